@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from disk_cache import DiskCache
+
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get('FIG2PDF_ANALYSIS_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+# Finished analyses kept in memory, for repeated requests about the same upload.
+ANALYSIS_MEMO_SECONDS = float(os.environ.get('FIG2PDF_ANALYSIS_MEMO_SECONDS', 300))
+ANALYSIS_MEMO_SIZE = 32
+
+
+class PageHistogramCache(DiskCache):
+    """
+    On-disk store of per-page color histograms (packed RGB keys + counts),
+    keyed by pdf_color_analyzer.page_cache_key. A revised export only has its
+    changed pages analyzed again. Entries are evicted least recently used
+    first once the store grows past `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + '.npz')
+
+    def get(self, key):
+        """Returns (keys, counts) or None."""
+        if not self.enabled:
+            return None
+        import numpy as np  # only needed once an analysis runs, see app.HEAVY_MODULES
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = data['keys'], data['counts']
+            os.utime(path)  # LRU bookkeeping
+        except (OSError, ValueError, KeyError):
+            # Missing, evicted meanwhile, or a damaged file.
+            self._count("misses")
+            return None
+        self._count("hits")
+        return arrays
+
+    def put(self, key, keys, counts):
+        if not self.enabled:
+            return
+        import numpy as np
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f'.tmp-{uuid.uuid4()}.npz')
+        try:
+            np.savez(tmp_path, keys=keys, counts=counts)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._stored(size)
+
+
+class RecentAnalyses:
+    """
+    Thread-safe, in-memory LRU of finished analysis results (the last
+    snapshot of iter_color_analysis), each kept for `ttl` seconds. Answers a
+    repeated analysis of the same PDF without opening it; a ttl of 0
+    disables it.
+    """
+
+    def __init__(self, ttl=ANALYSIS_MEMO_SECONDS, maxsize=ANALYSIS_MEMO_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] < now:
+                del self._items[key]
+                item = None
+            self._counters["hits" if item is not None else "misses"] += 1
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key, snapshot):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, snapshot)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._items)}
@@ -1,29 +1,75 @@
 import os
 import json
+import base64
 import datetime
 import shutil
-from flask import Flask, request, render_template, send_from_directory, jsonify
+import subprocess
+import time
+from flask import Flask, Response, g, request, render_template, send_file, send_from_directory, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from process_pdf import process_pdf_files
-from pdf_color_analyzer import extract_unique_colors
+from werkzeug.exceptions import RequestEntityTooLarge
+from color_mapping import load_color_mapping, load_color_mapping_file, invalidate_color_mapping_file
+from jobs import JobQueue, QueueFullError
+from result_cache import ResultCache
+from previews import PreviewCache, PreviewError, PREVIEW_DPI, PREVIEW_MAX_DPI
+from analysis_cache import PageHistogramCache, RecentAnalyses
+from uploads import (save_upload, extract_pdf_zip, unique_path, dedup_upload, write_upload_info, find_upload,
+                     upload_file_path, link_upload, UploadError, MAX_UPLOAD_BYTES, MAX_MAPPING_BYTES)
+from storage_gc import UploadReaper, purge_trash
+from database import BatchWriter, configure_sqlite, database_uri, engine_options
+import metrics
+from metrics import observe_job, run_profiled, PROFILER
 import uuid
 from flask_sqlalchemy import SQLAlchemy
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Range / ETag headers must be readable by cross-origin PDF viewers
+CORS(app, resources={r"/*": {"origins": "*"}},
+     expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "ETag", "X-Changed-Ratio"])
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+DEFAULT_MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_color_mapping.json')
+INITIAL_MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'initial_default_color_mapping.json')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Werkzeug rejects larger request bodies up front and spools file parts to disk
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + MAX_MAPPING_BYTES
 
 # Database Configuration
 db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'project.db')
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+app.config["SQLALCHEMY_DATABASE_URI"] = database_uri(f"sqlite:///{db_path}")
+# Pool sizing for server databases; WAL + busy timeout for SQLite (see database.py)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 db = SQLAlchemy(app)
 
-with app.app_context():
-    db.create_all()
+# Modules that pull in pikepdf / numpy / Pillow. Routes import them when
+# first needed, so the web process starts without them; warm_up() loads them
+# up front in gunicorn's master (see gunicorn.conf.py), and job worker
+# processes are forked from a server that has them loaded already.
+HEAVY_MODULES = ('process_pdf', 'pdf_color_analyzer', 'batch')
+
+# Background job queue for /process (local process pool, see jobs.py)
+job_queue = JobQueue(on_finished=observe_job, preload=('process_pdf', 'batch'))
+JOB_EVENTS_INTERVAL = 0.5  # seconds between SSE state checks
+
+# Content-addressed cache of finished /process outputs
+result_cache = ResultCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'results'))
+# Per-page color histograms for /api/analyze-colors, keyed by page content hash
+analysis_cache = PageHistogramCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'analysis'))
+# Finished /api/analyze-colors results by (PDF sha256, max_pages), for a few minutes
+recent_analyses = RecentAnalyses()
+# Low-resolution page renders and before/after diff rasters (see previews.py)
+preview_cache = PreviewCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'previews'))
+# Files in an upload directory never change once written, so browsers may reuse them
+DOWNLOAD_MAX_AGE = int(os.environ.get('FIG2PDF_DOWNLOAD_MAX_AGE', 3600))
+
+# /api/history page size (default and upper bound)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
 
 class UploadHistory(db.Model):
+    # Serves the newest-first keyset pagination of /api/history
+    __table_args__ = (db.Index('ix_upload_history_timestamp_id', 'timestamp', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     upload_id = db.Column(db.String(36), unique=True, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.now)
@@ -42,10 +88,151 @@ class UploadHistory(db.Model):
             "final_pdf": self.final_pdf # Stored as filename
         }
 
-def _get_history_data():
-    """Helper function to get history data as a list of dicts from the database."""
-    history_records = UploadHistory.query.order_by(UploadHistory.timestamp.desc()).all()
-    return [record.to_dict() for record in history_records]
+# Tables must be created after the models are declared
+with app.app_context():
+    configure_sqlite(db.engine)
+    db.create_all()
+    # create_all() leaves existing tables alone, so add the index to older databases too
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_upload_history_timestamp_id ON upload_history (timestamp, id)'
+    ))
+    db.session.commit()
+
+def _write_history_rows(rows):
+    """Inserts a batch of UploadHistory rows in one transaction."""
+    with app.app_context():
+        start = time.perf_counter()
+        try:
+            db.session.execute(db.insert(UploadHistory), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage='db_commit')
+
+def _history_write_failed(rows, error):
+    app.logger.error("Dropped %d history rows after repeated write failures: %s", len(rows), error)
+    metrics.HISTORY_ROWS_DROPPED.inc(len(rows))
+
+history_writer = BatchWriter(_write_history_rows, on_error=_history_write_failed)
+
+def _active_upload_ids():
+    return {job.meta.get("upload_id") for job in job_queue.active()}
+
+def _forget_uploads(upload_ids):
+    """Drops the history rows of upload directories the reaper removed."""
+    with app.app_context():
+        for i in range(0, len(upload_ids), 500):
+            UploadHistory.query.filter(UploadHistory.upload_id.in_(upload_ids[i:i + 500])).delete(synchronize_session=False)
+        db.session.commit()
+
+# Removes expired / least recently used upload directories in the background (see storage_gc.py)
+upload_reaper = UploadReaper(app.config['UPLOAD_FOLDER'], on_removed=_forget_uploads, is_active=_active_upload_ids)
+
+@app.before_request
+def start_upload_reaper():
+    upload_reaper.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    if 'request_started' in g:
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - g.request_started,
+            endpoint=request.endpoint or 'unmatched', method=request.method, status=response.status_code,
+        )
+    return response
+
+def _encode_history_cursor(record):
+    raw = json.dumps([record.timestamp.isoformat(), record.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_history_cursor(cursor):
+    """(timestamp, id) of the last record of the previous page; raises ValueError if malformed."""
+    try:
+        timestamp, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.datetime.fromisoformat(timestamp), int(record_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"无效的分页游标: {e}")
+
+def _get_history_page(limit=HISTORY_PAGE_SIZE, cursor=None, filename=None, date_from=None, date_to=None):
+    """
+    One page of history, newest first. Pages are addressed by a cursor (the
+    position of the previous page's last record) rather than an offset, so
+    every page is an index range scan no matter how large the table is.
+    """
+    query = UploadHistory.query
+    if filename:
+        query = query.filter(UploadHistory.original_pdf.contains(filename, autoescape=True))
+    if date_from:
+        query = query.filter(UploadHistory.timestamp >= date_from)
+    if date_to:
+        query = query.filter(UploadHistory.timestamp < date_to + datetime.timedelta(days=1))
+    if cursor:
+        query = query.filter(db.tuple_(UploadHistory.timestamp, UploadHistory.id) < _decode_history_cursor(cursor))
+
+    records = query.order_by(UploadHistory.timestamp.desc(), UploadHistory.id.desc()).limit(limit + 1).all()
+    has_more = len(records) > limit
+    records = records[:limit]
+    return {
+        "items": [record.to_dict() for record in records],
+        "next_cursor": _encode_history_cursor(records[-1]) if has_more else None,
+    }
+
+def _record_processing_result(upload_id, pdf_filename, json_filename, processing_result):
+    """Saves a successful processing run to the history and builds the API payload."""
+    if not processing_result["success"]:
+        return {"success": False, "message": processing_result["message"],
+                "timings": processing_result.get("timings"), "counters": processing_result.get("counters"),
+                "profile_filename": processing_result.get("profile_filename")}
+
+    cmyk_pdf_filename = os.path.basename(processing_result["output_cmyk_pdf"]) if processing_result.get("output_cmyk_pdf") else None
+    final_pdf_filename = os.path.basename(processing_result["output_final_pdf"]) if processing_result.get("output_final_pdf") else None
+
+    # Queued for the batched history writer; the record is returned right away
+    row = {
+        "upload_id": upload_id,
+        "timestamp": datetime.datetime.now(),
+        "original_pdf": pdf_filename,
+        "json_mapping": json_filename,
+        "cmyk_pdf": cmyk_pdf_filename,
+        "final_pdf": final_pdf_filename,
+    }
+    history_writer.add(row)
+    record = UploadHistory(**row).to_dict()
+
+    return {
+        "success": True,
+        "message": processing_result["message"],
+        "upload_id": upload_id,
+        "cmyk_pdf_filename": cmyk_pdf_filename,
+        "final_pdf_filename": final_pdf_filename,
+        "intermediate": processing_result.get("intermediate"),
+        "timings": processing_result.get("timings"),
+        "counters": processing_result.get("counters"),
+        "profile_filename": processing_result.get("profile_filename"),
+        "record": record  # The new history entry; clients prepend it to their list
+    }
+
+def _save_pdf_upload(pdf_file, upload_dir):
+    """
+    Saves an uploaded PDF into upload_dir, sharing the bytes with earlier
+    uploads of the same file, and records it for later requests by upload_id.
+    Returns (pdf_path, info). Raises UploadError.
+    """
+    pdf_filename = secure_filename(pdf_file.filename)
+    pdf_path = os.path.join(upload_dir, pdf_filename)
+    size, sha256 = save_upload(pdf_file, pdf_path)
+    dedup_upload(pdf_path, sha256, app.config['UPLOAD_FOLDER'])
+    write_upload_info(upload_dir, pdf_filename, size, sha256)
+    return pdf_path, {"filename": pdf_filename, "size": size, "sha256": sha256}
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"success": False, "message": f"文件过大，最大允许 {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"}), 413
 
 # Serve Vue.js static files
 @app.route('/', defaults={'path': ''})
@@ -63,89 +250,335 @@ app.static_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'
 def process_files():
     """API endpoint for processing PDF files with AJAX"""
     try:
-        if 'pdf_file' not in request.files or 'json_file' not in request.files:
+        # The PDF is either uploaded again (pdf_file) or taken from an earlier
+        # /api/upload-pdf or /api/analyze-colors request (upload_id).
+        pdf_file = request.files.get('pdf_file')
+        json_file = request.files.get('json_file')
+        source_upload_id = request.form.get('upload_id')
+
+        if (not source_upload_id and (pdf_file is None or pdf_file.filename == '')) \
+                or json_file is None or json_file.filename == '':
             return jsonify({"success": False, "message": "请选择PDF文件和JSON文件"})
 
-        pdf_file = request.files['pdf_file']
-        json_file = request.files['json_file']
-
-        if pdf_file.filename == '' or json_file.filename == '':
-            return jsonify({"success": False, "message": "请选择PDF文件和JSON文件"})
+        if json_file:
+            source = None
+            if source_upload_id:
+                try:
+                    source = find_upload(app.config['UPLOAD_FOLDER'], source_upload_id)
+                except UploadError as e:
+                    return jsonify({"success": False, "message": str(e)}), e.status
+                upload_reaper.touch(source_upload_id)
 
-        if pdf_file and json_file:
+            # Every run gets its own directory (and history entry); a reused PDF is hard-linked into it
             upload_id = str(uuid.uuid4())
             upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
             os.makedirs(upload_dir, exist_ok=True)
 
-            pdf_filename = secure_filename(pdf_file.filename)
             json_filename = secure_filename(json_file.filename)
-
-            pdf_path = os.path.join(upload_dir, pdf_filename)
             json_path = os.path.join(upload_dir, json_filename)
 
-            pdf_file.save(pdf_path)
-            json_file.save(json_path)
+            try:
+                if source:
+                    source_path, pdf_info = source
+                    pdf_path = link_upload(source_path, upload_dir, pdf_info["filename"])
+                    write_upload_info(upload_dir, pdf_info["filename"], pdf_info["size"], pdf_info["sha256"])
+                else:
+                    pdf_path, pdf_info = _save_pdf_upload(pdf_file, upload_dir)
+                save_upload(json_file, json_path, max_bytes=MAX_MAPPING_BYTES, expect_pdf=False)
+            except UploadError as e:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+                return jsonify({"success": False, "message": str(e)}), e.status
+            pdf_filename = pdf_info["filename"]
+            pdf_sha256 = pdf_info["sha256"]
 
             convert_text_to_curves = request.form.get('convert_text', 'false').lower() == 'true'
-            processing_result = process_pdf_files(pdf_path, json_path, upload_dir, convert_text_to_curves=convert_text_to_curves)
-
-            if processing_result["success"]:
-                cmyk_pdf_filename = os.path.basename(processing_result["output_cmyk_pdf"]) if processing_result.get("output_cmyk_pdf") else None
-                final_pdf_filename = os.path.basename(processing_result["output_final_pdf"]) if processing_result.get("output_final_pdf") else None
-                
-                # Save to database
-                new_history_entry = UploadHistory(
-                    upload_id=upload_id,
-                    original_pdf=pdf_filename,
-                    json_mapping=json_filename,
-                    cmyk_pdf=cmyk_pdf_filename,
-                    final_pdf=final_pdf_filename
-                )
-                db.session.add(new_history_entry)
-                db.session.commit()
-
-                # Get updated history
-                updated_history = _get_history_data()
-
-                return jsonify({
+            from process_pdf import process_pdf_files, DEFAULT_TOLERANCE
+
+            # Identical (PDF, mapping, options) jobs are served from the result cache
+            cache_key = None
+            try:
+                mapping_hash = load_color_mapping(json_path).content_hash
+                cache_key = ResultCache.make_key(pdf_sha256, mapping_hash, convert_text_to_curves, DEFAULT_TOLERANCE)
+            except (json.JSONDecodeError, KeyError, TypeError):
+                pass  # Invalid mapping: let the job report the error
+
+            cached = result_cache.lookup(cache_key, upload_dir, os.path.splitext(pdf_filename)[0]) if cache_key else None
+            if cached:
+                result = _record_processing_result(upload_id, pdf_filename, json_filename, {
                     "success": True,
-                    "message": processing_result["message"],
-                    "upload_id": upload_id,
-                    "cmyk_pdf_filename": cmyk_pdf_filename,
-                    "final_pdf_filename": final_pdf_filename,
-                    "history": updated_history  # Return updated history
+                    "message": "已命中缓存：相同的PDF、颜色映射和选项已处理过，直接复用结果。",
+                    "output_cmyk_pdf": cached.get('cmyk.pdf'),
+                    "output_final_pdf": cached.get('final.pdf'),
                 })
-            else:
+                job = job_queue.add_completed(result, kind='process', meta={"upload_id": upload_id, "cached": True})
                 return jsonify({
-                    "success": False,
-                    "message": processing_result["message"]
+                    "success": True,
+                    "job_id": job.id,
+                    "upload_id": upload_id,
+                    "status": job.status,
+                    "cached": True
                 })
-    
+
+            def record_result(job, processing_result):
+                # Runs in the parent process once the worker has finished.
+                if processing_result["success"] and cache_key:
+                    result_cache.store(cache_key, {
+                        'cmyk.pdf': processing_result["output_cmyk_pdf"],
+                        'final.pdf': processing_result["output_final_pdf"],
+                    })
+                return _record_processing_result(upload_id, pdf_filename, json_filename, processing_result)
+
+            # Opt-in profiling (FIG2PDF_PROFILER); the profile lands next to the outputs
+            job_fn, job_args = process_pdf_files, (pdf_path, json_path, upload_dir)
+            if PROFILER and request.form.get('profile', 'false').lower() == 'true':
+                job_fn, job_args = run_profiled, (process_pdf_files, upload_dir) + job_args
+
+            try:
+                job = job_queue.submit(
+                    job_fn, *job_args,
+                    convert_text_to_curves=convert_text_to_curves,
+                    kind='process', meta={"upload_id": upload_id}, on_done=record_result,
+                )
+            except QueueFullError as e:
+                return jsonify({"success": False, "message": f"服务器繁忙，请稍后重试: {str(e)}"}), 503
+
+            return jsonify({
+                "success": True,
+                "job_id": job.id,
+                "upload_id": upload_id,
+                "status": job.status
+            }), 202
+
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({
             "success": False,
             "message": f"服务器错误: {str(e)}"
         })
 
+@app.route('/api/batch', methods=['POST'])
+def process_batch():
+    """批量转换：多个PDF（pdf_files）或一个ZIP压缩包（zip_file）使用同一个颜色映射（json_file）"""
+    pdf_files = [f for f in request.files.getlist('pdf_files') if f.filename]
+    zip_file = request.files.get('zip_file')
+    json_file = request.files.get('json_file')
+    if not json_file or not json_file.filename or not (pdf_files or (zip_file and zip_file.filename)):
+        return jsonify({"success": False, "message": "请选择多个PDF文件或一个ZIP压缩包，以及JSON文件"}), 400
+
+    upload_id = str(uuid.uuid4())
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
+    input_dir = os.path.join(upload_dir, 'input')
+    os.makedirs(input_dir, exist_ok=True)
+
+    try:
+        json_path = os.path.join(upload_dir, secure_filename(json_file.filename) or 'mapping.json')
+        save_upload(json_file, json_path, max_bytes=MAX_MAPPING_BYTES, expect_pdf=False)
+        load_color_mapping(json_path)
+
+        input_pdfs = []
+        for pdf_file in pdf_files:
+            pdf_path = unique_path(input_dir, secure_filename(pdf_file.filename) or 'upload.pdf')
+            save_upload(pdf_file, pdf_path)
+            input_pdfs.append(pdf_path)
+        if zip_file and zip_file.filename:
+            zip_path = os.path.join(upload_dir, 'upload.zip')
+            save_upload(zip_file, zip_path, expect_pdf=False)
+            input_pdfs.extend(extract_pdf_zip(zip_path, input_dir))
+            os.remove(zip_path)
+        if not input_pdfs:
+            raise UploadError("没有可转换的PDF文件")
+    except UploadError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({"success": False, "message": str(e)}), e.status
+    except (json.JSONDecodeError, KeyError, TypeError):
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({"success": False, "message": "无法解析颜色映射JSON文件"}), 400
+
+    convert_text_to_curves = request.form.get('convert_text', 'false').lower() == 'true'
+
+    from batch import run_batch_job, BATCH_WORKERS
+    # Up to job_queue.max_workers batches run at once, each with its own pool:
+    # give each one its share of the cores.
+    batch_workers = max(1, min(BATCH_WORKERS, (os.cpu_count() or 1) // job_queue.max_workers))
+
+    def add_upload_id(job, batch_result):
+        batch_result["upload_id"] = upload_id
+        return batch_result
+
+    try:
+        job = job_queue.submit(
+            run_batch_job, input_pdfs, json_path, os.path.join(upload_dir, 'output'),
+            os.path.join(upload_dir, f'batch_{upload_id[:8]}.zip'),
+            convert_text_to_curves=convert_text_to_curves, workers=batch_workers,
+            kind='batch', meta={"upload_id": upload_id, "files": len(input_pdfs)}, on_done=add_upload_id,
+        )
+    except QueueFullError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({"success": False, "message": f"服务器繁忙，请稍后重试: {str(e)}"}), 503
+
+    return jsonify({
+        "success": True,
+        "job_id": job.id,
+        "upload_id": upload_id,
+        "files": len(input_pdfs),
+        "status": job.status
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询后台任务的状态、阶段进度和结果"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在或已过期"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """以 Server-Sent Events 推送任务的日志行和进度，直到任务结束"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在或已过期"}), 404
+
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    # EventSource resends the last id it saw when it reconnects
+    try:
+        start_seq = int(request.headers.get('Last-Event-ID', 0) or 0)
+    except ValueError:
+        start_seq = 0
+
+    def generate():
+        last_seq = start_seq
+        last_state = None
+        while True:
+            done = job.logs_complete  # read before draining logs so none are missed
+            for seq, line in job.logs_since(last_seq):
+                last_seq = seq
+                yield f"id: {seq}\n" + sse('log', line)
+            state = (job.status, job.stage, json.dumps(job.progress, sort_keys=True))
+            if state != last_state:
+                last_state = state
+                yield sse('progress', {k: v for k, v in job.to_dict().items() if k != 'result'})
+            if done:
+                yield sse('done', job.to_dict())
+                return
+            time.sleep(JOB_EVENTS_INTERVAL)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # disable proxy buffering (nginx)
+    })
+
+@app.route('/api/jobs', methods=['GET'])
+def get_job_stats():
+    """任务队列概况"""
+    return jsonify(job_queue.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """结果缓存与颜色分析页缓存的命中率与占用空间"""
+    return jsonify({**result_cache.stats(), "analysis": analysis_cache.stats(),
+                    "recent_analyses": recent_analyses.stats(), "previews": preview_cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的运行指标"""
+    job_counts = job_queue.stats()["jobs"]
+    for status in ('queued', 'running', 'succeeded', 'failed'):
+        metrics.QUEUE_JOBS.set(job_counts.get(status, 0), status=status)
+    upload_stats = upload_reaper.stats()
+    for name, stats in (('results', result_cache.stats()), ('analysis', analysis_cache.stats()),
+                        ('uploads', upload_stats)):
+        metrics.STORE_BYTES.set(stats["bytes"], store=name)
+        metrics.STORE_ENTRIES.set(stats["entries"], store=name)
+    metrics.UPLOAD_RECLAIMED_BYTES.set(upload_stats["bytes_reclaimed"])
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/storage/stats', methods=['GET'])
+def get_storage_stats():
+    """上传目录的占用空间与清理统计"""
+    return jsonify(upload_reaper.stats())
+
 @app.route('/download/<upload_id>/<filename>')
 def download_file(upload_id, filename):
     """Download endpoint for processed files"""
-    return send_from_directory(os.path.join(app.config['UPLOAD_FOLDER'], upload_id), filename, as_attachment=True)
+    upload_reaper.touch(upload_id)
+    # Conditional: answers Range requests (206) and If-None-Match / If-Modified-Since (304)
+    return send_from_directory(os.path.join(app.config['UPLOAD_FOLDER'], upload_id), filename, as_attachment=True,
+                               conditional=True, etag=True, max_age=DOWNLOAD_MAX_AGE)
+
+def _preview_dpi():
+    """Resolution requested with ?dpi=, clamped to PREVIEW_MAX_DPI; raises ValueError."""
+    dpi = int(request.args.get('dpi') or PREVIEW_DPI)
+    if dpi <= 0:
+        raise ValueError(dpi)
+    return min(dpi, PREVIEW_MAX_DPI)
+
+def _send_preview(key, png_path):
+    # The key is derived from the file contents, so it is a strong ETag
+    return send_file(png_path, mimetype='image/png', etag=key, conditional=True, max_age=DOWNLOAD_MAX_AGE)
+
+@app.route('/api/preview/<upload_id>/<filename>', methods=['GET'])
+def preview_info(upload_id, filename):
+    """上传目录中某个PDF的页数与各页尺寸（点），供预览按页懒加载"""
+    try:
+        pdf_path = upload_file_path(app.config['UPLOAD_FOLDER'], upload_id, filename)
+        pages = preview_cache.pages(pdf_path)
+    except (UploadError, PreviewError) as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    upload_reaper.touch(upload_id)
+    return jsonify({"success": True, "page_count": len(pages), "pages": pages, "dpi": PREVIEW_DPI})
+
+@app.route('/api/preview/<upload_id>/<filename>/<int:page>.png', methods=['GET'])
+def preview_page(upload_id, filename, page):
+    """单页低分辨率预览图（首次请求时由 Ghostscript 渲染并缓存）"""
+    try:
+        dpi = _preview_dpi()
+        pdf_path = upload_file_path(app.config['UPLOAD_FOLDER'], upload_id, filename)
+        key, png_path = preview_cache.page(pdf_path, page, dpi)
+    except ValueError:
+        return jsonify({"success": False, "message": "dpi 必须是正整数"}), 400
+    except (UploadError, PreviewError) as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    upload_reaper.touch(upload_id)
+    return _send_preview(key, png_path)
+
+@app.route('/api/preview/<upload_id>/<filename>/<int:page>/diff.png', methods=['GET'])
+def preview_diff(upload_id, filename, page):
+    """
+    单页颜色差异图：原始PDF（或 ?against= 指定的文件）与 filename 的差异，
+    变化的像素标红；变化像素占比见响应头 X-Changed-Ratio
+    """
+    try:
+        dpi = _preview_dpi()
+        after_pdf = upload_file_path(app.config['UPLOAD_FOLDER'], upload_id, filename)
+        against = request.args.get('against')
+        if against:
+            before_pdf = upload_file_path(app.config['UPLOAD_FOLDER'], upload_id, against)
+        else:
+            before_pdf, _ = find_upload(app.config['UPLOAD_FOLDER'], upload_id)
+        key, png_path, changed_ratio = preview_cache.diff(before_pdf, after_pdf, page, dpi)
+    except ValueError:
+        return jsonify({"success": False, "message": "dpi 必须是正整数"}), 400
+    except (UploadError, PreviewError) as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    upload_reaper.touch(upload_id)
+    response = _send_preview(key, png_path)
+    response.headers['X-Changed-Ratio'] = f'{changed_ratio:.6f}'
+    return response
 
 @app.route('/api/color-mapping', methods=['GET'])
 def get_color_mapping():
     """获取默认颜色映射"""
     try:
-        # Try to open the default mapping first
-        with open('default_color_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        # Try to open the default mapping first (served from the compiled mapping cache)
+        return jsonify(load_color_mapping_file(DEFAULT_MAPPING_PATH).data)
     except FileNotFoundError:
         # If it doesn't exist, try to load the initial one
         try:
-            with open('initial_default_color_mapping.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return jsonify(data)
+            return jsonify(load_color_mapping_file(INITIAL_MAPPING_PATH).data)
         except Exception as e:
             print(f"FATAL: Could not read initial_default_color_mapping.json. {e}")
             return jsonify({"error": str(e)}), 500
@@ -159,8 +592,9 @@ def save_color_mapping():
     """保存颜色映射到默认文件"""
     try:
         data = request.get_json()
-        with open('default_color_mapping.json', 'w', encoding='utf-8') as f:
+        with open(DEFAULT_MAPPING_PATH, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        invalidate_color_mapping_file(DEFAULT_MAPPING_PATH)
         return jsonify({"success": True, "message": "颜色映射已保存"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -169,51 +603,92 @@ def save_color_mapping():
 def get_original_color_mapping():
     """获取原始默认颜色映射"""
     try:
-        with open('initial_default_color_mapping.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_color_mapping_file(INITIAL_MAPPING_PATH).data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/analyze-colors', methods=['POST'])
 def analyze_colors_endpoint():
-    """Analyzes the dominant colors in an uploaded PDF file."""
-    if 'pdf_file' not in request.files:
+    """
+    Analyzes the dominant colors of a PDF: an uploaded pdf_file, or the
+    upload_id of an earlier upload. The response carries the upload_id, which
+    /process accepts instead of the file.
+    """
+    source_upload_id = request.form.get('upload_id')
+    pdf_file = request.files.get('pdf_file')
+    if not source_upload_id and pdf_file is None:
         return jsonify({"success": False, "message": "No PDF file provided."}), 400
-
-    pdf_file = request.files['pdf_file']
-    if pdf_file.filename == '':
+    if not source_upload_id and pdf_file.filename == '':
         return jsonify({"success": False, "message": "No selected file."}), 400
 
-    if pdf_file:
+    try:
+        max_pages = int(request.form.get('max_pages') or 0) or None
+    except ValueError:
+        return jsonify({"success": False, "message": "max_pages 必须是整数"}), 400
+    stream = request.form.get('stream', 'false').lower() == 'true'
+
+    if source_upload_id:
+        try:
+            pdf_path, pdf_info = find_upload(app.config['UPLOAD_FOLDER'], source_upload_id)
+        except UploadError as e:
+            return jsonify({"success": False, "message": str(e)}), e.status
+        upload_id = str(uuid.UUID(source_upload_id))
+        upload_reaper.touch(upload_id)
+    else:
         upload_id = str(uuid.uuid4())
         upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
         os.makedirs(upload_dir, exist_ok=True)
+        try:
+            pdf_path, pdf_info = _save_pdf_upload(pdf_file, upload_dir)
+        except UploadError as e:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return jsonify({"success": False, "message": str(e)}), e.status
 
-        pdf_filename = secure_filename(pdf_file.filename)
-        pdf_path = os.path.join(upload_dir, pdf_filename)
-        pdf_file.save(pdf_path)
+    # The upload directory is removed by upload_reaper once it expires.
 
-        try:
-            # Perform the color analysis
-            unique_colors = extract_unique_colors(pdf_path)
-            
-            # The temporary file and directory will be cleaned up later by other processes
-            # or a dedicated cleanup service. For now, we leave it.
+    memo_key = (pdf_info["sha256"], max_pages)
+    final = recent_analyses.get(memo_key)
+    if final is not None:
+        snapshots = iter([final])
+    else:
+        from pdf_color_analyzer import iter_color_analysis
+
+        def snapshots_and_remember():
+            for snapshot in iter_color_analysis(pdf_path, max_pages=max_pages, cache=analysis_cache):
+                if snapshot["done"]:
+                    recent_analyses.put(memo_key, snapshot)
+                yield snapshot
+        snapshots = snapshots_and_remember()
+
+    if stream:
+        # One JSON object per line (NDJSON) for each partial result, the last has "done": true
+        def generate():
+            try:
+                for snapshot in snapshots:
+                    yield json.dumps({"success": True, "upload_id": upload_id, **snapshot}) + "\n"
+            except Exception as e:
+                print(f"[ERROR] in color analysis for {pdf_path}: {e}")
+                yield json.dumps({"success": False, "message": f"An error occurred during color analysis: {str(e)}"}) + "\n"
+
+        return Response(generate(), mimetype='application/x-ndjson', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
 
-            return jsonify({
-                "success": True,
-                "colors": unique_colors
-            })
-        except Exception as e:
-            # Log the exception for debugging
-            print(f"[ERROR] in color analysis for {pdf_path}: {e}")
-            return jsonify({
-                "success": False,
-                "message": f"An error occurred during color analysis: {str(e)}"
-            }), 500
-    
-    return jsonify({"success": False, "message": "Invalid file."}), 400
+    try:
+        # Perform the color analysis
+        snapshot = None
+        for snapshot in snapshots:
+            pass
+
+        return jsonify({"success": True, "upload_id": upload_id, **snapshot})
+    except Exception as e:
+        # Log the exception for debugging
+        print(f"[ERROR] in color analysis for {pdf_path}: {e}")
+        return jsonify({
+            "success": False,
+            "message": f"An error occurred during color analysis: {str(e)}"
+        }), 500
 
 @app.route('/api/upload-pdf', methods=['POST'])
 def upload_pdf():
@@ -230,17 +705,24 @@ def upload_pdf():
         upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
         os.makedirs(upload_dir, exist_ok=True)
 
-        pdf_filename = secure_filename(pdf_file.filename)
-        pdf_path = os.path.join(upload_dir, pdf_filename)
-        pdf_file.save(pdf_path)
+        try:
+            pdf_path, pdf_info = _save_pdf_upload(pdf_file, upload_dir)
+        except UploadError as e:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return jsonify({"success": False, "message": str(e)}), e.status
 
+        # /api/analyze-colors and /process accept this upload_id instead of the file
         return jsonify({
             "success": True,
             "upload_id": upload_id,
-            "filename": pdf_filename,
-            "file_path": pdf_path
+            "filename": pdf_info["filename"],
+            "file_path": pdf_path,
+            "size": pdf_info["size"],
+            "sha256": pdf_info["sha256"]
         })
 
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({
             "success": False,
@@ -249,32 +731,76 @@ def upload_pdf():
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """获取处理历史记录"""
-    return jsonify(_get_history_data())
+    """获取处理历史记录（按时间倒序分页）
+
+    参数: limit, cursor（上一页返回的 next_cursor）, q（按原始PDF文件名筛选）,
+    date_from / date_to（YYYY-MM-DD，含当天）
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        page = _get_history_page(
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            filename=request.args.get('q'),
+            date_from=datetime.datetime.strptime(date_from, '%Y-%m-%d') if date_from else None,
+            date_to=datetime.datetime.strptime(date_to, '%Y-%m-%d') if date_to else None,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify(page)
 
 @app.route('/api/clear-history', methods=['POST'])
 def clear_history():
-    """清空所有上传和处理的历史记录"""
-    uploads_dir = app.config['UPLOAD_FOLDER']
+    """清空所有上传和处理的历史记录（文件在后台删除）"""
     try:
-        # Clear file system uploads
-        for item in os.listdir(uploads_dir):
-            item_path = os.path.join(uploads_dir, item)
-            if os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-            elif os.path.isfile(item_path):
-                os.remove(item_path)
-        
-        os.makedirs(uploads_dir, exist_ok=True)
-
-        # Clear database history
-        db.session.query(UploadHistory).delete()
-        db.session.commit()
-
-        return jsonify({"success": True, "message": "历史记录已清空"})
+        # Uploads of running jobs stay; everything else is moved aside at once
+        trash_dir = upload_reaper.discard_all(keep=_active_upload_ids())
+
+        # Clear database history, including rows still queued for writing; no
+        # batch may be committed between the flush and the delete
+        with history_writer.flushed():
+            db.session.query(UploadHistory).delete()
+            db.session.commit()
     except Exception as e:
         return jsonify({"success": False, "message": f"清空历史记录失败: {str(e)}"})
 
+    def record_reclaimed(job, purge_result):
+        upload_reaper.record_reclaimed(purge_result["removed"], purge_result["bytes_reclaimed"])
+        return purge_result
+
+    try:
+        job = job_queue.submit(purge_trash, trash_dir, kind='cleanup', on_done=record_reclaimed)
+    except QueueFullError:
+        # upload_reaper deletes leftover trash on a later pass
+        return jsonify({"success": True, "message": "历史记录已清空，文件稍后删除"}), 202
+    return jsonify({"success": True, "message": "历史记录已清空，文件正在后台删除", "job_id": job.id}), 202
+
+def warm_up():
+    """
+    Pays the first request's one-time costs at boot: imports HEAVY_MODULES,
+    loads the default color mapping and looks up Ghostscript. gunicorn.conf.py
+    calls it in the master, before the workers are forked.
+    """
+    for module in HEAVY_MODULES:
+        __import__(module)
+    try:
+        load_color_mapping_file(DEFAULT_MAPPING_PATH)
+    except Exception as e:
+        print(f"Error reading default_color_mapping.json. {e}")
+
+    gs_command = shutil.which('gs')
+    if not gs_command:
+        print("Warning: Ghostscript ('gs') not found in PATH; /process will only produce the CMYK PDF.")
+        return
+    try:
+        version = subprocess.run([gs_command, '--version'], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Warning: Ghostscript at {gs_command} does not run: {e}")
+        return
+    print(f"Found Ghostscript {version} at {gs_command}")
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
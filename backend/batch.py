@@ -0,0 +1,247 @@
+"""
+Batch conversion: many PDFs against one color mapping.
+
+    python batch.py mapping.json a.pdf b.pdf artwork/ campaign.zip -o out --zip out.zip
+
+Inputs may be PDF files, directories (their *.pdf files) or zip archives.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pikepdf
+from color_mapping import load_color_mapping
+from process_pdf import process_pdf_files, DEFAULT_TOLERANCE
+from uploads import extract_pdf_zip
+
+BATCH_WORKERS = int(os.environ.get('FIG2PDF_BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_REPORT_NAME = 'report.json'
+
+
+def _init_batch_worker(color_mapping_path, tolerance):
+    # Compile the mapping and build its index once per worker; every file
+    # then hits the in-process mapping cache.
+    load_color_mapping(color_mapping_path).index(tolerance)
+
+
+def _page_count(pdf_path):
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        return None
+
+
+def _process_file(input_pdf, color_mapping_path, output_dir, tolerance, convert_text_to_curves):
+    """Converts one file of a batch (in a pool worker) and times it."""
+    start = time.perf_counter()
+    try:
+        # Files, not pages, are spread over the cores, so each file runs serially.
+        result = process_pdf_files(input_pdf, color_mapping_path, output_dir, tolerance,
+                                   convert_text_to_curves, page_workers=1)
+    except Exception as e:
+        result = {"success": False, "message": f"Unexpected error: {e}"}
+    return {
+        "input": input_pdf,
+        "success": result["success"],
+        "seconds": round(time.perf_counter() - start, 3),
+        "pages": _page_count(input_pdf),
+        "bytes": os.path.getsize(input_pdf),
+        "output_cmyk_pdf": result.get("output_cmyk_pdf"),
+        "output_final_pdf": result.get("output_final_pdf"),
+        # Last lines only; per-file logs can be long.
+        "message": "\n".join(result["message"].splitlines()[-5:]),
+    }
+
+
+def _output_dirs(input_pdfs, output_dir):
+    """One output directory per input; files whose names collide get a subdirectory each."""
+    seen = set()
+    dirs = []
+    for n, path in enumerate(input_pdfs):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        dirs.append(output_dir if stem not in seen else os.path.join(output_dir, f'{stem}_{n}'))
+        seen.add(stem)
+    return dirs
+
+
+def run_batch(input_pdfs, color_mapping_path, output_dir, tolerance=DEFAULT_TOLERANCE,
+              convert_text_to_curves=False, workers=BATCH_WORKERS, progress=None, log=None):
+    """
+    Converts every PDF in input_pdfs with the same color mapping.
+
+    Files are spread over `workers` processes, largest first so one big file
+    does not finish last on its own. The mapping is validated once here and
+    compiled once per worker. `progress('batch', done, total)` and
+    `log(line)` report each finished file.
+
+    Returns {"success", "files": [per-file result, in input order], "summary"},
+    where the summary holds totals and throughput.
+    """
+    if progress is None:
+        progress = lambda stage, current=None, total=None: None
+    if log is None:
+        log = lambda line: None
+
+    load_color_mapping(color_mapping_path)  # fail fast on a bad mapping
+    os.makedirs(output_dir, exist_ok=True)
+
+    total = len(input_pdfs)
+    jobs = list(zip(input_pdfs, _output_dirs(input_pdfs, output_dir)))
+    order = sorted(range(total), key=lambda n: os.path.getsize(input_pdfs[n]), reverse=True)
+    workers = max(1, min(workers, total))
+    results = [None] * total
+
+    def finished(n, result):
+        results[n] = result
+        done = sum(1 for r in results if r is not None)
+        status = "ok" if result["success"] else "FAILED"
+        log(f"[{done}/{total}] {os.path.basename(result['input'])}: {status} in {result['seconds']:.2f} s")
+        progress('batch', done, total)
+
+    start = time.perf_counter()
+    progress('batch', 0, total)
+    if workers == 1:
+        _init_batch_worker(color_mapping_path, tolerance)
+        for n in order:
+            finished(n, _process_file(jobs[n][0], color_mapping_path, jobs[n][1], tolerance, convert_text_to_curves))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_batch_worker,
+                                 initargs=(color_mapping_path, tolerance)) as pool:
+            futures = {
+                pool.submit(_process_file, jobs[n][0], color_mapping_path, jobs[n][1], tolerance,
+                            convert_text_to_curves): n
+                for n in order
+            }
+            for future in as_completed(futures):
+                finished(futures[future], future.result())
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(1 for r in results if r["success"])
+    pages = sum(r["pages"] or 0 for r in results)
+    size = sum(r["bytes"] for r in results)
+    summary = {
+        "files": total,
+        "succeeded": succeeded,
+        "failed": total - succeeded,
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "files_per_minute": round(total / elapsed * 60, 2) if elapsed else None,
+        "pages_per_second": round(pages / elapsed, 2) if elapsed else None,
+        "mb_per_second": round(size / 1024 ** 2 / elapsed, 2) if elapsed else None,
+    }
+    return {"success": succeeded == total, "files": results, "summary": summary}
+
+
+def write_batch_zip(batch_result, zip_path):
+    """
+    Writes every file's print PDF (or the CMYK PDF if Ghostscript failed for
+    it) plus report.json with the per-file timings into zip_path.
+    """
+    names = set()
+    with zipfile.ZipFile(zip_path, 'w') as archive:
+        for result in batch_result["files"]:
+            output = result["output_final_pdf"] or result["output_cmyk_pdf"]
+            if not output or not os.path.exists(output):
+                continue
+            name = os.path.basename(output)
+            if name in names:
+                name = os.path.relpath(output, os.path.dirname(os.path.dirname(output)))
+            names.add(name)
+            # PDF streams are already compressed; storing them saves CPU for ~no size cost.
+            archive.write(output, name, compress_type=zipfile.ZIP_STORED)
+        report = {
+            "summary": batch_result["summary"],
+            "files": [
+                {**{k: v for k, v in r.items() if not k.startswith('output_')},
+                 "input": os.path.basename(r["input"])}
+                for r in batch_result["files"]
+            ],
+        }
+        archive.writestr(BATCH_REPORT_NAME, json.dumps(report, ensure_ascii=False, indent=2),
+                         compress_type=zipfile.ZIP_DEFLATED)
+
+
+def run_batch_job(input_pdfs, color_mapping_path, output_dir, zip_path, tolerance=DEFAULT_TOLERANCE,
+                  convert_text_to_curves=False, workers=BATCH_WORKERS, progress=None, log=None):
+    """Job queue entry point for /api/batch: runs the batch and packs the outputs."""
+    result = run_batch(input_pdfs, color_mapping_path, output_dir, tolerance, convert_text_to_curves,
+                       workers=workers, progress=progress, log=log)
+    write_batch_zip(result, zip_path)
+    result["zip_filename"] = os.path.basename(zip_path)
+    # The job still succeeds with some failed files; the report says which.
+    result["success"] = result["summary"]["succeeded"] > 0
+    result["message"] = (f"{result['summary']['succeeded']}/{result['summary']['files']} 个文件转换成功，"
+                         f"用时 {result['summary']['seconds']:.1f} 秒")
+    for r in result["files"]:
+        r["input"] = os.path.basename(r["input"])
+        for key in ("output_cmyk_pdf", "output_final_pdf"):
+            r[key] = os.path.relpath(r[key], output_dir) if r[key] else None
+    return result
+
+
+def _collect_inputs(paths, scratch_dir):
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                 if name.lower().endswith('.pdf')))
+        elif zipfile.is_zipfile(path):
+            dest = tempfile.mkdtemp(dir=scratch_dir)
+            inputs.extend(extract_pdf_zip(path, dest))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert many PDFs with one RGB -> CMYK color mapping.")
+    parser.add_argument('color_mapping', help='color mapping JSON')
+    parser.add_argument('inputs', nargs='+', help='PDF files, directories of PDFs or zip archives')
+    parser.add_argument('-o', '--output-dir', default='batch_output')
+    parser.add_argument('--zip', help='also pack the outputs and report.json into this zip file')
+    parser.add_argument('-j', '--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--convert-text', action='store_true', help='convert text to curves')
+    args = parser.parse_args()
+    missing = [path for path in args.inputs if not os.path.exists(path)]
+    if missing:
+        parser.error(f"not found: {', '.join(missing)}")
+
+    scratch_dir = tempfile.mkdtemp(prefix='fig2pdf-batch-')
+    try:
+        inputs = _collect_inputs(args.inputs, scratch_dir)
+        if not inputs:
+            print("No PDF files found.")
+            sys.exit(1)
+        result = run_batch(inputs, args.color_mapping, args.output_dir, args.tolerance, args.convert_text,
+                           workers=args.workers, log=print)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    print()
+    for r in result["files"]:
+        pages = r["pages"] if r["pages"] is not None else '?'
+        print(f"{'ok  ' if r['success'] else 'FAIL'} {r['seconds']:8.2f} s {pages:>5} pages  {r['input']}")
+        if not r["success"]:
+            print("       " + r["message"].replace("\n", "\n       "))
+    s = result["summary"]
+    print(f"\n{s['succeeded']}/{s['files']} files in {s['seconds']:.2f} s with {s['workers']} workers: "
+          f"{s['files_per_minute']} files/min, {s['pages_per_second']} pages/s, {s['mb_per_second']} MB/s")
+
+    if args.zip:
+        write_batch_zip(result, args.zip)
+        print(f"Wrote {args.zip}")
+    sys.exit(0 if result["success"] else 1)
+
+
+if __name__ == '__main__':
+    main()
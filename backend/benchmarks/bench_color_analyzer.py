@@ -0,0 +1,122 @@
+"""
+Benchmark: extract_unique_colors (NumPy histogram) vs. the previous
+tuple + collections.Counter implementation on synthetic image-heavy PDFs.
+Checks that both return the same colors, counts and order.
+
+Usage: python benchmarks/bench_color_analyzer.py [--pages 20] [--images 6] [--quality 75 300]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pikepdf
+from PIL import Image
+from pdf_color_analyzer import extract_unique_colors
+
+
+def legacy_extract_unique_colors(pdf_path, limit=256, quality=75):
+    """The per-pixel tuple + Counter implementation this benchmark replaces."""
+    all_colors = []
+    with pikepdf.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            try:
+                for operands, operator in pikepdf.parse_content_stream(page):
+                    if str(operator) in ('rg', 'sc', 'scn') and len(operands) >= 3:
+                        all_colors.append(tuple(int(c * 255) for c in operands[:3]))
+            except Exception:
+                continue
+            for image_obj in page.images.values():
+                try:
+                    pil_image = Image.open(io.BytesIO(image_obj.read_raw_bytes()))
+                    if pil_image.mode != 'RGB':
+                        pil_image = pil_image.convert('RGB')
+                    pil_image.thumbnail((quality, quality))
+                    all_colors.extend(map(tuple, np.array(pil_image).reshape(-1, 3)))
+                except Exception:
+                    continue
+    return [(tuple(int(c) for c in rgb), count) for rgb, count in Counter(all_colors).most_common(limit)]
+
+
+def build_pdf(path, pages, images_per_page, size, rng):
+    pdf = pikepdf.new()
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    palette = np_rng.integers(0, 256, size=(16, 3), dtype=np.uint8)
+    for _ in range(pages):
+        pdf.add_blank_page()
+        page = pdf.pages[-1]
+        xobjects = {}
+        lines = []
+        for i in range(images_per_page):
+            # Flat swatches from a shared palette plus noise, like scanned artwork.
+            cells = palette[np_rng.integers(0, len(palette), size=(size // 32, size // 32))]
+            pixels = np.kron(cells, np.ones((32, 32, 1), dtype=np.uint8))
+            noise = np_rng.integers(-3, 4, size=pixels.shape)
+            pixels = np.clip(pixels.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(pixels, 'RGB').save(buffer, format='JPEG', quality=90)
+            image = pdf.make_stream(buffer.getvalue())
+            image.Type = pikepdf.Name.XObject
+            image.Subtype = pikepdf.Name.Image
+            image.Width, image.Height = pixels.shape[1], pixels.shape[0]
+            image.ColorSpace = pikepdf.Name.DeviceRGB
+            image.BitsPerComponent = 8
+            image.Filter = pikepdf.Name.DCTDecode
+            xobjects[f'/Im{i}'] = image
+            lines.append(f"q 100 0 0 100 {i * 90} 100 cm /Im{i} Do Q")
+        for _ in range(200):
+            lines.append(f"{rng.random():.3f} {rng.random():.3f} {rng.random():.3f} rg 10 10 5 5 re f")
+        page.obj.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(xobjects))
+        page.obj.Contents = pdf.make_stream("\n".join(lines).encode())
+    pdf.save(path)
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--images', type=int, default=6, help='images per page')
+    parser.add_argument('--size', type=int, default=1024, help='image width/height in pixels')
+    parser.add_argument('--quality', type=int, nargs='+', default=[75, 300],
+                        help='thumbnail sizes to compare (the analyzer default is 75)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_pdf = os.path.join(tmp, 'bench.pdf')
+        build_pdf(input_pdf, args.pages, args.images, args.size, random.Random(args.seed))
+        print(f"pages={args.pages} images/page={args.images} size={args.size}px "
+              f"file={os.path.getsize(input_pdf) / 1024 ** 2:.1f} MiB")
+
+        for quality in args.quality:
+            old, old_time, old_peak = measure(lambda: legacy_extract_unique_colors(input_pdf, quality=quality))
+            new, new_time, new_peak = measure(lambda: extract_unique_colors(input_pdf, quality=quality))
+            same = [(c["rgb"], c["count"]) for c in new] == old
+            print(f"quality={quality:<4} counter {old_time:6.2f} s {old_peak / 1024 ** 2:7.1f} MiB   "
+                  f"numpy {new_time:6.2f} s {new_peak / 1024 ** 2:7.1f} MiB   "
+                  f"x{old_time / new_time:4.1f}   results {'identical' if same else 'DIFFERENT'}")
+
+            sampled, sampled_time, _ = measure(lambda: extract_unique_colors(
+                input_pdf, quality=quality, max_image_pixels=quality * quality // 4, bucket_bits=5))
+            print(f"             sampled 1/4 + 5-bit buckets {sampled_time:6.2f} s, {len(sampled)} colors")
+
+
+if __name__ == '__main__':
+    main()
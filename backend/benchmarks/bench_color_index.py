@@ -0,0 +1,80 @@
+"""
+Micro-benchmark: linear RGB -> CMYK scan vs. ColorIndex lookups.
+
+Usage: python benchmarks/bench_color_index.py [--swatches 500] [--operators 50000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from color_index import ColorIndex, linear_lookup
+
+
+def build_palette(size, rng):
+    palette = {}
+    while len(palette) < size:
+        rgb = tuple(rng.randrange(256) / 255.0 for _ in range(3))
+        palette[rgb] = tuple(rng.randrange(101) / 100.0 for _ in range(4))
+    return palette
+
+
+def build_operands(palette, count, hit_ratio, rng):
+    swatches = list(palette)
+    operands = []
+    for _ in range(count):
+        if rng.random() < hit_ratio:
+            r, g, b = rng.choice(swatches)
+            # Figma exports round to 4-6 digits, so hits are near, not exact.
+            operands.append((round(r, 4), round(g, 4), round(b, 4)))
+        else:
+            operands.append(tuple(round(rng.random(), 4) for _ in range(3)))
+    return operands
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--swatches', type=int, default=500)
+    parser.add_argument('--operators', type=int, default=50000)
+    parser.add_argument('--hit-ratio', type=float, default=0.8)
+    parser.add_argument('--tolerance', type=float, default=0.002)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    palette = build_palette(args.swatches, rng)
+    operands = build_operands(palette, args.operators, args.hit_ratio, rng)
+
+    start = time.perf_counter()
+    linear_results = [linear_lookup(palette, r, g, b, args.tolerance) for r, g, b in operands]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = ColorIndex(palette, args.tolerance)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index_results = [index.lookup(r, g, b) for r, g, b in operands]
+    index_time = time.perf_counter() - start
+
+    match = index.matcher()
+    start = time.perf_counter()
+    memo_results = [match(r, g, b) for r, g, b in operands]
+    memo_time = time.perf_counter() - start
+
+    if linear_results != index_results or linear_results != memo_results:
+        print("MISMATCH: index results differ from the linear scan")
+        sys.exit(1)
+
+    print(f"swatches={args.swatches} operators={args.operators} tolerance={args.tolerance}")
+    print(f"linear scan:      {linear_time * 1000:9.1f} ms")
+    print(f"index build:      {build_time * 1000:9.1f} ms")
+    print(f"index lookup:     {index_time * 1000:9.1f} ms  ({linear_time / index_time:.1f}x)")
+    print(f"index + memo:     {memo_time * 1000:9.1f} ms  ({linear_time / memo_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
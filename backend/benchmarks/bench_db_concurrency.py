@@ -0,0 +1,119 @@
+"""
+Load test: several processes sharing one SQLite history database (e.g. app
+instances and CLI runs on one host; gunicorn.conf.py itself runs a single web
+worker, see FIG2PDF_WEB_WORKERS). Each records processing results, reads the first history
+page and now and then bulk-deletes rows like /api/clear-history. Runs once
+with the previous settings (rollback journal, sqlite3's default 5 s lock
+wait, one commit per result) and once with the defaults (WAL, busy timeout,
+batched writes), counting "database is locked" errors.
+
+Usage: python benchmarks/bench_db_concurrency.py [--workers 8] [--ops 300]
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = {
+    'previous': {"FIG2PDF_SQLITE_WAL": '0', "FIG2PDF_SQLITE_BUSY_TIMEOUT": '5',
+                 "FIG2PDF_HISTORY_FLUSH_INTERVAL": '0'},
+    'tuned': {},
+}
+
+
+def _import_app(database_url, env):
+    # No upload cleanup thread: the app's upload folder is not part of the test.
+    os.environ.update(env, DATABASE_URL=database_url, FIG2PDF_GC_INTERVAL='0')
+    sys.path.insert(0, BACKEND_DIR)
+    import app as web
+    return web
+
+
+def _worker(database_url, env, ops, n, start_at, results):
+    errors = {"locked": 0, "other": 0}
+    latencies = []
+    try:
+        web = _import_app(database_url, env)
+    except Exception as e:
+        errors["locked" if 'locked' in str(e) else "other"] += 1
+        results.put((n, errors, latencies, 0))
+        return
+    client = web.app.test_client()
+    while time.time() < start_at:
+        time.sleep(0.001)
+
+    writes = 0
+    for op in range(ops):
+        begin = time.perf_counter()
+        try:
+            if op % 10 == 9:
+                response = client.get('/api/history')
+                if response.status_code != 200:
+                    raise RuntimeError(response.get_data(as_text=True))
+            elif op % 50 == 49 and n == 0:
+                with web.app.app_context(), web.history_writer.flushed():
+                    web.db.session.query(web.UploadHistory).delete()
+                    web.db.session.commit()
+            else:
+                web._record_processing_result(str(uuid.uuid4()), 'artwork.pdf', 'mapping.json', {
+                    "success": True, "message": "", "output_final_pdf": 'artwork_modern_print.pdf',
+                })
+                writes += 1
+        except Exception as e:
+            errors["locked" if 'locked' in str(e) else "other"] += 1
+            with web.app.app_context():
+                web.db.session.rollback()
+        latencies.append(time.perf_counter() - begin)
+    web.history_writer.flush()
+    results.put((n, errors, latencies, writes))
+
+
+def run(label, env, workers, ops):
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+    ctx = multiprocessing.get_context('spawn')
+    # Create the schema once, outside the measured part.
+    setup = ctx.Process(target=_import_app, args=(database_url, env))
+    setup.start()
+    setup.join()
+
+    results = ctx.Queue()
+    start_at = time.time() + 3  # let every worker import the app first
+    processes = [ctx.Process(target=_worker, args=(database_url, env, ops, n, start_at, results))
+                 for n in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.time() - start_at
+
+    locked = sum(errors["locked"] for _, errors, _, _ in collected)
+    other = sum(errors["other"] for _, errors, _, _ in collected)
+    latencies = sorted(latency for _, _, worker_latencies, _ in collected for latency in worker_latencies)
+    writes = sum(w for _, _, _, w in collected)
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    print(f"{label:<10} {locked:>7} {other:>6} {writes / elapsed:>9.0f} "
+          f"{statistics.median(latencies) * 1000 if latencies else 0:>9.2f} {p99 * 1000:>9.2f}")
+    return locked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=300, help='operations per worker')
+    args = parser.parse_args()
+
+    print(f"{args.workers} processes x {args.ops} operations")
+    print(f"{'settings':<10} {'locked':>7} {'other':>6} {'writes/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for label, env in SETTINGS.items():
+        run(label, env, args.workers, args.ops)
+
+
+if __name__ == '__main__':
+    main()
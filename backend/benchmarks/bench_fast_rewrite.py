@@ -0,0 +1,230 @@
+"""
+Benchmark: the byte-level fast path (fast_rewrite_content) against the
+pikepdf tokenizing rewriter (rewrite_content_stream).
+
+First checks equivalence: hand-written edge cases plus --fuzz random streams
+(strings and comments containing "rg", inline images, names, arrays, odd
+number syntax, 4-operand scn...). For every stream the fast path either
+declines (and pikepdf handles it) or returns bytes that parse to the same
+instructions as the pikepdf output. Then reports operators per second and
+peak Python allocations (tracemalloc) of both on Figma-like streams.
+
+With --check only the equivalence checks run; the exit status is 1 on any
+difference, so it can gate changes to the fast path.
+
+Usage: python benchmarks/bench_fast_rewrite.py [--ops 20000] [--fuzz 2000] [--check]
+"""
+import argparse
+import decimal
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import pikepdf
+from color_mapping import load_color_mapping
+from corpus import _color_ops, build_palette
+from process_pdf import fast_rewrite_content, rewrite_content_stream
+
+PALETTE = [(1.0, 0.0, 0.0), (0.2, 0.4, 0.6), (0.0, 0.0, 0.0), (1.0, 1.0, 1.0)]
+
+# (name, stream, fast path expected to handle it)
+EDGE_CASES = [
+    ('plain rg', b'1 0 0 rg 0 0 10 10 re f', True),
+    ('sc and scn', b'/CS0 cs 0.2 0.4 0.6 sc /CS0 CS 1 0 0 scn', True),
+    ('no match', b'0.5 0.5 0.5 rg 0 0 1 1 re f', True),
+    ('number syntax', b'+1 .0 0. rg .2 +.4 0.60 sc', True),
+    ('string with rg', b'BT /F1 12 Tf (1 0 0 rg) Tj ET 1 0 0 rg', True),
+    ('nested string', b'BT (a (1 0 0 rg) \\) 0 0 0 rg) Tj ET 0 0 0 rg', True),
+    ('escaped parenthesis', b'BT (\\(1 0 0 rg) Tj ET', True),
+    ('hex string', b'BT <3120302030207267> Tj ET 1 1 1 rg', True),
+    ('comment with rg', b'% 1 0 0 rg\n0 0 0 rg', True),
+    ('comment inside operands', b'1 0 % red\n0 rg', True),
+    ('TJ array', b'BT [(rg) 120 (sc)] TJ ET 1 0 0 rg', True),
+    ('marked content dict', b'/Span <</ActualText (1 0 0 rg)>> BDC 1 0 0 rg EMC', True),
+    ('pattern name', b'/Pattern cs /P0 scn 0 0 5 5 re f', True),
+    ('numbers and pattern', b'1 0 0 /P0 scn', True),
+    ('4 operands', b'/CS1 cs 0.2 0.4 0.6 0.1 scn', True),
+    ('2 operands', b'0.5 1 sc', True),
+    ('stream start and end', b'1 0 0 rg', True),
+    ('glued operators', b'q 1 0 0 rg\r\n0.2 0.4 0.6 sc Q', True),
+    ('exponent-like token', b'1e2 0 0 rg', False),
+    ('inline image', b'BI /W 1 /H 1 /CS /RGB /BPC 8 ID \x01rg\x02 EI 1 0 0 rg', False),
+    ('name among first three', b'/A 0 0 rg', False),
+    ('keyword among first three', b'true 0 0 rg', False),
+    ('array operand', b'[1 0 0] rg', False),
+    ('string operand', b'(x) 1 0 0 rg', False),
+]
+
+
+def _normalize(instructions):
+    """Instructions with numbers compared by value, everything else by its serialized form."""
+    normalized = []
+    for instruction in instructions:
+        if isinstance(instruction, pikepdf.ContentStreamInlineImage):
+            normalized.append(('INLINE IMAGE', bytes(instruction.iimage.read_raw_bytes())))
+            continue
+        operands, operator = instruction
+        normalized.append((str(operator), tuple(
+            round(float(o), 6) if isinstance(o, (int, decimal.Decimal)) and not isinstance(o, bool) else repr(o)
+            for o in operands
+        )))
+    return normalized
+
+
+def check(pdf, data, match_color):
+    """
+    'fast' when the fast path handled `data` like pikepdf does, 'declined' when it
+    left it to pikepdf; raises AssertionError on any difference.
+    """
+    fast = fast_rewrite_content(data, match_color)
+    try:
+        slow = rewrite_content_stream(pdf.make_stream(data), match_color)
+    except Exception:
+        assert fast is None, 'fast path accepted a stream pikepdf rejects'
+        return 'declined'
+    if fast is None:
+        return 'declined'
+    assert fast[1] == slow[1], f'replacements: fast {fast[1]}, pikepdf {slow[1]}'
+    fast_out = fast[0] if fast[0] is not None else data
+    slow_out = slow[0] if slow[0] is not None else data
+    expected = _normalize(pikepdf.parse_content_stream(pdf.make_stream(slow_out)))
+    actual = _normalize(pikepdf.parse_content_stream(pdf.make_stream(fast_out)))
+    assert actual == expected, 'different instructions'
+    return 'fast'
+
+
+def _random_number(rng, palette):
+    if rng.random() < 0.4:
+        return f'{rng.choice(palette)[rng.randrange(3)]:.4f}'
+    return rng.choice(['0', '1', '.5', '-.25', '+1', '3.', '0.50', '12', '1e2', '0.333333'])
+
+
+def random_stream(rng, palette):
+    """A stream of random, mostly valid, content stream syntax around color operators."""
+    parts = []
+    for _ in range(rng.randrange(1, 30)):
+        kind = rng.random()
+        if kind < 0.35:
+            numbers = ' '.join(_random_number(rng, palette) for _ in range(rng.choice([1, 2, 3, 3, 3, 4])))
+            parts.append(f'{numbers} {rng.choice(["rg", "sc", "scn", "RG", "SC"])}')
+        elif kind < 0.45:
+            text = rng.choice(['1 0 0 rg', 'a (b) c', 'x \\) 0 sc', '\\\\'])
+            parts.append(f'BT /F1 9 Tf ({text}) Tj ET')
+        elif kind < 0.5:
+            parts.append(f'% {rng.choice(["1 0 0 rg", "note", "(unbalanced"])}\n')
+        elif kind < 0.55:
+            parts.append(f'/P{rng.randrange(3)} scn')
+        elif kind < 0.6:
+            parts.append('BT [(rg) -250 <0102>] TJ ET')
+        elif kind < 0.63:
+            parts.append('/Span <</ActualText (0 0 1 rg)>> BDC EMC')
+        elif kind < 0.65:
+            parts.append('BI /W 1 /H 1 /CS /G /BPC 8 ID \x80 EI')
+        else:
+            parts.append(rng.choice(['q', 'Q', '0 0 10 10 re f', '1 0 0 1 5 5 cm', 'h', '2 w']))
+    separators = [' ', '\n', '\r\n', '  ']
+    return ''.join(part + rng.choice(separators) for part in parts).encode('latin-1')
+
+
+def check_equivalence(pdf, match_color, rng, palette, fuzz):
+    """Runs EDGE_CASES and `fuzz` random streams through check(); returns the number of failures."""
+    failures = 0
+    for name, data, handled in EDGE_CASES:
+        try:
+            outcome = check(pdf, data, match_color)
+            if (outcome == 'fast') != handled:
+                outcome += ' (unexpected)'
+                failures += 1
+        except AssertionError as e:
+            outcome = f'MISMATCH: {e}'
+            failures += 1
+        print(f"  {name:<26} {outcome}")
+
+    outcomes = {"fast": 0, "declined": 0}
+    fuzz_failures = 0
+    for n in range(fuzz):
+        data = random_stream(rng, palette)
+        try:
+            outcomes[check(pdf, data, match_color)] += 1
+        except AssertionError as e:
+            fuzz_failures += 1
+            if fuzz_failures <= 5:
+                print(f"  fuzz #{n} MISMATCH ({e}): {data!r}")
+    print(f"fuzz: {fuzz} streams, {outcomes['fast']} via the fast path, "
+          f"{outcomes['declined']} left to pikepdf")
+    return failures + fuzz_failures
+
+
+def measure(fn, repeat):
+    """Best wall time of `repeat` calls, and the peak traced allocation of one call."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--ops', type=int, default=20000, help='color operators in the benchmark stream')
+    parser.add_argument('--fuzz', type=int, default=2000, help='random streams checked for equivalence')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help='only check equivalence (exit status 1 on failure)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    palette = PALETTE + build_palette(60, rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        mapping_path = os.path.join(tmp, 'mapping.json')
+        with open(mapping_path, 'w') as f:
+            json.dump({"mappings": [
+                {"rgb_255": [round(c * 255) for c in rgb], "cmyk_100": [(7 * n) % 100, 50, 0, 10]}
+                for n, rgb in enumerate(palette)
+            ]}, f)
+        match_color = load_color_mapping(mapping_path).index(0.002).matcher()
+
+    pdf = pikepdf.new()
+    failures = check_equivalence(pdf, match_color, rng, palette, args.fuzz)
+    if failures:
+        print(f"{failures} equivalence failure(s)")
+        sys.exit(1)
+    print("All equivalent.")
+    if args.check:
+        return
+    print()
+
+    streams = {
+        'vectors': "\n".join(_color_ops(args.ops, palette, rng)).encode(),
+        'vectors + text': "\n".join(
+            line + f"\nBT /F1 9 Tf 10 {i % 700} Td (Label {i} (rg)) Tj ET"
+            for i, line in enumerate(_color_ops(args.ops, palette, rng))
+        ).encode(),
+    }
+    print(f"{'stream':<16} {'path':<8} {'ops':>8} {'ms':>9} {'Mops/s':>8} {'peak KiB':>9} {'replaced':>9}")
+    for label, data in streams.items():
+        stream = pdf.make_stream(data)
+        operators = len(pikepdf.parse_content_stream(stream))
+        for path, fn in (('pikepdf', lambda: rewrite_content_stream(stream, match_color)),
+                         ('fast', lambda: fast_rewrite_content(data, match_color))):
+            seconds, peak = measure(fn, args.repeat)
+            replaced = fn()[1]
+            print(f"{label:<16} {path:<8} {operators:>8} {seconds * 1000:9.1f} "
+                  f"{operators / seconds / 1e6:8.2f} {peak / 1024:9.0f} {replaced:>9}")
+
+
+if __name__ == '__main__':
+    main()
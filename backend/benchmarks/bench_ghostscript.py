@@ -0,0 +1,91 @@
+"""
+Benchmark: per-job Ghostscript latency, cold `gs` process vs. pooled interpreter.
+
+Usage: python benchmarks/bench_ghostscript.py [--jobs 10] [--gs /usr/bin/gs]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pikepdf
+from gs_runner import GhostscriptPool, run_ghostscript_cold
+
+GS_OPTIONS = ['-sDEVICE=pdfwrite', '-dUseCIEColor=false']
+
+
+def build_pdf(path, pages, ops_per_page):
+    pdf = pikepdf.new()
+    for p in range(pages):
+        lines = [f"{(i % 97) / 97:.4f} 0.2 0.6 rg {i % 500} {(i * 7) % 700} 20 20 re f" for i in range(ops_per_page)]
+        lines.append(f"0 0 0 k BT /F1 24 Tf 72 720 Td (Page {p + 1}) Tj ET")
+        pdf.add_blank_page()
+        page = pdf.pages[-1]
+        page.obj.Contents = pdf.make_stream("\n".join(lines).encode())
+        page.obj.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(
+            F1=pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica)
+        ))
+    pdf.save(path)
+
+
+def summarize(label, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    print(f"  {label:<8} mean {statistics.mean(timings) * 1000:8.1f} ms   "
+          f"p50 {statistics.median(timings) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=10)
+    parser.add_argument('--gs', default=shutil.which('gs'))
+    args = parser.parse_args()
+
+    if not args.gs:
+        print("Ghostscript ('gs') not found; pass --gs /path/to/gs")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        job_dir = os.path.join(tmp, 'job')
+        os.makedirs(job_dir)
+        corpus = {'small': (1, 50), 'large': (100, 2000)}
+        pool = GhostscriptPool(size=1, max_jobs=args.jobs + 1)
+        try:
+            for name, (pages, ops) in corpus.items():
+                input_pdf = os.path.join(job_dir, f'{name}.pdf')
+                output_pdf = os.path.join(job_dir, f'{name}_out.pdf')
+                build_pdf(input_pdf, pages, ops)
+                print(f"{name}: {pages} pages, {ops} ops/page, {os.path.getsize(input_pdf) / 1024:.0f} KiB")
+
+                cold = []
+                for _ in range(args.jobs):
+                    start = time.perf_counter()
+                    run_ghostscript_cold(args.gs, GS_OPTIONS, input_pdf, output_pdf, allowed_dir=tmp)
+                    cold.append(time.perf_counter() - start)
+
+                # The first pooled job pays interpreter start-up; report it separately.
+                start = time.perf_counter()
+                pool.run(args.gs, GS_OPTIONS, input_pdf, output_pdf)
+                first = time.perf_counter() - start
+
+                pooled = []
+                for _ in range(args.jobs):
+                    start = time.perf_counter()
+                    pool.run(args.gs, GS_OPTIONS, input_pdf, output_pdf)
+                    pooled.append(time.perf_counter() - start)
+
+                summarize('cold', cold)
+                summarize('pooled', pooled)
+                print(f"  first pooled job (includes start-up): {first * 1000:.1f} ms")
+                pool.close()
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
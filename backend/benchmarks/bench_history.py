@@ -0,0 +1,89 @@
+"""
+Benchmark: /api/history on a large table (default 100k rows) in a throwaway
+SQLite database. Compares the previous "load every row" query with the
+paginated endpoint: first page, a deep page reached by cursor, and
+filename / date filters. Reports latency and response size.
+
+Usage: python benchmarks/bench_history.py [--rows 100000] [--repeat 20]
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'history.db')}"
+    os.environ['FIG2PDF_GC_INTERVAL'] = '0'  # leave the real upload folder alone
+    import app as web  # picks up DATABASE_URL
+
+    client = web.app.test_client()
+    with web.app.app_context():
+        start = datetime.datetime(2024, 1, 1)
+        rows = [{
+            "upload_id": f"{n:036d}",
+            "timestamp": start + datetime.timedelta(minutes=n),
+            "original_pdf": f"campaign_{n % 977}_page.pdf",
+            "json_mapping": "color-mapping.json",
+            "cmyk_pdf": f"campaign_{n % 977}_page_cmyk.pdf",
+            "final_pdf": f"campaign_{n % 977}_page_modern_print.pdf",
+        } for n in range(args.rows)]
+        web.db.session.execute(web.db.insert(web.UploadHistory), rows)
+        web.db.session.commit()
+        print(f"{args.rows:,} rows")
+
+        plan = web.db.session.execute(web.db.text(
+            "EXPLAIN QUERY PLAN SELECT * FROM upload_history WHERE (timestamp, id) < (:ts, :id) "
+            "ORDER BY timestamp DESC, id DESC LIMIT 51"
+        ), {"ts": "2024-06-01 00:00:00.000000", "id": 1}).fetchall()
+        print("keyset query plan: " + "; ".join(row[-1] for row in plan))
+
+        def legacy():
+            records = web.UploadHistory.query.order_by(web.UploadHistory.timestamp.desc()).all()
+            return [record.to_dict() for record in records]
+
+        records, legacy_time = timed(legacy, max(1, args.repeat // 10))
+        import json
+        print(f"\n{'all rows (previous)':<28} {legacy_time * 1000:9.2f} ms {len(json.dumps(records)) / 1024:10.1f} KiB")
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, response.json
+        return response
+
+    cases = [('first page', '/api/history')]
+    page = get('/api/history?limit=200').json
+    for _ in range(args.rows // 400):  # walk halfway down the table
+        page = get(f"/api/history?limit=200&cursor={page['next_cursor']}").json
+    cases.append(('page at 50% (cursor)', f"/api/history?cursor={page['next_cursor']}"))
+    cases.append(('filename filter', '/api/history?q=campaign_42_'))
+    cases.append(('date range', '/api/history?date_from=2024-01-02&date_to=2024-01-02'))
+
+    for label, url in cases:
+        response, elapsed = timed(lambda: get(url), args.repeat)
+        print(f"{label:<28} {elapsed * 1000:9.2f} ms {len(response.data) / 1024:10.1f} KiB  "
+              f"({len(response.json['items'])} items)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: step 1 of process_pdf_files (color rewriting + save) with a growing
+number of page workers. Verifies every run produces the same bytes as the
+serial path and reports pages per second.
+
+Usage: python benchmarks/bench_page_workers.py [--pages 200] [--workers 1 2 4]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pikepdf
+from process_pdf import process_pdf_files
+
+
+def build_pdf(path, pages, ops_per_page, palette, rng):
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        lines = []
+        for _ in range(ops_per_page):
+            r, g, b = rng.choice(palette) if rng.random() < 0.5 else (rng.random(), rng.random(), rng.random())
+            x, y = rng.randrange(500), rng.randrange(700)
+            lines.append(f"{r:.4f} {g:.4f} {b:.4f} rg {x} {y} 20 20 re f")
+        pdf.add_blank_page()
+        pdf.pages[-1].obj.Contents = pdf.make_stream("\n".join(lines).encode())
+    pdf.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--ops', type=int, default=400, help='color operators per page')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    palette = [(rng.randrange(256) / 255.0, rng.randrange(256) / 255.0, rng.randrange(256) / 255.0) for _ in range(100)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_pdf = os.path.join(tmp, 'bench.pdf')
+        mapping_path = os.path.join(tmp, 'mapping.json')
+        build_pdf(input_pdf, args.pages, args.ops, palette, rng)
+        with open(mapping_path, 'w') as f:
+            json.dump({"mappings": [
+                {"rgb_255": [round(c * 255) for c in rgb], "cmyk_100": [10, 20, 30, 40]} for rgb in palette
+            ]}, f)
+
+        print(f"pages={args.pages} ops/page={args.ops}")
+        reference = None
+        for workers in args.workers:
+            output_dir = os.path.join(tmp, f'out_{workers}')
+            start = time.perf_counter()
+            result = process_pdf_files(input_pdf, mapping_path, output_dir, page_workers=workers)
+            elapsed = time.perf_counter() - start
+            if not result.get("output_cmyk_pdf"):
+                print(result["message"])
+                sys.exit(1)
+            with open(result["output_cmyk_pdf"], 'rb') as f:
+                # qpdf regenerates the second /ID element on every save; ignore it.
+                digest = hashlib.sha256(re.sub(rb'/ID \[<[0-9a-f]*><[0-9a-f]*>\]', b'', f.read())).hexdigest()
+            reference = reference or digest
+            same = "identical" if digest == reference else "DIFFERENT"
+            print(f"workers={workers:<3} {elapsed:7.2f} s  {args.pages / elapsed:8.1f} pages/s  output {same}")
+
+
+if __name__ == '__main__':
+    main()
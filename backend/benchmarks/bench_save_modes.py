@@ -0,0 +1,99 @@
+"""
+Benchmark: intermediate CMYK PDF save modes (default / compact / linearized)
+written to disk or kept in memory (memfd) for Ghostscript. Reports bytes
+written, save time, Ghostscript time and end-to-end wall time per mode.
+
+Usage: python benchmarks/bench_save_modes.py [--pages 50] [--images 2] [--runs 3]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pikepdf
+from PIL import Image
+from process_pdf import process_pdf_files, SAVE_OPTIONS
+
+COLORS = [(0.2, 0.4, 0.6), (0.8, 0.1, 0.1), (0.1, 0.7, 0.3)]
+
+
+def build_pdf(path, pages, images_per_page, seed):
+    """Pages with mapped vector colors and JPEG artwork, like a Figma export."""
+    rng = np.random.default_rng(seed)
+    pdf = pikepdf.new()
+    for p in range(pages):
+        pdf.add_blank_page()
+        page = pdf.pages[-1]
+        xobjects = {}
+        lines = []
+        for i in range(images_per_page):
+            pixels = rng.integers(0, 256, size=(64, 64, 3), dtype=np.uint8).repeat(8, axis=0).repeat(8, axis=1)
+            buffer = io.BytesIO()
+            Image.fromarray(pixels, 'RGB').save(buffer, format='JPEG', quality=85)
+            image = pdf.make_stream(buffer.getvalue())
+            image.Type, image.Subtype = pikepdf.Name.XObject, pikepdf.Name.Image
+            image.Width, image.Height = pixels.shape[1], pixels.shape[0]
+            image.ColorSpace, image.BitsPerComponent = pikepdf.Name.DeviceRGB, 8
+            image.Filter = pikepdf.Name.DCTDecode
+            xobjects[f'/Im{i}'] = image
+            lines.append(f"q 200 0 0 200 {i * 210} 400 cm /Im{i} Do Q")
+        for n in range(300):
+            r, g, b = COLORS[n % len(COLORS)]
+            lines.append(f"{r} {g} {b} rg {n % 500} {(n * 7) % 380} 12 12 re f")
+        page.obj.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(xobjects))
+        page.obj.Contents = pdf.make_stream("\n".join(lines).encode())
+    pdf.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--images', type=int, default=2, help='JPEG images per page')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    if not shutil.which('gs'):
+        print("Ghostscript ('gs') not found: only save times are meaningful, memory mode falls back to disk.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_pdf = os.path.join(tmp, 'bench.pdf')
+        mapping_path = os.path.join(tmp, 'mapping.json')
+        build_pdf(input_pdf, args.pages, args.images, seed=0)
+        with open(mapping_path, 'w') as f:
+            json.dump({"mappings": [
+                {"rgb_255": [round(c * 255) for c in rgb], "cmyk_100": [10, 20, 30, 40]} for rgb in COLORS
+            ]}, f)
+        print(f"input: {args.pages} pages, {os.path.getsize(input_pdf) / 1024 ** 2:.1f} MiB\n")
+        print(f"{'mode':<11} {'storage':<7} {'bytes':>12} {'save s':>8} {'gs s':>8} {'wall s':>8}")
+
+        for save_mode in SAVE_OPTIONS:
+            for intermediate in ('file', 'memory'):
+                saves, gs_times, walls = [], [], []
+                info = None
+                for run in range(args.runs):
+                    output_dir = os.path.join(tmp, f'{save_mode}_{intermediate}_{run}')
+                    start = time.perf_counter()
+                    result = process_pdf_files(input_pdf, mapping_path, output_dir,
+                                               save_mode=save_mode, intermediate=intermediate)
+                    walls.append(time.perf_counter() - start)
+                    if not result.get("intermediate"):
+                        print(result["message"])
+                        sys.exit(1)
+                    info = result["intermediate"]
+                    saves.append(result["timings"].get("save", 0))
+                    gs_times.append(result["timings"].get("ghostscript", 0))
+                    shutil.rmtree(output_dir)
+                print(f"{save_mode:<11} {info['storage']:<7} {info['bytes']:>12,} {statistics.median(saves):8.3f} "
+                      f"{statistics.median(gs_times):8.3f} {statistics.median(walls):8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Benchmark: startup time and memory of the web and job worker processes.
+
+1. Importing the app in a fresh interpreter (time, peak RSS, heavy modules
+   loaded), with and without app.warm_up(), next to the sklearn import the
+   app no longer pays for.
+2. gunicorn started plainly (every worker imports the app on its own, heavy
+   modules on first use) and with gunicorn.conf.py (app preloaded and warmed
+   up in the master, workers forked from it): time until the first response,
+   latency of the first color analysis, and RSS / PSS / USS of each process
+   after every worker has served analyses. PSS splits shared pages between
+   the processes using them, so the PSS total is the real footprint.
+3. Job worker pools started with 'spawn' and with 'forkserver' preloading
+   the conversion modules: time until every worker has run a job, and the
+   memory of each worker.
+
+Usage: python benchmarks/bench_startup.py [--workers 2] [--repeat 3]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from jobs import JobQueue
+
+HEAVY = ('pikepdf', 'numpy', 'PIL', 'sklearn', 'process_pdf', 'pdf_color_analyzer')
+
+IMPORT_CASES = {
+    'import app': 'import app',
+    'import app; warm_up()': 'import app; app.warm_up()',
+    'sklearn.cluster (removed)': 'import sklearn.cluster',
+}
+
+IMPORT_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+print(json.dumps([time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def _env(database_url):
+    # No upload cleanup thread: the app's upload folder is not part of the test.
+    return dict(os.environ, DATABASE_URL=database_url, FIG2PDF_GC_INTERVAL='0')
+
+
+def process_memory(pid):
+    """RSS, PSS and USS (private pages) of `pid` in MiB, from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    uss = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return fields.get('Rss', 0), fields.get('Pss', 0), uss
+
+
+def _children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _print_memory(rows):
+    print(f"    {'process':<22} {'RSS MiB':>8} {'PSS MiB':>8} {'USS MiB':>8}")
+    total = 0
+    for label, pid in rows:
+        rss, pss, uss = process_memory(pid)
+        total += pss
+        print(f"    {label:<22} {rss:8.1f} {pss:8.1f} {uss:8.1f}")
+    print(f"    {'total PSS':<22} {'':>8} {total:8.1f}")
+
+
+def bench_imports(database_url, repeat):
+    print(f"{'import':<28} {'seconds':>8} {'peak RSS MiB':>13}  heavy modules loaded")
+    for label, code in IMPORT_CASES.items():
+        best = None
+        for _ in range(repeat):
+            probe = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(code=code, heavy=HEAVY)],
+                                   cwd=BACKEND_DIR, env=_env(database_url), capture_output=True, text=True)
+            if probe.returncode != 0:
+                break
+            result = json.loads(probe.stdout.strip().splitlines()[-1])
+            best = result if best is None or result[0] < best[0] else best
+        if best is None:
+            print(f"{label:<28} {'-':>8} {'-':>13}  (not importable here)")
+            continue
+        seconds, maxrss_kib, loaded = best
+        print(f"{label:<28} {seconds:8.2f} {maxrss_kib / 1024:13.0f}  {', '.join(loaded) or '-'}")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _post_pdf(url, path):
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        data = f.read()
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="pdf_file"; '
+            f'filename="{os.path.basename(path)}"\r\nContent-Type: application/pdf\r\n\r\n').encode()
+    body += data + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(url, data=body,
+                                     headers={"Content-Type": f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return json.load(response)
+
+
+def bench_gunicorn(label, args, workers, database_url, pdf_path):
+    port = _free_port()
+    base = f'http://127.0.0.1:{port}'
+    command = [sys.executable, '-m', 'gunicorn', *args, '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               'app:app']
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=_env(database_url),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    upload_ids = []
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f'{base}/api/color-mapping', timeout=1):
+                    break
+            except OSError:
+                if server.poll() is not None or time.perf_counter() - started > 60:
+                    raise RuntimeError(f'{label}: gunicorn did not start')
+                time.sleep(0.02)
+        ready = time.perf_counter() - started
+
+        start = time.perf_counter()
+        upload_ids.append(_post_pdf(f'{base}/api/analyze-colors', pdf_path).get("upload_id"))
+        first = time.perf_counter() - start
+        # Enough concurrent analyses for every worker to serve some
+        with ThreadPoolExecutor(workers * 2) as pool:
+            upload_ids.extend(result.get("upload_id") for result in pool.map(
+                lambda _: _post_pdf(f'{base}/api/analyze-colors', pdf_path), range(workers * 6)))
+
+        print(f"  {label}: ready after {ready:.2f} s, first analysis {first * 1000:.0f} ms")
+        _print_memory([('master', server.pid)] + [(f'worker {n}', pid)
+                                                  for n, pid in enumerate(_children(server.pid))])
+    finally:
+        server.terminate()
+        server.wait()
+        for upload_id in filter(None, upload_ids):
+            shutil.rmtree(os.path.join(BACKEND_DIR, 'uploads', upload_id), ignore_errors=True)
+
+
+def _probe_job(progress=None, log=None):
+    import batch, process_pdf  # what unpickling a real job function imports
+    time.sleep(0.3)  # keep the worker busy so every job lands on its own worker
+    return {"success": True, "pid": os.getpid()}
+
+
+def bench_job_pool(start_method, workers):
+    queue = JobQueue(max_workers=workers, executor='process', start_method=start_method,
+                     preload=('process_pdf', 'batch'))
+    start = time.perf_counter()
+    jobs = [queue.submit(_probe_job) for _ in range(workers)]
+    while not all(job.done for job in jobs):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start - 0.3
+    failed = [job.error for job in jobs if job.status != 'succeeded']
+    if failed:
+        raise RuntimeError(f'{start_method}: {failed[0]}')
+
+    print(f"  {start_method}: {workers} workers ready after {elapsed:.2f} s")
+    rows = [(f'worker {n}', job.result["pid"]) for n, job in enumerate(jobs)]
+    if start_method == 'forkserver':
+        from multiprocessing import forkserver
+        rows.insert(0, ('forkserver', forkserver._forkserver._forkserver_pid))
+    _print_memory(rows)
+    queue.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers and job workers')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per import measurement (best is shown)')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        database_url = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        bench_imports(database_url, args.repeat)
+
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from corpus import CORPUS, build_pdf
+        pdf_path = os.path.join(tmp, 'light.pdf')
+        build_pdf(pdf_path, CORPUS['light'])
+
+        print(f"\ngunicorn, {args.workers} workers")
+        bench_gunicorn('plain', ['-c', os.devnull], args.workers, database_url, pdf_path)
+        bench_gunicorn('gunicorn.conf.py', ['-c', 'gunicorn.conf.py'], args.workers, database_url, pdf_path)
+
+        print(f"\njob worker pool, {args.workers} workers")
+        for start_method in ('spawn', 'forkserver'):
+            if start_method in multiprocessing.get_all_start_methods():
+                bench_job_pool(start_method, args.workers)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
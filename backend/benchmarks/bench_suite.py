@@ -0,0 +1,203 @@
+"""
+Benchmark suite: process_pdf_files and extract_unique_colors over the
+synthetic corpus in corpus.py. Each (document, workload) pair runs in a
+fresh process: one warm-up run, then --repeat timed runs. Records latency
+percentiles, throughput, peak RSS and (for conversions) per-step timings to
+JSON, and compares them with a saved baseline.
+
+Usage:
+    python benchmarks/bench_suite.py --save-baseline benchmarks/baseline.json
+    # ... change code ...
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json
+
+Exits with status 1 when a p50 latency or peak RSS grows by more than
+--threshold relative to the baseline.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from corpus import CORPUS, build_pdf, write_mapping
+
+WORKLOADS = ('process', 'analyze')
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (values need not be sorted)."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def _measure(workload, pdf_path, mapping_path, work_dir, repeat):
+    """Runs in a fresh spawned process so peak RSS belongs to this workload alone."""
+    sys.path.insert(0, BACKEND_DIR)
+    from pdf_color_analyzer import extract_unique_colors
+    from process_pdf import process_pdf_files
+
+    latencies = []
+    steps = {}
+    for run in range(repeat + 1):
+        output_dir = os.path.join(work_dir, f'run{run}')
+        start = time.perf_counter()
+        if workload == 'process':
+            result = process_pdf_files(pdf_path, mapping_path, output_dir, page_workers=1)
+        else:
+            result = extract_unique_colors(pdf_path)
+        elapsed = time.perf_counter() - start
+        shutil.rmtree(output_dir, ignore_errors=True)
+        if run == 0:
+            continue  # warm-up: imports, mapping compilation
+        latencies.append(elapsed)
+        if workload == 'process':
+            for step, seconds in result.get("timings", {}).items():
+                steps.setdefault(step, []).append(seconds)
+    counters = result.get("counters") if workload == 'process' else None
+    return {
+        "latencies": latencies,
+        "steps": {step: statistics.median(values) for step, values in steps.items()},
+        "counters": counters,
+        # Linux reports KiB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_case(name, spec, workload, corpus_dir, repeat):
+    pdf_path = os.path.join(corpus_dir, f'{name}.pdf')
+    mapping_path = os.path.join(corpus_dir, f'{name}.json')
+    work_dir = tempfile.mkdtemp(dir=corpus_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            raw = pool.submit(_measure, workload, pdf_path, mapping_path, work_dir, repeat).result()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = raw["latencies"]
+    p50 = percentile(latencies, 50)
+    size_mb = os.path.getsize(pdf_path) / 1024 ** 2
+    result = {
+        "pages": spec["pages"],
+        "size_mb": round(size_mb, 3),
+        "runs": len(latencies),
+        "p50": round(p50, 4),
+        "p90": round(percentile(latencies, 90), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "mean": round(statistics.mean(latencies), 4),
+        "pages_per_second": round(spec["pages"] / p50, 2),
+        "mb_per_second": round(size_mb / p50, 2),
+        "peak_rss_mb": round(raw["peak_rss_mb"], 1),
+    }
+    if raw["steps"]:
+        result["steps"] = {step: round(seconds, 4) for step, seconds in raw["steps"].items()}
+    if raw["counters"]:
+        result["counters"] = raw["counters"]
+    return result
+
+
+def environment():
+    import numpy
+    import pikepdf
+    return {
+        "date": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pikepdf": pikepdf.__version__,
+        "numpy": numpy.__version__,
+        "ghostscript": shutil.which('gs') is not None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints current vs. baseline and returns the list of regressions."""
+    regressions = []
+    print(f"\n{'case':<32} {'p50 base':>9} {'p50 now':>9} {'change':>8} {'RSS base':>9} {'RSS now':>8}")
+    for key, current in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if previous is None:
+            print(f"{key:<32} {'-':>9} {current['p50']:9.3f}   (new)")
+            continue
+        time_change = current["p50"] / previous["p50"] - 1 if previous["p50"] else 0
+        rss_change = current["peak_rss_mb"] / previous["peak_rss_mb"] - 1 if previous["peak_rss_mb"] else 0
+        flags = []
+        if time_change > threshold:
+            flags.append("SLOWER")
+        if rss_change > threshold:
+            flags.append("MORE MEMORY")
+        if flags:
+            regressions.append((key, flags))
+        print(f"{key:<32} {previous['p50']:9.3f} {current['p50']:9.3f} {time_change:+8.1%} "
+              f"{previous['peak_rss_mb']:9.1f} {current['peak_rss_mb']:8.1f}  {' '.join(flags)}")
+    if baseline.get("environment", {}).get("platform") != platform.platform():
+        print("Note: the baseline was recorded on a different platform.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cases', nargs='+', choices=sorted(CORPUS), default=list(CORPUS))
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case (after one warm-up)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the page count of every document')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--save-baseline', help='also write the results here, as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed relative growth (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    report = {
+        "environment": environment(),
+        "settings": {"repeat": args.repeat, "scale": args.scale, "seed": args.seed},
+        "results": {},
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print(f"Warning: baseline settings {baseline.get('settings')} differ from {report['settings']}.")
+
+    with tempfile.TemporaryDirectory(prefix='fig2pdf-bench-') as corpus_dir:
+        print(f"{'case':<32} {'pages':>5} {'MB':>6} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} "
+              f"{'pages/s':>8} {'RSS MB':>7}")
+        for name in args.cases:
+            spec = dict(CORPUS[name], pages=max(1, round(CORPUS[name]['pages'] * args.scale)))
+            palette = build_pdf(os.path.join(corpus_dir, f'{name}.pdf'), spec, seed=args.seed)
+            write_mapping(os.path.join(corpus_dir, f'{name}.json'), palette)
+            for workload in args.workloads:
+                key = f'{name}/{workload}'
+                r = run_case(name, spec, workload, corpus_dir, args.repeat)
+                report["results"][key] = r
+                print(f"{key:<32} {r['pages']:>5} {r['size_mb']:6.1f} {r['p50']:8.3f} {r['p90']:8.3f} "
+                      f"{r['p99']:8.3f} {r['pages_per_second']:8.1f} {r['peak_rss_mb']:7.1f}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote {path}")
+
+    if args.baseline:
+        regressions = compare(report["results"], baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: "
+                  + ", ".join(f"{key} ({' / '.join(flags)})" for key, flags in regressions))
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == '__main__':
+    main()
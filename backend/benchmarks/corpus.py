@@ -0,0 +1,112 @@
+"""
+Synthetic, Figma-like PDF corpus for the benchmark suite (bench_suite.py).
+
+Every document is generated deterministically from its spec and a seed:
+vector fills and strokes drawn from a palette (with a share of off-palette
+colors), optional JPEG / Flate images, and Form XObjects shared by many
+pages, the way Figma exports repeated components.
+"""
+import io
+import json
+import random
+
+import numpy as np
+import pikepdf
+from PIL import Image
+
+# name -> spec. `scale` in bench_suite multiplies pages.
+CORPUS = {
+    'light': dict(pages=5, ops=100, palette=8, images=0, image_size=0, shared=0),
+    'dense-vectors': dict(pages=20, ops=2000, palette=64, images=0, image_size=0, shared=0),
+    'large-palette': dict(pages=10, ops=500, palette=1024, images=0, image_size=0, shared=0),
+    'image-heavy': dict(pages=10, ops=100, palette=16, images=4, image_size=1024, shared=0),
+    'shared-components': dict(pages=60, ops=50, palette=32, images=1, image_size=512, shared=4),
+    'many-pages': dict(pages=300, ops=60, palette=16, images=0, image_size=0, shared=0),
+}
+
+# Share of operators whose color is in the mapping.
+MAPPED_RATIO = 0.7
+
+
+def build_palette(size, rng):
+    return [(rng.random(), rng.random(), rng.random()) for _ in range(size)]
+
+
+def _color_ops(count, palette, rng):
+    lines = []
+    for _ in range(count):
+        if rng.random() < MAPPED_RATIO:
+            r, g, b = rng.choice(palette)
+        else:
+            r, g, b = rng.random(), rng.random(), rng.random()
+        x, y, w, h = rng.randrange(550), rng.randrange(780), rng.randrange(2, 60), rng.randrange(2, 60)
+        if rng.random() < 0.8:
+            lines.append(f"{r:.4f} {g:.4f} {b:.4f} rg {x} {y} {w} {h} re f")
+        else:
+            lines.append(f"{r:.4f} {g:.4f} {b:.4f} RG 0.5 w {x} {y} m {x + w} {y + h} l S")
+    return lines
+
+
+def _image(pdf, size, palette, np_rng, jpeg):
+    cells = np.array(palette[:16]) * 255
+    pixels = cells[np_rng.integers(0, len(cells), size=(size // 32, size // 32))].astype(np.uint8)
+    pixels = np.kron(pixels, np.ones((32, 32, 1), dtype=np.uint8))
+    if jpeg:
+        buffer = io.BytesIO()
+        Image.fromarray(pixels, 'RGB').save(buffer, format='JPEG', quality=85)
+        image = pdf.make_stream(buffer.getvalue())
+        image.Filter = pikepdf.Name.DCTDecode
+    else:
+        image = pdf.make_stream(pixels.tobytes())  # pikepdf Flate-compresses on save
+    image.Type, image.Subtype = pikepdf.Name.XObject, pikepdf.Name.Image
+    image.Width, image.Height = size, size
+    image.ColorSpace, image.BitsPerComponent = pikepdf.Name.DeviceRGB, 8
+    return image
+
+
+def build_pdf(path, spec, seed=0):
+    """Writes the document described by `spec` (see CORPUS); returns its palette."""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    palette = build_palette(spec['palette'], rng)
+    pdf = pikepdf.new()
+
+    components = {}
+    for i in range(spec['shared']):
+        form = pdf.make_stream("\n".join(_color_ops(spec['ops'] * 4, palette, rng)).encode())
+        form.Type, form.Subtype = pikepdf.Name.XObject, pikepdf.Name.Form
+        form.BBox = [0, 0, 612, 792]
+        components[f'/Fx{i}'] = form
+    shared_images = {f'/Shared{i}': _image(pdf, spec['image_size'], palette, np_rng, jpeg=True)
+                     for i in range(min(spec['images'], 1) if spec['shared'] else 0)}
+
+    for p in range(spec['pages']):
+        pdf.add_blank_page(page_size=(612, 792))
+        page = pdf.pages[-1]
+        xobjects = dict(components)
+        lines = _color_ops(spec['ops'], palette, rng)
+        for name in components:
+            lines.append(f"q 0.5 0 0 0.5 {rng.randrange(300)} {rng.randrange(400)} cm {name} Do Q")
+        if shared_images:
+            xobjects.update(shared_images)
+            lines.extend(f"q 120 0 0 120 20 20 cm {name} Do Q" for name in shared_images)
+        else:
+            for i in range(spec['images']):
+                # Alternate JPEG and Flate images, as exports mix photos and flat artwork.
+                xobjects[f'/Im{i}'] = _image(pdf, spec['image_size'], palette, np_rng, jpeg=(p + i) % 2 == 0)
+                lines.append(f"q 200 0 0 200 {i * 100} 500 cm /Im{i} Do Q")
+        if xobjects:
+            page.obj.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(xobjects))
+        page.obj.Contents = pdf.make_stream("\n".join(lines).encode())
+    pdf.save(path)
+    return palette
+
+
+def write_mapping(path, palette):
+    """A color mapping covering every palette color."""
+    mappings = [
+        {"rgb_255": [round(c * 255) for c in rgb], "cmyk_100": [(7 * n) % 100, (13 * n) % 100, (29 * n) % 100, 0]}
+        for n, rgb in enumerate(palette)
+    ]
+    with open(path, 'w') as f:
+        json.dump({"mappings": mappings}, f)
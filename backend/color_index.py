@@ -0,0 +1,75 @@
+import math
+
+
+class ColorIndex:
+    """
+    Quantized-grid index over an RGB -> CMYK mapping.
+
+    RGB space is split into cubic cells whose edge equals the matching
+    tolerance, so any color within tolerance of a query lies in the query's
+    cell or one of its 26 neighbours. Each mapped color is registered in all
+    27 cells around it at build time, which makes a lookup a single dict probe
+    followed by exact checks. Lookups return the same "first match within
+    tolerance" (in mapping order) as a linear scan.
+    """
+
+    def __init__(self, rgb_to_cmyk_map, tolerance):
+        self.tolerance = tolerance
+        self._entries = list(rgb_to_cmyk_map.items())
+        self._buckets = {}
+        if tolerance > 0:
+            for order, (rgb, _) in enumerate(self._entries):
+                ci, cj, ck = self._cell(rgb)
+                for i in (ci - 1, ci, ci + 1):
+                    for j in (cj - 1, cj, cj + 1):
+                        for k in (ck - 1, ck, ck + 1):
+                            self._buckets.setdefault((i, j, k), []).append(order)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cell(self, rgb):
+        tol = self.tolerance
+        return (math.floor(rgb[0] / tol), math.floor(rgb[1] / tol), math.floor(rgb[2] / tol))
+
+    def lookup(self, r, g, b):
+        """Returns the CMYK tuple of the first mapping entry within tolerance, or None."""
+        if not self._buckets:
+            return None
+
+        tol = self.tolerance
+        for order in self._buckets.get(self._cell((r, g, b)), ()):
+            map_rgb, map_cmyk = self._entries[order]
+            if (abs(r - map_rgb[0]) < tol and
+                abs(g - map_rgb[1]) < tol and
+                abs(b - map_rgb[2]) < tol):
+                return map_cmyk
+        return None
+
+    def matcher(self):
+        """
+        Returns a lookup function with its own memo of resolved (r, g, b) triples.
+        Intended to live for a single processing run.
+        """
+        memo = {}
+        lookup = self.lookup
+
+        def match(r, g, b):
+            key = (r, g, b)
+            try:
+                return memo[key]
+            except KeyError:
+                result = memo[key] = lookup(r, g, b)
+                return result
+
+        return match
+
+
+def linear_lookup(rgb_to_cmyk_map, r, g, b, tolerance):
+    """Reference implementation: scans every mapping entry in order."""
+    for map_rgb, map_cmyk in rgb_to_cmyk_map.items():
+        if (abs(r - map_rgb[0]) < tolerance and
+            abs(g - map_rgb[1]) < tolerance and
+            abs(b - map_rgb[2]) < tolerance):
+            return map_cmyk
+    return None
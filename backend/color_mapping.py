@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from color_index import ColorIndex
+
+MAPPING_CACHE_SIZE = int(os.environ.get('FIG2PDF_MAPPING_CACHE_SIZE', 32))
+
+
+class CompiledColorMapping:
+    """
+    A parsed color mapping: normalized float tuples plus lazily built lookup
+    indexes (one per tolerance). Instances are immutable once built and are
+    shared between requests through the process-wide cache below.
+    """
+
+    def __init__(self, data, content_hash):
+        self.data = data
+        self.content_hash = content_hash
+        self.rgb_to_cmyk_map = {}
+        for item in data['mappings']:
+            rgb_key = tuple(c / 255.0 for c in item['rgb_255'])
+            cmyk_value = tuple(c / 100.0 for c in item['cmyk_100'])
+            self.rgb_to_cmyk_map[rgb_key] = cmyk_value
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rgb_to_cmyk_map)
+
+    def index(self, tolerance):
+        """Returns the ColorIndex for `tolerance`, building it on first use."""
+        color_index = self._indexes.get(tolerance)
+        if color_index is None:
+            with self._lock:
+                color_index = self._indexes.get(tolerance)
+                if color_index is None:
+                    color_index = self._indexes[tolerance] = ColorIndex(self.rgb_to_cmyk_map, tolerance)
+        return color_index
+
+
+class _MappingCache:
+    """Thread-safe LRU of CompiledColorMapping objects keyed by content hash."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            mapping = self._items.get(key)
+            if mapping is not None:
+                self._items.move_to_end(key)
+            return mapping
+
+    def put(self, key, mapping):
+        with self._lock:
+            self._items[key] = mapping
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_cache = _MappingCache(MAPPING_CACHE_SIZE)
+
+# path -> (mtime_ns, size, content_hash) for mapping files read via load_color_mapping_file
+_file_stamps = {}
+_file_stamps_lock = threading.Lock()
+
+
+def content_hash(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def compile_color_mapping(raw):
+    """
+    Returns the CompiledColorMapping for raw JSON bytes, reusing the cached one
+    when the same content has been compiled before.
+
+    Raises json.JSONDecodeError / KeyError / TypeError for malformed mappings.
+    """
+    key = content_hash(raw)
+    mapping = _cache.get(key)
+    if mapping is None:
+        mapping = CompiledColorMapping(json.loads(raw), key)
+        _cache.put(key, mapping)
+    return mapping
+
+
+def load_color_mapping(path):
+    """Reads and compiles a mapping file. Raises FileNotFoundError if it is missing."""
+    with open(path, 'rb') as f:
+        return compile_color_mapping(f.read())
+
+
+def load_color_mapping_file(path):
+    """
+    Like load_color_mapping, but for long-lived files such as the default
+    mapping: while the file's mtime and size are unchanged the cached mapping
+    is returned without touching the file contents.
+    """
+    st = os.stat(path)
+    with _file_stamps_lock:
+        stamp = _file_stamps.get(path)
+    if stamp is not None and stamp[:2] == (st.st_mtime_ns, st.st_size):
+        mapping = _cache.get(stamp[2])
+        if mapping is not None:
+            return mapping
+
+    mapping = load_color_mapping(path)
+    with _file_stamps_lock:
+        _file_stamps[path] = (st.st_mtime_ns, st.st_size, mapping.content_hash)
+    return mapping
+
+
+def invalidate_color_mapping_file(path):
+    """Forgets the cached mapping for `path`, e.g. after it has been rewritten."""
+    with _file_stamps_lock:
+        stamp = _file_stamps.pop(path, None)
+    if stamp is not None:
+        _cache.pop(stamp[2])
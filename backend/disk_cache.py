@@ -0,0 +1,104 @@
+import os
+import shutil
+import threading
+import time
+
+# Other processes write to the same store, so a process's running byte total
+# is an estimate: it is recounted from disk at least this often.
+DISK_CACHE_RECOUNT_SECONDS = 60
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class DiskCache:
+    """
+    Size-bounded on-disk store shared by the result, analysis and preview
+    caches. Entries (files or directories) live in two-character shard
+    directories under `root`, and their mtime records the last use; names
+    starting with '.' are work in progress and not counted. Writes are
+    reported with _stored, which evicts least recently used entries only
+    once the running byte total goes over `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._bytes = None  # running total, not known until the first count
+        self._counted_at = 0
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _stored(self, size):
+        """Accounts for an entry of `size` bytes just written."""
+        with self._lock:
+            self._counters["stores"] += 1
+            if self._bytes is not None:
+                self._bytes += size
+            due = (self._bytes is None or self._bytes > self.max_bytes
+                   or time.monotonic() - self._counted_at >= DISK_CACHE_RECOUNT_SECONDS)
+        if due:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith('.'):
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    size = _dir_size(entry.path) if entry.is_dir(follow_symlinks=False) else stat.st_size
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, size, entry.path))
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the store fits in max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self._count("evictions")
+        with self._lock:
+            self._bytes = total
+            self._counted_at = time.monotonic()
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": counters["hits"] / lookups if lookups else None,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,271 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+import uuid
+
+# Long-lived interpreters are opt-in until the stdin job loop has been validated
+# and benchmarked on a real Ghostscript build (benchmarks/bench_ghostscript.py).
+GS_POOL_SIZE = int(os.environ.get('FIG2PDF_GS_POOL_SIZE', 0))  # 0 = cold `gs` process per job
+GS_TIMEOUT = float(os.environ.get('FIG2PDF_GS_TIMEOUT', 600))
+GS_MAX_JOBS_PER_WORKER = int(os.environ.get('FIG2PDF_GS_MAX_JOBS', 50))
+# After this many protocol failures the pool is bypassed for the rest of the process.
+GS_MAX_POOL_FAILURES = 3
+
+
+class GhostscriptWorkerError(Exception):
+    """A pooled interpreter crashed or did not behave as expected (not the job's fault)."""
+
+
+def _allowed_dir(input_pdf, output_pdf):
+    """The directory a conversion may read and write below: the parent of its job directory (e.g. the uploads folder)."""
+    job_dir = os.path.commonpath([os.path.dirname(os.path.abspath(input_pdf)),
+                                  os.path.dirname(os.path.abspath(output_pdf))])
+    return os.path.dirname(job_dir)
+
+
+def _safer_options(allowed_dir):
+    # The same for pooled and cold interpreters, so both run a job alike.
+    return [
+        '-dSAFER',
+        f'--permit-file-read={allowed_dir}{os.sep}',
+        f'--permit-file-write={allowed_dir}{os.sep}',
+        '--permit-file-write=/dev/null',
+    ]
+
+
+def run_ghostscript_cold(gs_command, gs_options, input_pdf, output_pdf, timeout=GS_TIMEOUT, input_fd=None,
+                         allowed_dir=None):
+    """
+    Runs one conversion in a fresh `gs` process.
+
+    With `input_fd` (e.g. a memfd holding the PDF), gs reads /dev/fd/<n>
+    instead of input_pdf; the descriptor must be seekable, as PDF input is.
+    With `allowed_dir`, gs runs with -dSAFER and may only read and write
+    below that directory, like a pooled interpreter.
+
+    Returns the CompletedProcess; raises subprocess.CalledProcessError or
+    subprocess.TimeoutExpired.
+    """
+    safer_options = _safer_options(allowed_dir) if allowed_dir else []
+    pass_fds = ()
+    if input_fd is not None:
+        input_pdf = f'/dev/fd/{input_fd}'
+        pass_fds = (input_fd,)
+        if allowed_dir:
+            safer_options.append(f'--permit-file-read={input_pdf}')
+    gs_args = [gs_command, '-dBATCH', '-dNOPAUSE', *safer_options, *gs_options,
+               f'-sOutputFile={output_pdf}', input_pdf]
+    return subprocess.run(gs_args, capture_output=True, text=True, check=True, timeout=timeout, pass_fds=pass_fds)
+
+
+def _ps_string(text):
+    """Encodes text as a PostScript hex string, so no escaping rules apply."""
+    return '<' + text.encode('utf-8').hex() + '>'
+
+
+def _looks_complete(pdf_path):
+    try:
+        with open(pdf_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 1024))
+            return size > 0 and b'%%EOF' in f.read()
+    except OSError:
+        return False
+
+
+class _GhostscriptWorker:
+    """
+    One long-lived `gs` interpreter reading jobs from stdin.
+
+    Each job points the pdfwrite device at a new OutputFile, runs the input
+    PDF inside `stopped`, then switches OutputFile back to /dev/null, which
+    closes and finalizes the job's PDF before a sentinel line is printed.
+    """
+
+    def __init__(self, gs_command, gs_options, allowed_dir):
+        self.jobs_run = 0
+        self.process = subprocess.Popen(
+            [
+                gs_command, '-q', '-dNOPAUSE', *_safer_options(allowed_dir),
+                *gs_options, '-sOutputFile=/dev/null', '-',
+            ],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, bufsize=1,
+        )
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None)  # EOF: the interpreter exited
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, input_pdf, output_pdf, timeout):
+        token = uuid.uuid4().hex
+        job = (
+            f"{{ << /OutputFile {_ps_string(output_pdf)} >> setpagedevice {_ps_string(input_pdf)} run }} stopped\n"
+            "{ << /OutputFile (/dev/null) >> setpagedevice } stopped pop\n"
+            f"{{ (\\n%%FIG2PDF-FAILED {token} ) print $error /errorname get 128 string cvs print (\\n) print }}\n"
+            f"{{ (\\n%%FIG2PDF-DONE {token}\\n) print }} ifelse\n"
+            "clear cleardictstack $error /newerror false put flush\n"
+        )
+        self.jobs_run += 1
+        try:
+            self.process.stdin.write(job)
+            self.process.stdin.flush()
+        except OSError as e:
+            raise GhostscriptWorkerError(f"Could not send job to Ghostscript: {e}")
+
+        output = []
+        # One deadline for the whole job, so a job that keeps printing cannot outlive it
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self._lines.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.close(kill=True)
+                raise subprocess.TimeoutExpired(['gs', input_pdf], timeout, output=''.join(output))
+            if line is None:
+                raise GhostscriptWorkerError(
+                    f"Ghostscript exited with code {self.process.wait()}:\n{''.join(output)}"
+                )
+            if line.startswith(f'%%FIG2PDF-DONE {token}'):
+                if not _looks_complete(output_pdf):
+                    raise GhostscriptWorkerError(f"Ghostscript did not finalize {output_pdf}")
+                return subprocess.CompletedProcess(['gs', input_pdf], 0, ''.join(output), '')
+            if line.startswith(f'%%FIG2PDF-FAILED {token}'):
+                errorname = line.split(token, 1)[1].strip()
+                raise subprocess.CalledProcessError(1, ['gs', input_pdf], ''.join(output), f"PostScript error: {errorname}")
+            output.append(line)
+
+    def close(self, kill=False):
+        if self.alive and not kill:
+            try:
+                self.process.stdin.write("quit\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self.alive:
+            self.process.kill()
+            self.process.wait()
+
+
+class GhostscriptPool:
+    """
+    Keeps up to `size` warm interpreters, so jobs skip interpreter start-up
+    and font/resource setup. Interpreters are keyed by their gs options and
+    the directory they may read and write (the parent of the job directory,
+    e.g. the uploads folder). Workers are recycled after `max_jobs` jobs,
+    after a timeout and after a crash.
+    """
+
+    def __init__(self, size=GS_POOL_SIZE, max_jobs=GS_MAX_JOBS_PER_WORKER):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.failures = 0
+        self._idle = []  # [(key, worker)], least recently used first
+        self._slots = threading.BoundedSemaphore(max(size, 1))
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.size > 0 and self.failures < GS_MAX_POOL_FAILURES
+
+    def _acquire(self, key):
+        with self._lock:
+            for n, (idle_key, worker) in enumerate(self._idle):
+                if idle_key == key:
+                    del self._idle[n]
+                    if worker.alive:
+                        return worker
+                    break
+        return _GhostscriptWorker(key[0], key[1], key[2])
+
+    def _release(self, key, worker):
+        if not worker.alive:
+            return
+        if worker.jobs_run >= self.max_jobs:
+            worker.close()
+            return
+        with self._lock:
+            self._idle.append((key, worker))
+            surplus = self._idle[:-self.size]
+            del self._idle[:-self.size]
+        for _, old_worker in surplus:
+            old_worker.close()
+
+    def run(self, gs_command, gs_options, input_pdf, output_pdf, timeout=GS_TIMEOUT):
+        input_pdf = os.path.abspath(input_pdf)
+        output_pdf = os.path.abspath(output_pdf)
+        key = (gs_command, tuple(gs_options), _allowed_dir(input_pdf, output_pdf))
+
+        with self._slots:
+            worker = self._acquire(key)
+            try:
+                return worker.run(input_pdf, output_pdf, timeout)
+            except GhostscriptWorkerError:
+                with self._lock:
+                    self.failures += 1
+                worker.close(kill=True)
+                raise
+            except subprocess.CalledProcessError:
+                # The document failed, the interpreter is still usable.
+                raise
+            except BaseException:
+                worker.close(kill=True)
+                raise
+            finally:
+                self._release(key, worker)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, worker in idle:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool (one per job worker process)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = GhostscriptPool()
+        return _pool
+
+
+def run_ghostscript(gs_command, gs_options, input_pdf, output_pdf, timeout=GS_TIMEOUT, input_fd=None):
+    """
+    Converts input_pdf to output_pdf, on a pooled interpreter when possible.
+
+    Returns (CompletedProcess, used_pool). Raises subprocess.CalledProcessError
+    or subprocess.TimeoutExpired like run_ghostscript_cold. If a pooled
+    interpreter misbehaves the job is retried once in a cold process.
+    Input from a file descriptor always uses a cold process, since a running
+    interpreter cannot receive new descriptors. Either way gs runs with
+    -dSAFER and the same file permissions.
+    """
+    allowed_dir = _allowed_dir(input_pdf, output_pdf)
+    if input_fd is not None:
+        return run_ghostscript_cold(gs_command, gs_options, input_pdf, output_pdf, timeout, input_fd=input_fd,
+                                    allowed_dir=allowed_dir), False
+    pool = get_pool()
+    if pool.enabled:
+        try:
+            return pool.run(gs_command, gs_options, input_pdf, output_pdf, timeout), True
+        except GhostscriptWorkerError:
+            pass
+    return run_ghostscript_cold(gs_command, gs_options, input_pdf, output_pdf, timeout,
+                                allowed_dir=allowed_dir), False
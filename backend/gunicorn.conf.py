@@ -0,0 +1,39 @@
+"""
+Production gunicorn settings:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app) and warmed up there
+(app.warm_up: heavy modules, default color mapping, Ghostscript lookup)
+before the workers are forked, so workers start serving right away and share
+those pages copy-on-write instead of each importing everything again.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Job state lives in the web process (see jobs.py), so keep a single worker
+# process and serve concurrent requests, including the long-lived job event
+# streams, with threads. With more workers, /api/jobs/* requests landing in a
+# process that does not own the job would answer 404.
+workers = int(os.environ.get('FIG2PDF_WEB_WORKERS', 1))
+if workers > 1:
+    raise RuntimeError("FIG2PDF_WEB_WORKERS > 1 is not supported: job state is kept in one process (see jobs.py)")
+worker_class = 'gthread'
+threads = int(os.environ.get('FIG2PDF_WEB_THREADS', 8))
+
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the app has been preloaded, before any fork.
+    import app
+    app.warm_up()
+
+
+def post_fork(server, worker):
+    # Schema setup opened database connections in the master; the worker must
+    # open its own instead of sharing those sockets with its siblings.
+    from app import app as flask_app, db
+    with flask_app.app_context():
+        db.engine.dispose(close=False)
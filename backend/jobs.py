@@ -0,0 +1,324 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+JOB_EXECUTOR = os.environ.get('FIG2PDF_JOB_EXECUTOR', 'process')  # 'process' or 'thread'
+JOB_WORKERS = int(os.environ.get('FIG2PDF_JOB_WORKERS', min(4, os.cpu_count() or 1)))
+JOB_MAX_PENDING = int(os.environ.get('FIG2PDF_JOB_MAX_PENDING', 64))
+JOB_HISTORY_SIZE = int(os.environ.get('FIG2PDF_JOB_HISTORY_SIZE', 500))
+# How job worker processes start. 'forkserver' forks each worker from a small
+# server process that has imported the queue's `preload` modules once, so
+# workers start warm and share those pages; 'spawn' starts every worker cold.
+JOB_START_METHOD = os.environ.get(
+    'FIG2PDF_JOB_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn',
+)
+# Log lines kept per job for streaming clients; older lines are dropped.
+JOB_LOG_LINES = 500
+# How long after a job finished its last log lines may still be in transit, when
+# the worker did not get to send the end-of-log marker (e.g. it was killed).
+JOB_LOG_GRACE_SECONDS = 2
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# Set in every worker (process or thread) by _init_worker.
+_progress_queue = None
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when max_pending jobs are already waiting or running."""
+
+
+class Job:
+    def __init__(self, kind, meta=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.stage = None
+        self.progress = {}  # stage -> {"current": int, "total": int}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.log_lines = deque(maxlen=JOB_LOG_LINES)  # (seq, line)
+        self.log_seq = 0
+        self.log_closed = False  # the worker's end-of-log marker has arrived
+
+    def add_log(self, line):
+        self.log_seq += 1
+        self.log_lines.append((self.log_seq, line))
+
+    def logs_since(self, seq):
+        """Log entries (seq, line) newer than `seq` that are still buffered."""
+        return [entry for entry in list(self.log_lines) if entry[0] > seq]
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    @property
+    def logs_complete(self):
+        """Whether the job is done and all its log lines have arrived (they trail the result)."""
+        if not self.done:
+            return False
+        return self.log_closed or time.time() - self.finished_at >= JOB_LOG_GRACE_SECONDS
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.meta,
+        }
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+class _ProgressReporter:
+    """Handed to job functions as `progress=` (and `.log` as `log=`); forwards events to the parent."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def __call__(self, stage, current=None, total=None):
+        _progress_queue.put((self.job_id, 'progress', (stage, current, total)))
+
+    def log(self, line):
+        _progress_queue.put((self.job_id, 'log', line))
+
+
+def _run_job(job_id, fn, args, kwargs):
+    _progress_queue.put((job_id, 'started', None))
+    reporter = _ProgressReporter(job_id)
+    try:
+        return fn(*args, progress=reporter, log=reporter.log, **kwargs)
+    finally:
+        # Queued after every log line of the job, so it marks the end of its log
+        _progress_queue.put((job_id, 'finished', None))
+
+
+class JobQueue:
+    """
+    Local, in-process job backend: a bounded worker pool plus an in-memory
+    registry of job states. No external broker is needed, but job state is
+    only visible to the process that owns the queue, so run the web server
+    with a single worker process (and threads) when relying on it.
+
+    Job functions must be picklable top-level callables accepting
+    `progress(stage, current=None, total=None)` and `log(line)` keyword
+    arguments and returning a dict with a boolean "success" key.
+
+    `on_finished(job)`, if given, is called once for every job that reaches
+    a final state (e.g. to record metrics). `preload` names modules the job
+    functions need; with the forkserver start method they are imported once
+    and inherited by every worker process.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING,
+                 executor=JOB_EXECUTOR, history_size=JOB_HISTORY_SIZE, on_finished=None,
+                 start_method=JOB_START_METHOD, preload=()):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor_kind = executor
+        self.start_method = start_method
+        self.preload = list(preload)
+        self.history_size = history_size
+        self.on_finished = on_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._mp_context = None
+        self._progress_queue = None
+        self._drain_thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Pools are created lazily so importing the app (e.g. in gunicorn's
+        # master with preload) does not spawn worker processes.
+        with self._start_lock:
+            if self._executor is None:
+                self._start()
+
+    def _start(self):
+        if self.executor_kind == 'thread':
+            self._progress_queue = queue.Queue()
+        else:
+            self._mp_context = multiprocessing.get_context(self.start_method)
+            if self.start_method == 'forkserver' and self.preload:
+                self._mp_context.set_forkserver_preload(self.preload)
+            self._progress_queue = self._mp_context.Queue()
+        self._executor = self._new_executor()
+        self._drain_thread = threading.Thread(target=self._drain_progress, name='fig2pdf-job-progress', daemon=True)
+        self._drain_thread.start()
+
+    def _new_executor(self):
+        if self.executor_kind == 'thread':
+            return ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='fig2pdf-job',
+                initializer=_init_worker,
+                initargs=(self._progress_queue,),
+            )
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._mp_context,
+            initializer=_init_worker,
+            initargs=(self._progress_queue,),
+        )
+
+    def _replace_broken_executor(self, broken):
+        """Swaps a pool that lost a worker (BrokenProcessPool) for a fresh one, keeping the progress queue."""
+        with self._start_lock:
+            if self._executor is broken:
+                print("[ERROR] A job worker process died; restarting the job pool")
+                broken.shutdown(wait=False)
+                self._executor = self._new_executor()
+
+    def _drain_progress(self):
+        while True:
+            job_id, event, payload = self._progress_queue.get()
+            job = self.get(job_id)
+            if job is None:
+                continue
+            if event == 'log':
+                # Log lines may trail the result, keep them even for finished jobs.
+                job.add_log(payload)
+            elif event == 'finished':
+                job.log_closed = True
+            elif job.done:
+                continue
+            elif event == 'started':
+                job.status = RUNNING
+                job.started_at = time.time()
+            elif event == 'progress':
+                stage, current, total = payload
+                job.stage = stage
+                if current is not None:
+                    job.progress[stage] = {"current": current, "total": total}
+
+    def submit(self, fn, *args, kind='job', meta=None, on_done=None, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) on the pool and returns its Job.
+
+        `on_done(job, result)` runs in the parent process once fn returns; its
+        return value (a dict) replaces the stored result, so callers can
+        persist side effects (e.g. history rows) and shape the final payload.
+        If the job cannot be scheduled even on a rebuilt pool, it is returned
+        already FAILED.
+        """
+        self._ensure_started()
+        job = Job(kind, meta)
+        with self._lock:
+            if sum(1 for j in self._jobs.values() if not j.done) >= self.max_pending:
+                raise QueueFullError(f"Too many pending jobs (limit {self.max_pending})")
+            self._jobs[job.id] = job
+            self._evict_finished()
+
+        executor = self._executor
+        try:
+            try:
+                future = executor.submit(_run_job, job.id, fn, args, kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory) and took the whole pool down
+                self._replace_broken_executor(executor)
+                future = self._executor.submit(_run_job, job.id, fn, args, kwargs)
+        except Exception as e:
+            # Not scheduled: fail the job so it stops counting against max_pending
+            job.error = f"{type(e).__name__}: {e}"
+            job.finished_at = time.time()
+            job.log_closed = True
+            job.status = FAILED
+            self._notify_finished(job)
+            return job
+        future.add_done_callback(lambda f: self._finish(job, f, on_done))
+        return job
+
+    def add_completed(self, result, kind='job', meta=None):
+        """Registers a job whose result is already known (e.g. served from a cache)."""
+        job = Job(kind, meta)
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        job.log_closed = True
+        job.status = SUCCEEDED if result.get("success") else FAILED
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        self._notify_finished(job)
+        return job
+
+    def _finish(self, job, future, on_done):
+        try:
+            result = future.result()
+            if on_done is not None:
+                result = on_done(job, result)
+            job.result = result
+            if not result.get("success"):
+                job.error = result.get("message")
+            status = SUCCEEDED if result.get("success") else FAILED
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            status = FAILED
+        job.finished_at = time.time()
+        job.status = status
+        self._notify_finished(job)
+
+    def _notify_finished(self, job):
+        if self.on_finished is None:
+            return
+        try:
+            self.on_finished(job)
+        except Exception as e:
+            print(f"[ERROR] on_finished hook failed for job {job.id}: {e}")
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in itertools.islice(finished, max(0, len(finished) - self.history_size)):
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self):
+        """Jobs that are queued or running."""
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "executor": self.executor_kind,
+            "start_method": self.start_method if self.executor_kind != 'thread' else None,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "jobs": counts,
+        }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
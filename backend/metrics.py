@@ -0,0 +1,191 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters and histograms live in the web process. Conversion jobs run in
+worker processes, so they report step durations and counts in their result
+("timings", "counters") and observe_job() records them once the job is done.
+"""
+import bisect
+import cProfile
+import os
+import threading
+
+# Opt-in profiling of single jobs ('/process' with profile=true): '' (off),
+# 'cprofile' or 'pyinstrument'.
+PROFILER = os.environ.get('FIG2PDF_PROFILER', '')
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def _samples(self, key, value):
+        yield self.name, _labels(self.labels, key), value
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(value) if isinstance(value, list) else value)
+                           for key, value in self._values.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, value in items:
+            lines.extend(f'{name}{labels} {_number(v)}' for name, labels, v in self._samples(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (not cumulative), then sum and count
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self, key, state):
+        cumulative = 0
+        for bound, count in zip(self.buckets, state):
+            cumulative += count
+            yield f'{self.name}_bucket', _labels(self.labels, key, [('le', _number(float(bound)))]), cumulative
+        yield f'{self.name}_bucket', _labels(self.labels, key, [('le', '+Inf')]), state[-1]
+        yield f'{self.name}_sum', _labels(self.labels, key), state[-2]
+        yield f'{self.name}_count', _labels(self.labels, key), state[-1]
+
+
+HTTP_REQUEST_SECONDS = Histogram('fig2pdf_http_request_duration_seconds',
+                                 'Time to build the response, by endpoint.', ('endpoint', 'method', 'status'))
+JOBS_TOTAL = Counter('fig2pdf_jobs_total', 'Finished background jobs.', ('kind', 'status'))
+JOB_SECONDS = Histogram('fig2pdf_job_duration_seconds', 'Job run time, start to finish.', ('kind',), STAGE_BUCKETS)
+JOB_WAIT_SECONDS = Histogram('fig2pdf_job_queue_wait_seconds', 'Time jobs spent queued.', ('kind',), STAGE_BUCKETS)
+STAGE_SECONDS = Histogram('fig2pdf_stage_duration_seconds',
+                          'Conversion step durations (mapping, open, scan, parse, match, unparse, rewrite, save, '
+                          'ghostscript, db_commit).', ('stage',), STAGE_BUCKETS)
+PAGES_TOTAL = Counter('fig2pdf_pages_processed_total', 'Pages of converted PDFs.')
+STREAMS_TOTAL = Counter('fig2pdf_content_streams_total',
+                        'Content streams considered for rewriting: skipped (no color operator), fast '
+                        '(patched in place) or tokenized (parsed by pikepdf).', ('result',))
+OPERATORS_TOTAL = Counter('fig2pdf_operators_scanned_total', 'Content stream operators parsed by pikepdf.')
+HISTORY_ROWS_DROPPED = Counter('fig2pdf_history_rows_dropped_total',
+                               'History rows given up on after repeated database write failures.')
+REPLACEMENTS_TOTAL = Counter('fig2pdf_color_replacements_total', 'RGB color operators replaced with CMYK.')
+# Set from the queue and store statistics on every scrape
+QUEUE_JOBS = Gauge('fig2pdf_queue_jobs', 'Jobs held by the queue, by status.', ('status',))
+STORE_BYTES = Gauge('fig2pdf_store_bytes', 'Bytes used by the result cache, analysis cache and uploads.', ('store',))
+STORE_ENTRIES = Gauge('fig2pdf_store_entries', 'Entries in the result cache, analysis cache and uploads.', ('store',))
+UPLOAD_RECLAIMED_BYTES = Gauge('fig2pdf_upload_reclaimed_bytes', 'Bytes freed by upload cleanup since start.')
+
+
+def observe_job(job):
+    """JobQueue on_finished hook: records a finished job and the timings and counters it reports."""
+    JOBS_TOTAL.inc(kind=job.kind, status=job.status)
+    if job.meta.get("cached"):
+        return  # nothing ran
+    if job.started_at is not None:
+        JOB_WAIT_SECONDS.observe(job.started_at - job.created_at, kind=job.kind)
+        JOB_SECONDS.observe(job.finished_at - job.started_at, kind=job.kind)
+    result = job.result or {}
+    for stage, seconds in (result.get("timings") or {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    counters = result.get("counters") or {}
+    if counters:
+        PAGES_TOTAL.inc(counters.get("pages", 0))
+        STREAMS_TOTAL.inc(counters.get("streams_skipped", 0), result='skipped')
+        STREAMS_TOTAL.inc(counters.get("streams_fast", 0), result='fast')
+        STREAMS_TOTAL.inc(counters.get("streams_tokenized", 0), result='tokenized')
+        OPERATORS_TOTAL.inc(counters.get("operators", 0))
+        REPLACEMENTS_TOTAL.inc(counters.get("replacements", 0))
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def run_profiled(fn, profile_dir, *args, **kwargs):
+    """
+    Job queue entry point wrapping another one: runs fn(*args, **kwargs)
+    under PROFILER and writes profile.pstats (cProfile) or profile.html
+    (pyinstrument) to profile_dir. The result gets "profile_filename".
+    """
+    if PROFILER == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("[WARN] pyinstrument is not installed, profiling with cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                profiler.stop()
+                with open(os.path.join(profile_dir, 'profile.html'), 'w') as f:
+                    f.write(profiler.output_html())
+            result["profile_filename"] = 'profile.html'
+            return result
+
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(os.path.join(profile_dir, 'profile.pstats'))
+    result["profile_filename"] = 'profile.pstats'
+    return result
@@ -1,9 +1,13 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
 import pikepdf
 import numpy as np
-from PIL import Image
-from sklearn.cluster import KMeans
-from collections import Counter
-import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pdf_image_decoder import decode_image_sample
 
 def rgb_to_hex(rgb):
     """Converts an (R, G, B) tuple to a hex string."""
@@ -27,54 +31,297 @@ def simple_rgb_to_cmyk(r, g, b):
 
     return [int(c*100), int(m*100), int(y*100), int(k*100)]
 
-def extract_unique_colors(pdf_path, limit=256, quality=75):
+ANALYSIS_WORKERS = int(os.environ.get('FIG2PDF_ANALYSIS_WORKERS', 1))
+MIN_PAGES_PER_WORKER = 8
+# Minimum seconds between the partial results iter_color_analysis yields.
+ANALYSIS_SNAPSHOT_INTERVAL = 0.5
+# Bump when page histograms change meaning, to orphan old page cache entries.
+ANALYSIS_VERSION = 1
+
+# Pending (key, count) entries a ColorHistogram buffers before merging them.
+HISTOGRAM_COMPACT_THRESHOLD = 1_000_000
+
+def pack_rgb(rgb):
+    """Packs an (..., 3) array of 0-255 channel values into uint32 keys 0xRRGGBB."""
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+def unpack_rgb(key):
+    """Inverse of pack_rgb for a single key, as a tuple of Python ints."""
+    key = int(key)
+    return ((key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF)
+
+def bucket_keys(keys, bits):
     """
-    Extracts all unique colors from a PDF, sorted by frequency, and provides a default CMYK conversion.
+    Quantizes packed colors to `bits` bits per channel; every color is replaced
+    by the center of its bucket, so near-identical shades are counted together.
     """
-    all_colors = []
+    if not bits or bits >= 8:
+        return keys
+    shift = 8 - bits
+    channel_mask = (0xFF >> shift) << shift
+    half = 1 << (shift - 1)
+    mask = np.uint32((channel_mask << 16) | (channel_mask << 8) | channel_mask)
+    center = np.uint32((half << 16) | (half << 8) | half)
+    return (keys & mask) | center
+
+def count_keys(keys):
+    """Returns (unique keys, counts) of a key array, in order of first occurrence."""
+    keys = np.asarray(keys, dtype=np.uint32)
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    return uniq[order], counts[order].astype(np.int64)
+
+class ColorHistogram:
+    """
+    Frequency table of packed RGB keys.
+
+    Chunks are added in document order, each in first-occurrence order, and
+    merged with np.unique/bincount. Ties in most_common() are broken by first
+    occurrence, like collections.Counter.most_common.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._counts = []
+        self._pending = 0
+
+    def add(self, keys, counts=None):
+        """Adds a chunk of keys (with per-key counts, or one count per occurrence)."""
+        if counts is None:
+            keys, counts = count_keys(keys)
+        if len(keys) == 0:
+            return
+        self._keys.append(np.asarray(keys, dtype=np.uint32))
+        self._counts.append(np.asarray(counts, dtype=np.int64))
+        self._pending += len(keys)
+        if self._pending > HISTOGRAM_COMPACT_THRESHOLD:
+            self._compact()
+
+    def update(self, other):
+        keys, counts = other.arrays()
+        self.add(keys, counts)
+
+    def _compact(self):
+        if len(self._keys) > 1:
+            keys = np.concatenate(self._keys)
+            counts = np.concatenate(self._counts)
+            uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            totals = np.bincount(inverse, weights=counts, minlength=len(uniq)).astype(np.int64)
+            order = np.argsort(first, kind='stable')
+            self._keys = [uniq[order]]
+            self._counts = [totals[order]]
+        self._pending = len(self._keys[0]) if self._keys else 0
+
+    def arrays(self):
+        """(keys, counts) with one entry per color, in order of first occurrence."""
+        self._compact()
+        if not self._keys:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+        return self._keys[0], self._counts[0]
+
+    def __len__(self):
+        return len(self.arrays()[0])
+
+    def most_common(self, limit=None):
+        """[(rgb tuple, count)] sorted by count, ties in first-occurrence order."""
+        keys, counts = self.arrays()
+        order = np.lexsort((np.arange(len(keys)), -counts))[:limit]
+        return [(unpack_rgb(keys[i]), int(counts[i])) for i in order]
 
+def _vector_color_keys(page):
+    """Packed keys of the RGB fill colors set by a page's content stream, in order."""
+    values = []
+    for operands, operator in pikepdf.parse_content_stream(page):
+        op_str = str(operator)
+        if op_str in ('rg', 'sc', 'scn') and len(operands) >= 3:
+            try:
+                values.append([int(c * 255) for c in operands[:3]])
+            except (ValueError, TypeError):
+                continue
+    if not values:
+        return np.empty(0, dtype=np.uint32)
+    return pack_rgb(np.clip(np.array(values, dtype=np.int64), 0, 255))
+
+def _image_color_keys(image_obj, quality, max_image_pixels):
+    """
+    Packed keys of an image's pixels, decoded at no more than `quality` pixels
+    per side. With max_image_pixels, every n-th pixel is kept (deterministic)
+    and returned with weight n, so totals stay comparable. Returns (keys, weight).
+    """
+    pixels = decode_image_sample(image_obj, quality)
+    if pixels is None:
+        return np.empty(0, dtype=np.uint32), 1
+    keys = pack_rgb(pixels.reshape(-1, 3))
+    step = 1
+    if max_image_pixels and len(keys) > max_image_pixels:
+        step = -(-len(keys) // max_image_pixels)
+        keys = keys[::step]
+    return keys, step
+
+def page_color_histogram(page, quality=75, max_image_pixels=None, bucket_bits=None, image_cache=None):
+    """
+    Color histogram of one page: vector fill colors first, then image pixels.
+    Returns None if the page's content stream cannot be parsed.
+
+    `image_cache` (a dict) lets callers share decoded images between pages:
+    an image XObject used on several pages is decoded once and counted once
+    per page it appears on.
+    """
+    histogram = ColorHistogram()
     try:
-        with pikepdf.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                # Extract vector colors
-                try:
-                    for operands, operator in pikepdf.parse_content_stream(page):
-                        op_str = str(operator)
-                        if op_str in ('rg', 'sc', 'scn') and len(operands) >= 3:
-                            try:
-                                r, g, b = [int(c * 255) for c in operands[:3]]
-                                all_colors.append((r, g, b))
-                            except (ValueError, TypeError):
-                                continue
-                except Exception:
-                    continue
-
-                # Extract image colors
-                for image_obj in page.images.values():
-                    try:
-                        pil_image = Image.open(io.BytesIO(image_obj.read_raw_bytes()))
-                        if pil_image.mode not in ['RGB', 'L']:
-                            pil_image = pil_image.convert('RGB')
-                        elif pil_image.mode == 'L':
-                            pil_image = pil_image.convert('RGB')
-
-                        pil_image.thumbnail((quality, quality))
-                        img_colors = np.array(pil_image)
-                        pixels = img_colors.reshape(-1, 3)
-                        all_colors.extend(map(tuple, pixels))
-                    except Exception:
-                        continue
-    except Exception as e:
-        print(f"Error opening or processing PDF {pdf_path}: {e}")
-        return []
+        histogram.add(bucket_keys(_vector_color_keys(page), bucket_bits))
+    except Exception:
+        return None
 
-    if not all_colors:
-        return []
+    for image_obj in page.images.values():
+        objgen = image_obj.objgen
+        cached = image_cache.get(objgen) if image_cache is not None and objgen != (0, 0) else None
+        if cached is None:
+            try:
+                keys, weight = _image_color_keys(image_obj, quality, max_image_pixels)
+            except Exception:
+                continue
+            keys, counts = count_keys(bucket_keys(keys, bucket_bits))
+            cached = (keys, counts * weight)
+            if image_cache is not None and objgen != (0, 0):
+                image_cache[objgen] = cached
+        histogram.add(*cached)
+    return histogram
 
-    # Count frequency and get the most common colors
-    color_counts = Counter(all_colors)
-    most_common = color_counts.most_common(limit)
-    
+def _canonical(obj, depth=0):
+    """JSON-able form of a PDF object with streams replaced by a hash of their raw bytes."""
+    if depth > 8:
+        return None
+    if isinstance(obj, pikepdf.Stream):
+        return 'stream:' + hashlib.sha256(obj.read_raw_bytes()).hexdigest()
+    if isinstance(obj, pikepdf.Array):
+        return [_canonical(item, depth + 1) for item in obj]
+    if isinstance(obj, pikepdf.Dictionary):
+        return {str(k): _canonical(v, depth + 1) for k, v in obj.items()}
+    return str(obj)
+
+_IMAGE_KEYS = ('/Width', '/Height', '/BitsPerComponent', '/ColorSpace', '/Filter',
+               '/DecodeParms', '/Decode', '/ImageMask')
+
+def page_cache_key(page, params, image_digests=None):
+    """
+    Content hash of everything page_color_histogram reads from a page: its
+    content streams and the data and format of its images. Object numbers are
+    not part of it, so unchanged pages keep their key across re-exports.
+    `image_digests` (a dict) memoizes image hashes by objgen within a document.
+    """
+    digest = hashlib.sha256(json.dumps([ANALYSIS_VERSION, params]).encode('utf-8'))
+    contents = page.obj.get('/Contents')
+    streams = contents if isinstance(contents, pikepdf.Array) else [contents]
+    for stream in streams:
+        if isinstance(stream, pikepdf.Stream):
+            digest.update(json.dumps([_canonical(stream.get('/Filter')), _canonical(stream.get('/DecodeParms'))]).encode('utf-8'))
+            digest.update(stream.read_raw_bytes())
+    for image_obj in page.images.values():
+        objgen = image_obj.objgen
+        image_digest = image_digests.get(objgen) if image_digests is not None else None
+        if image_digest is None:
+            header = json.dumps([_canonical(image_obj.get(k)) for k in _IMAGE_KEYS])
+            image_digest = hashlib.sha256(header.encode('utf-8') + image_obj.read_raw_bytes()).hexdigest()
+            if image_digests is not None and objgen != (0, 0):
+                image_digests[objgen] = image_digest
+        digest.update(image_digest.encode('ascii'))
+    return digest.hexdigest()
+
+def _page_arrays(page, quality, max_image_pixels, bucket_bits, image_cache):
+    histogram = page_color_histogram(page, quality, max_image_pixels, bucket_bits, image_cache)
+    return histogram.arrays() if histogram is not None else ColorHistogram().arrays()
+
+def _analyze_page_batch(pdf_path, page_indices, quality, max_image_pixels, bucket_bits):
+    """Process pool worker: opens the PDF itself and returns [(page index, keys, counts)]."""
+    image_cache = {}
+    with pikepdf.open(pdf_path) as pdf:
+        return [
+            (i, *_page_arrays(pdf.pages[i], quality, max_image_pixels, bucket_bits, image_cache))
+            for i in page_indices
+        ]
+
+def _iter_page_arrays(pdf, pdf_path, page_indices, quality, max_image_pixels, bucket_bits, page_workers,
+                      cache=None):
+    """
+    Yields (page index, keys, counts, from cache) for page_indices, in order.
+
+    With a PageHistogramCache, each page's key is computed when the page
+    comes up, so the first results do not wait for the whole document to be
+    hashed; known pages are served from the cache and the others analyzed
+    and stored. Missed pages are analyzed serially, or in batches on a
+    process pool once enough of them have queued up.
+    """
+    params = [quality, max_image_pixels, bucket_bits]
+    image_digests = {}
+    image_cache = {}
+    workers = min(page_workers, len(page_indices) // MIN_PAGES_PER_WORKER)
+    # Small batches so partial results keep flowing while later pages are analyzed.
+    chunk_size = max(1, -(-len(page_indices) // (workers * 4))) if workers > 1 else None
+
+    pool = None
+    order = deque()  # page indices not yielded yet, in document order
+    ready = {}  # page index -> (keys, counts, from cache)
+    batch = {}  # missed page index -> cache key, not submitted yet
+    submitted = deque()  # (future, {page index: cache key}), in submission order
+
+    def analyzed(i, key, keys, counts):
+        if key is not None:
+            cache.put(key, keys, counts)
+        ready[i] = (keys, counts, False)
+
+    def submit():
+        nonlocal pool
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        submitted.append((pool.submit(_analyze_page_batch, pdf_path, list(batch),
+                                      quality, max_image_pixels, bucket_bits), dict(batch)))
+        batch.clear()
+
+    def collect(block):
+        # Batches are collected in submission order, the order of their pages.
+        while submitted and (block or submitted[0][0].done()):
+            future, keys_by_page = submitted.popleft()
+            for i, keys, counts in future.result():
+                analyzed(i, keys_by_page[i], keys, counts)
+            block = False
+
+    def pop_ready():
+        while order and order[0] in ready:
+            i = order.popleft()
+            yield (i, *ready.pop(i))
+
+    try:
+        for i in page_indices:
+            order.append(i)
+            key = page_cache_key(pdf.pages[i], params, image_digests) if cache is not None else None
+            arrays = cache.get(key) if key is not None else None
+            if arrays is not None:
+                ready[i] = (*arrays, True)
+            elif chunk_size is None:
+                analyzed(i, key, *_page_arrays(pdf.pages[i], quality, max_image_pixels, bucket_bits, image_cache))
+            else:
+                batch[i] = key
+                if len(batch) >= chunk_size:
+                    submit()
+            collect(block=False)
+            yield from pop_ready()
+
+        if batch and pool is not None:
+            submit()
+        while submitted:
+            collect(block=True)
+            yield from pop_ready()
+        # Too few misses for a pool to be worth starting: analyze them here.
+        for i, key in batch.items():
+            analyzed(i, key, *_page_arrays(pdf.pages[i], quality, max_image_pixels, bucket_bits, image_cache))
+            yield from pop_ready()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def _format_colors(most_common):
     # Prepare the final data structure
     result = []
     for rgb_tuple, count in most_common:
@@ -87,5 +334,66 @@ def extract_unique_colors(pdf_path, limit=256, quality=75):
             "cmyk": cmyk_color,
             "count": count
         })
-    
-    return result
\ No newline at end of file
+    return result
+
+def iter_color_analysis(pdf_path, limit=256, quality=75, max_image_pixels=None, bucket_bits=None,
+                        max_pages=None, page_workers=ANALYSIS_WORKERS, cache=None):
+    """
+    Analyzes a PDF page by page and yields snapshots of the result so far:
+    {"colors", "pages_analyzed", "page_count", "cached_pages", "partial", "done"}.
+
+    Snapshots are yielded at most every ANALYSIS_SNAPSHOT_INTERVAL seconds; the
+    last one has done=True. Only the first `max_pages` pages are analyzed if
+    given (the result is then marked partial). With a PageHistogramCache,
+    pages whose content hash is known are not analyzed again; with
+    page_workers > 1, the other pages fan out over a process pool. Pages are
+    always merged in document order, so the colors and their order do not
+    depend on either.
+    """
+    with pikepdf.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+        pages = list(range(min(page_count, max_pages) if max_pages else page_count))
+        page_arrays = _iter_page_arrays(pdf, pdf_path, pages, quality, max_image_pixels, bucket_bits, page_workers,
+                                        cache if cache is not None and cache.enabled else None)
+
+        histogram = ColorHistogram()
+        cached_pages = 0
+        last_snapshot = time.monotonic()
+        for n, (_, keys, counts, from_cache) in enumerate(page_arrays, 1):
+            cached_pages += from_cache
+            histogram.add(keys, counts)
+
+            done = n == len(pages)
+            if done or time.monotonic() - last_snapshot >= ANALYSIS_SNAPSHOT_INTERVAL:
+                last_snapshot = time.monotonic()
+                yield {
+                    "colors": _format_colors(histogram.most_common(limit)),
+                    "pages_analyzed": n,
+                    "page_count": page_count,
+                    "cached_pages": cached_pages,
+                    "partial": len(pages) < page_count,
+                    "done": done,
+                }
+        if not pages:
+            yield {"colors": [], "pages_analyzed": 0, "page_count": page_count,
+                   "cached_pages": 0, "partial": False, "done": True}
+
+def extract_unique_colors(pdf_path, limit=256, quality=75, max_image_pixels=None, bucket_bits=None):
+    """
+    Extracts all unique colors from a PDF, sorted by frequency, and provides a default CMYK conversion.
+
+    Images are decoded at no more than `quality` pixels per side (see
+    pdf_image_decoder) and each image XObject is decoded only once.
+    `max_image_pixels` subsamples larger thumbnails deterministically and
+    `bucket_bits` (1-7) groups similar colors; both default to exact
+    counting. See iter_color_analysis for cached, parallel and partial runs.
+    """
+    try:
+        snapshot = None
+        for snapshot in iter_color_analysis(pdf_path, limit, quality, max_image_pixels, bucket_bits):
+            pass
+    except Exception as e:
+        print(f"Error opening or processing PDF {pdf_path}: {e}")
+        return []
+
+    return snapshot["colors"] if snapshot else []
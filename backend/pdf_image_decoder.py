@@ -0,0 +1,153 @@
+import io
+import zlib
+import numpy as np
+import pikepdf
+from PIL import Image
+from pikepdf import PdfImage
+
+# Channels per pixel of the color spaces sampled directly from the stream.
+_COMPONENTS = {'/DeviceGray': 1, '/DeviceRGB': 3, '/DeviceCMYK': 4}
+_PIL_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+
+# Decompressed bytes produced per zlib call while streaming a FlateDecode image.
+INFLATE_CHUNK = 1024 * 1024
+
+def _components(colorspace):
+    """Channels of a device (or ICC based) color space, or None if it needs a full decode."""
+    if isinstance(colorspace, pikepdf.Name):
+        return _COMPONENTS.get(str(colorspace))
+    if isinstance(colorspace, pikepdf.Array) and len(colorspace) == 2 and colorspace[0] == '/ICCBased':
+        n = int(colorspace[1].get('/N', 0))
+        return n if n in _PIL_MODES else None
+    return None
+
+def _palette(colorspace):
+    """(palette array, base channels) of an /Indexed color space over a device space, else None."""
+    if not (isinstance(colorspace, pikepdf.Array) and len(colorspace) == 4 and colorspace[0] == '/Indexed'):
+        return None
+    base = _components(colorspace[1])
+    if base is None:
+        return None
+    lookup = colorspace[3]
+    lookup = lookup.read_bytes() if isinstance(lookup, pikepdf.Stream) else bytes(lookup)
+    entries = int(colorspace[2]) + 1
+    palette = np.frombuffer(lookup, dtype=np.uint8)[:entries * base]
+    if len(palette) < entries * base:
+        return None
+    return palette.reshape(entries, base), base
+
+def _filters(image_obj):
+    filters = image_obj.get('/Filter')
+    if filters is None:
+        return []
+    if isinstance(filters, pikepdf.Name):
+        return [str(filters)]
+    return [str(f) for f in filters]
+
+def _has_predictor(image_obj):
+    parms = image_obj.get('/DecodeParms')
+    if isinstance(parms, pikepdf.Array):
+        parms = parms[0] if len(parms) else None
+    return isinstance(parms, pikepdf.Dictionary) and int(parms.get('/Predictor', 1)) > 1
+
+def _inflate_rows(raw, row_bytes, height, step):
+    """
+    Inflates a FlateDecode stream in bounded chunks and keeps only every
+    step-th row, so the full raster is never held in memory.
+    """
+    inflater = zlib.decompressobj()
+    data = raw
+    pending = b''
+    rows = []
+    y = 0
+    while y < height:
+        chunk = inflater.decompress(data, INFLATE_CHUNK)
+        data = inflater.unconsumed_tail
+        if not chunk:
+            if data:
+                continue
+            chunk = inflater.flush()
+            if not chunk:
+                break  # truncated stream: keep the rows we have
+        pending += chunk
+        complete = min(len(pending) // row_bytes, height - y)
+        first = -y % step
+        for i in range(first, complete, step):
+            rows.append(pending[i * row_bytes:(i + 1) * row_bytes])
+        pending = pending[complete * row_bytes:]
+        y += complete
+    return b''.join(rows)
+
+def _sample_rows(image_obj, filters, row_bytes, height, step):
+    """Every step-th row of the decoded image data, decoding as little as possible."""
+    if not filters:
+        raw = image_obj.read_raw_bytes()
+        rows = np.frombuffer(raw, dtype=np.uint8, count=min(len(raw) // row_bytes, height) * row_bytes)
+        return rows.reshape(-1, row_bytes)[::step].tobytes()
+    if filters == ['/FlateDecode'] and not _has_predictor(image_obj):
+        return _inflate_rows(image_obj.read_raw_bytes(), row_bytes, height, step)
+    # Other filter chains (predictors, LZW, RunLength, ASCII85...): qpdf decodes the
+    # whole stream, but no full-size PIL image is built.
+    data = image_obj.read_bytes()
+    rows = np.frombuffer(data, dtype=np.uint8, count=min(len(data) // row_bytes, height) * row_bytes)
+    return rows.reshape(-1, row_bytes)[::step].tobytes()
+
+def _to_rgb(pixels, components):
+    if components == 3:
+        return pixels
+    image = Image.fromarray(pixels[..., 0] if components == 1 else pixels, _PIL_MODES[components])
+    return np.asarray(image.convert('RGB'))
+
+def _decode_jpeg(raw, size):
+    pil_image = Image.open(io.BytesIO(raw))
+    # thumbnail() on an unloaded JPEG uses draft(): the DCT is scaled during decoding.
+    pil_image.thumbnail((size, size))
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return np.asarray(pil_image)
+
+def _decode_generic(image_obj, size):
+    """Full decode through PdfImage, for bit depths, color spaces and filters sampled data cannot handle."""
+    pil_image = PdfImage(image_obj).as_pil_image()
+    pil_image.thumbnail((size, size))
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return np.asarray(pil_image)
+
+def decode_image_sample(image_obj, size=75):
+    """
+    Decodes an image XObject to an RGB array of at most `size` pixels per side.
+
+    JPEG images are decoded at reduced resolution with PIL's draft mode; 8-bit
+    device, ICC based and indexed images are stride-sampled straight from the
+    (streamed) decoded data. Everything else goes through pikepdf.PdfImage.
+    Returns None for stencil masks, which carry no colors of their own.
+    """
+    if image_obj.get('/ImageMask', False):
+        return None
+
+    filters = _filters(image_obj)
+    if filters in (['/DCTDecode'], ['/JPXDecode']):
+        return _decode_jpeg(image_obj.read_raw_bytes(), size)
+
+    width, height = int(image_obj.Width), int(image_obj.Height)
+    colorspace = image_obj.get('/ColorSpace')
+    components = _components(colorspace)
+    palette = None if components else _palette(colorspace)
+    sampled = (
+        (components or palette)
+        and int(image_obj.get('/BitsPerComponent', 8)) == 8
+        and '/Decode' not in image_obj
+        and not set(filters) & {'/DCTDecode', '/JPXDecode', '/CCITTFaxDecode', '/JBIG2Decode'}
+    )
+    if not sampled:
+        return _decode_generic(image_obj, size)
+
+    channels = 1 if palette else components
+    step = max(1, -(-max(width, height) // size))
+    rows = _sample_rows(image_obj, filters, width * channels, height, step)
+    pixels = np.frombuffer(rows, dtype=np.uint8).reshape(-1, width, channels)[:, ::step]
+    if palette:
+        table, components = palette
+        pixels = table[np.minimum(pixels[..., 0], len(table) - 1)]
+    return _to_rgb(np.ascontiguousarray(pixels), components)
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+
+from disk_cache import DiskCache
+from gs_runner import run_ghostscript_cold
+from result_cache import file_sha256
+
+PREVIEW_DPI = int(os.environ.get('FIG2PDF_PREVIEW_DPI', 48))
+PREVIEW_MAX_DPI = 150
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('FIG2PDF_PREVIEW_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+# Ghostscript page renders running at once; further preview requests wait for a slot.
+PREVIEW_RENDERS = int(os.environ.get('FIG2PDF_PREVIEW_RENDERS', 2))
+PREVIEW_TIMEOUT = 60
+# Largest per-channel difference (0-255) still treated as "unchanged" in diff rasters,
+# so anti-aliasing noise does not light up every edge.
+DIFF_THRESHOLD = 8
+# Files whose hash / page sizes are remembered, by (device, inode, mtime, size).
+_FILE_MEMO_SIZE = 256
+
+
+class PreviewError(Exception):
+    """A preview cannot be produced; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def render_diff(before_png, after_png, out_path):
+    """
+    Writes a raster of where after_png differs from before_png: a faded
+    grayscale copy of the "before" page with changed pixels in red (more
+    opaque where the difference is larger). Returns the share of changed
+    pixels, which is also stored in the PNG as the "changed_ratio" text chunk.
+    """
+    from PIL import Image, ImageChops
+    from PIL.PngImagePlugin import PngInfo
+
+    with Image.open(before_png) as before_image, Image.open(after_png) as after_image:
+        before = before_image.convert('RGB')
+        after = after_image.convert('RGB')
+    if after.size != before.size:
+        after = after.resize(before.size)
+
+    red, green, blue = ImageChops.difference(before, after).split()
+    magnitude = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    alpha = magnitude.point(lambda v: 0 if v <= DIFF_THRESHOLD else min(255, 96 + 2 * v))
+    changed = sum(alpha.histogram()[1:])
+    changed_ratio = changed / (before.width * before.height)
+
+    faded = Image.blend(before.convert('L').convert('RGB'), Image.new('RGB', before.size, 'white'), 0.6)
+    result = Image.composite(Image.new('RGB', before.size, (230, 0, 0)), faded, alpha)
+    info = PngInfo()
+    info.add_text('changed_ratio', f'{changed_ratio:.6f}')
+    result.save(out_path, 'PNG', pnginfo=info)
+    return changed_ratio
+
+
+class PreviewCache(DiskCache):
+    """
+    On-disk store of low-resolution PNG renders of single PDF pages, and of
+    before/after difference rasters, keyed by file content hash, page and
+    resolution. Pages are rendered by Ghostscript on first request only, so a
+    viewer fetches just the pages it shows. Entries are evicted least
+    recently used first once the store grows past `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes=PREVIEW_CACHE_MAX_BYTES, renders=PREVIEW_RENDERS):
+        super().__init__(root, max_bytes)
+        self._render_slots = threading.BoundedSemaphore(max(1, renders))
+        self._files = OrderedDict()  # stat key -> {"sha256": ..., "pages": ...}
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + '.png')
+
+    def _file_memo(self, pdf_path):
+        st = os.stat(pdf_path)
+        stat_key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            memo = self._files.get(stat_key)
+            if memo is None:
+                memo = self._files[stat_key] = {}
+                while len(self._files) > _FILE_MEMO_SIZE:
+                    self._files.popitem(last=False)
+            self._files.move_to_end(stat_key)
+        return memo
+
+    def file_hash(self, pdf_path):
+        """SHA-256 of the file, hashed once per (inode, mtime, size)."""
+        memo = self._file_memo(pdf_path)
+        if "sha256" not in memo:
+            memo["sha256"] = file_sha256(pdf_path)
+        return memo["sha256"]
+
+    def pages(self, pdf_path):
+        """[width, height] in points of every page (rotation applied). Raises PreviewError."""
+        memo = self._file_memo(pdf_path)
+        if "pages" not in memo:
+            import pikepdf
+            sizes = []
+            try:
+                with pikepdf.open(pdf_path) as pdf:
+                    for page in pdf.pages:
+                        x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+                        width, height = round(abs(x1 - x0), 2), round(abs(y1 - y0), 2)
+                        rotate = int(page.obj.get('/Rotate', 0)) % 180
+                        sizes.append([height, width] if rotate else [width, height])
+            except pikepdf.PdfError as e:
+                raise PreviewError(f"无法读取PDF文件: {e}", status=422)
+            memo["pages"] = sizes
+        return memo["pages"]
+
+    def _check_page(self, pdf_path, page):
+        page_count = len(self.pages(pdf_path))
+        if not 1 <= page <= page_count:
+            raise PreviewError(f"页码超出范围（共 {page_count} 页）", status=404)
+
+    def _lookup(self, key):
+        path = self._path(key)
+        try:
+            os.utime(path)  # LRU bookkeeping
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return path
+
+    def _store(self, key, produce):
+        """Runs produce(tmp_path) and moves the result into place; returns its return value."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f'.tmp-{uuid.uuid4()}.png')
+        try:
+            result = produce(tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._stored(size)
+        return result
+
+    def _render(self, pdf_path, page, dpi, out_path):
+        gs_command = shutil.which('gs')
+        if not gs_command:
+            raise PreviewError("服务器未安装 Ghostscript，无法生成预览", status=503)
+        gs_options = [
+            '-dSAFER', '-dQUIET', '-sDEVICE=png16m', f'-r{dpi}',
+            f'-dFirstPage={page}', f'-dLastPage={page}',
+            '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4',
+        ]
+        with self._render_slots:
+            try:
+                run_ghostscript_cold(gs_command, gs_options, pdf_path, out_path, timeout=PREVIEW_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                raise PreviewError("生成预览超时", status=504)
+            except subprocess.CalledProcessError as e:
+                raise PreviewError(f"Ghostscript 无法渲染该页: {(e.stderr or '').strip()[-300:]}", status=422)
+        if not os.path.isfile(out_path):
+            raise PreviewError("Ghostscript 未生成预览图", status=422)
+
+    def page(self, pdf_path, page, dpi=PREVIEW_DPI):
+        """
+        (key, png_path) of page `page` (1-based) rendered at `dpi`; the key
+        identifies the content and can serve as an ETag. Raises PreviewError.
+        """
+        self._check_page(pdf_path, page)
+        payload = f'page:{self.file_hash(pdf_path)}:{page}:{dpi}'
+        key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        path = self._lookup(key)
+        if path is None:
+            self._store(key, lambda tmp_path: self._render(pdf_path, page, dpi, tmp_path))
+            path = self._path(key)
+        return key, path
+
+    def diff(self, before_pdf, after_pdf, page, dpi=PREVIEW_DPI):
+        """(key, png_path, changed_ratio) of the difference raster of one page (see render_diff)."""
+        self._check_page(after_pdf, page)
+        payload = f'diff:{self.file_hash(before_pdf)}:{self.file_hash(after_pdf)}:{page}:{dpi}:{DIFF_THRESHOLD}'
+        key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        path = self._lookup(key)
+        if path is not None:
+            from PIL import Image
+            try:
+                with Image.open(path) as image:
+                    return key, path, float(image.text.get('changed_ratio', 0))
+            except OSError:
+                pass  # Evicted meanwhile: render it again
+        _, before_png = self.page(before_pdf, page, dpi)
+        _, after_png = self.page(after_pdf, page, dpi)
+        changed_ratio = self._store(key, lambda tmp_path: render_diff(before_png, after_png, tmp_path))
+        return key, self._path(key), changed_ratio
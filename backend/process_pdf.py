@@ -3,13 +3,512 @@ import json
 import subprocess
 import shutil
 import os
+import re
+import bisect
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from os.path import abspath, dirname, join, basename
+from color_mapping import load_color_mapping
+from gs_runner import run_ghostscript
 
-def process_pdf_files(input_pdf_path, color_mapping_path, output_dir, tolerance=0.002, convert_text_to_curves=False):
-    logs = []
+DEFAULT_TOLERANCE = 0.002
+PAGE_WORKERS = int(os.environ.get('FIG2PDF_PAGE_WORKERS', 1))
+# Below this many pages per worker, process start-up costs more than it saves.
+MIN_PAGES_PER_WORKER = 8
+SAVE_MODE = os.environ.get('FIG2PDF_SAVE_MODE', 'default')  # see SAVE_OPTIONS
+INTERMEDIATE = os.environ.get('FIG2PDF_INTERMEDIATE', 'file')  # 'file' or 'memory'
+# Patch color operators in the raw stream bytes (fast_rewrite_content) and only
+# tokenize with pikepdf the streams it cannot handle; '0' always tokenizes.
+FAST_REWRITE = os.environ.get('FIG2PDF_FAST_REWRITE', '1') == '1'
+
+# pikepdf save() options of each save mode for the intermediate CMYK PDF.
+# qpdf always writes a complete file: incremental updates are not supported.
+SAVE_OPTIONS = {
+    'default': {},
+    'compact': {'object_stream_mode': pikepdf.ObjectStreamMode.generate, 'compress_streams': True},
+    'linearized': {'object_stream_mode': pikepdf.ObjectStreamMode.generate, 'compress_streams': True,
+                   'linearize': True},
+}
+
+_TARGET_LABELS = {'xobject': 'Form XObject', 'pattern': 'Pattern'}
+
+# Lines kept for the final "message"; the full log goes to the `log` callback.
+MAX_LOG_LINES = 200
+
+class LogBuffer:
+    """
+    List-like log collector. Every line is passed to `sink` as it is added,
+    but only the last `max_lines` are kept, so a job's memory use and result
+    size stay flat however many pages it logs about.
+    """
+
+    def __init__(self, sink=None, max_lines=MAX_LOG_LINES):
+        self.sink = sink
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+        if self.sink is not None:
+            self.sink(line)
+
+    def __iter__(self):
+        if self.dropped:
+            yield f"({self.dropped} earlier log lines omitted)"
+        yield from self.lines
+
+def new_rewrite_stats():
+    """
+    Accumulator for the rewrite step: seconds spent in the byte-level fast
+    path ("scan") and in the pikepdf parse / match / unparse path, operators
+    parsed by pikepdf, and streams skipped, patched by the fast path or parsed.
+    """
+    return {"scan": 0.0, "parse": 0.0, "match": 0.0, "unparse": 0.0, "operators": 0,
+            "skipped": 0, "fast": 0, "tokenized": 0}
+
+def _merge_rewrite_stats(total, stats):
+    for key, value in stats.items():
+        total[key] += value
+
+def rewrite_content_stream(content, match_color, stats=None):
+    """
+    Rewrites the RGB color operators of a content stream (anything accepted by
+    pikepdf.parse_content_stream, e.g. a page).
+
+    Returns (new_content_bytes, replacements); new_content_bytes is None when
+    nothing matched. `stats` (see new_rewrite_stats), if given, accumulates
+    the time spent parsing, matching and unparsing.
+    """
+    commands = []
+    replacements = 0
+
+    start = time.perf_counter()
+    instructions = pikepdf.parse_content_stream(content)
+    parsed = time.perf_counter()
+
+    for operands, operator in instructions:
+        op_str = str(operator)
+
+        if op_str in ('rg', 'sc', 'scn') and len(operands) >= 3:
+            r, g, b = [float(c) for c in operands[:3]]
+
+            map_cmyk = match_color(r, g, b)
+            if map_cmyk is not None:
+                new_operands = pikepdf.Array(map_cmyk)
+                new_operator = pikepdf.Operator('k') if op_str in ('sc', 'scn') else pikepdf.Operator('K')
+
+                commands.append((new_operands, new_operator))
+                replacements += 1
+            else:
+                commands.append((operands, operator))
+        else:
+            commands.append((operands, operator))
+
+    matched = time.perf_counter()
+    new_content = pikepdf.unparse_content_stream(commands) if replacements else None
+    if stats is not None:
+        stats["parse"] += parsed - start
+        stats["match"] += matched - parsed
+        stats["unparse"] += time.perf_counter() - matched
+        stats["operators"] += len(instructions)
+    return new_content, replacements
+
+# Operator tokens are delimited by whitespace, PDF delimiters or the stream ends
+# ('/' can follow an operator but never precede one: "/rg" is a name). The
+# boundary is checked after the first letter so the regex engine can jump from
+# one 'r' / 's' to the next instead of trying every position.
+_COLOR_OPERATOR_RE = re.compile(rb'(?:r(?<![^\s()<>\[\]{}%]r)g|s(?<![^\s()<>\[\]{}%]s)cn?)(?![^\s()<>\[\]{}/%])')
+
+def has_color_operators(content_bytes):
+    """Cheap byte-level check for rg/sc/scn tokens, done before any tokenization."""
+    return _COLOR_OPERATOR_RE.search(content_bytes) is not None
+
+def _content_bytes(content):
+    if isinstance(content, pikepdf.Page):
+        contents = content.obj.get('/Contents')
+        if contents is None:
+            return b''
+        if isinstance(contents, pikepdf.Array):
+            return b'\n'.join(part.read_bytes() for part in contents)
+        return contents.read_bytes()
+    return content.read_bytes()
+
+# Byte-level lexing for fast_rewrite_content. Python's \s also covers \v and not
+# NUL, so streams containing either are left to pikepdf.
+_WHITESPACE = frozenset(b' \t\n\r\x0c')
+_DELIMITERS = frozenset(b'()<>[]{}/%')
+_NUMBER_RE = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+_NUMBER_START = frozenset(b'+-.0123456789')
+# Starts of strings, hex strings, dictionaries and comments, and the inline
+# image operators BI / ID (written like _COLOR_OPERATOR_RE, for speed).
+_LEXICAL_RE = re.compile(rb'[(<%BI](?:(?<=[(<%])'
+                         rb'|(?<=B)(?<![^\s()<>\[\]{}/%]B)I(?![^\s()<>\[\]{}/%])'
+                         rb'|(?<=I)(?<![^\s()<>\[\]{}/%]I)D(?![^\s()<>\[\]{}/%]))')
+_STRING_RE = re.compile(rb'[()\\]')
+_EOL_RE = re.compile(rb'[\r\n]')
+_CMYK_OPERATORS = {b'rg': b'K', b'sc': b'k', b'scn': b'k'}
+# The common shape "<operator> r g b <color operator>", matched backwards from
+# the color operator on the reversed stream so each check is a single anchored
+# match (hence the reversed numbers and keywords). Anything else goes through
+# _operands_before.
+_WS = rb'[ \t\n\r\x0c]+'
+_REVERSED_NUMBER = rb'((?:\d*\.?\d+|\d+\.)[+-]?)'
+_REVERSED_OPERANDS_RE = re.compile(
+    _WS + _REVERSED_NUMBER + _WS + _REVERSED_NUMBER + _WS + _REVERSED_NUMBER
+    + rb'(?:' + _WS + rb'(?!(?:eurt|eslaf|llun)(?:[ \t\n\r\x0c()<>\[\]{}%]|\Z))'
+    rb'[^ \t\n\r\x0c()<>\[\]{}/%]*[^ \t\n\r\x0c()<>\[\]{}/%+\-.0-9](?=[ \t\n\r\x0c()<>\[\]{}%]|\Z)'
+    rb'|[ \t\n\r\x0c]*\Z)')
+
+def _opaque_regions(data):
+    """
+    Sorted (start, end) spans of the strings, hex strings and comments of a
+    content stream, where operator-looking bytes are not operators. None when
+    the stream has inline images or an unterminated string.
+    """
+    regions = []
+    pos = 0
+    while True:
+        m = _LEXICAL_RE.search(data, pos)
+        if m is None:
+            return regions
+        start = m.start()
+        first = data[start]
+        if first == 0x28:  # '(': literal string, with nested parentheses and escapes
+            depth = 1
+            end = m.end()
+            while depth:
+                s = _STRING_RE.search(data, end)
+                if s is None:
+                    return None
+                end = s.end()
+                if data[s.start()] == 0x5c:
+                    end += 1
+                else:
+                    depth += 1 if data[s.start()] == 0x28 else -1
+        elif first == 0x25:  # '%': comment, up to the end of the line
+            eol = _EOL_RE.search(data, start)
+            end = eol.start() if eol else len(data)
+        elif first == 0x3c:  # '<': dictionary or hex string
+            if data[start + 1:start + 2] == b'<':
+                pos = start + 2
+                continue
+            end = data.find(b'>', start)
+            if end < 0:
+                return None
+            end += 1
+        else:  # BI / ID: binary image data could hold anything
+            return None
+        regions.append((start, end))
+        pos = end
+
+def _operands_before(data, end, opaque_at):
+    """
+    (start, end, value) of the operands preceding the operator that starts at
+    `end`, nearest first; value is None for names and keywords. Returns None
+    for operand types the fast path does not handle (strings, arrays,
+    dictionaries, odd numbers), so the caller can defer to pikepdf.
+    """
+    operands = []
+    i = end - 1
+    while True:
+        while i >= 0 and data[i] in _WHITESPACE:
+            i -= 1
+        if i < 0:
+            return operands
+        region = opaque_at(i)
+        if region is not None:
+            if data[region[0]] != 0x25:
+                return None  # a string operand
+            i = region[0] - 1  # comments count as whitespace
+            continue
+        j = i
+        while j >= 0 and data[j] not in _WHITESPACE and data[j] not in _DELIMITERS:
+            j -= 1
+        token = data[j + 1:i + 1]
+        if j >= 0 and data[j] == 0x2f:  # '/': a name
+            operands.append((j, i + 1, None))
+            i = j - 1
+            continue
+        if not token or (j >= 0 and data[j] not in _WHITESPACE):
+            return None  # glued to a delimiter: "]", ">>", ...
+        if _NUMBER_RE.fullmatch(token):
+            operands.append((j + 1, i + 1, float(token)))
+        elif token[0] in _NUMBER_START:
+            return None  # e.g. "1e5" or "1.2.3": let qpdf decide what it is
+        elif token in (b'true', b'false', b'null'):
+            operands.append((j + 1, i + 1, None))
+        else:
+            return operands  # the previous operator
+        i = j
+
+def _format_number(value):
+    # Same text as pikepdf.unparse_content_stream: 6 decimals, trailing zeros trimmed.
+    text = f'{value:.6f}'.rstrip('0').rstrip('.')
+    return b'0' if text in ('', '-0') else text.encode()
+
+def fast_rewrite_content(data, match_color):
+    """
+    Rewrites the RGB color operators of decoded content stream bytes without
+    tokenizing the whole stream: finds each rg/sc/scn, reads its operands
+    backwards and patches only the matched spans, copying the rest as is.
+    Matches the same operators as rewrite_content_stream, so the result parses
+    to the same instructions.
+
+    Returns (new_content_bytes, replacements) like rewrite_content_stream, or
+    None when the stream needs the full tokenizer (inline images, strings or
+    arrays as color operands, unusual number syntax).
+    """
+    if b'\x00' in data or b'\x0b' in data:
+        return None
+    regions = _opaque_regions(data)
+    if regions is None:
+        return None
+    starts = [start for start, _ in regions]
+
+    def opaque_at(pos):
+        n = bisect.bisect_right(starts, pos) - 1
+        return regions[n] if n >= 0 and pos < regions[n][1] else None
+
+    reversed_data = data[::-1]
+    size = len(data)
+    parts = []
+    copied = 0
+    replacements = 0
+    replacement_text = {}
+    for m in _COLOR_OPERATOR_RE.finditer(data):
+        end = m.start()
+        if opaque_at(end) is not None:
+            continue
+        simple = _REVERSED_OPERANDS_RE.match(reversed_data, size - end)
+        if simple is not None and opaque_at(size - simple.end()) is None:
+            first_start = size - simple.end(3)
+            r = float(data[first_start:size - simple.start(3)])
+            g = float(data[size - simple.end(2):size - simple.start(2)])
+            b = float(data[size - simple.end(1):size - simple.start(1)])
+        else:
+            operands = _operands_before(data, end, opaque_at)
+            if operands is None:
+                return None
+            if len(operands) < 3:
+                continue
+            (first_start, _, r), (_, _, g), (_, _, b) = operands[-1], operands[-2], operands[-3]
+            if r is None or g is None or b is None:
+                return None  # rewrite_content_stream fails on these; report its error
+        map_cmyk = match_color(r, g, b)
+        if map_cmyk is None:
+            continue
+        key = (tuple(map_cmyk), m.group())
+        text = replacement_text.get(key)
+        if text is None:
+            text = replacement_text[key] = (b' '.join(_format_number(v) for v in map_cmyk)
+                                            + b' ' + _CMYK_OPERATORS[m.group()])
+        parts.append(data[copied:first_start])
+        parts.append(text)
+        copied = m.end()
+        replacements += 1
+    if not replacements:
+        return None, 0
+    parts.append(data[copied:])
+    return b''.join(parts), replacements
+
+def _page_resources(page_obj):
+    """The page's /Resources, following inheritance through the page tree."""
+    node = page_obj
+    while node is not None:
+        resources = node.get('/Resources')
+        if resources is not None:
+            return resources
+        node = node.get('/Parent')
+    return None
+
+def collect_rewrite_targets(pdf):
+    """
+    Lists every unique content stream that may carry colors, in a stable order:
+    page contents plus Form XObjects and tiling patterns reachable from page
+    resources (recursively). Each stream appears once, however many pages use it.
+
+    Returns (targets, page_aliases). Targets are picklable tuples
+    (kind, ref, page_index) with kind 'page' (ref = page index), 'xobject' or
+    'pattern' (ref = objgen). page_aliases maps a page index to the earlier
+    page whose identical /Contents it shares.
+    """
+    targets = []
+    page_aliases = {}
+    seen_contents = {}
+    seen_streams = set()
+    seen_resources = set()
+
+    for i, page in enumerate(pdf.pages):
+        contents = page.obj.get('/Contents')
+        if contents is not None:
+            if isinstance(contents, pikepdf.Array):
+                key = tuple(part.objgen for part in contents)
+            else:
+                key = (contents.objgen,)
+            if key in seen_contents and (0, 0) not in key:
+                page_aliases[i] = seen_contents[key]
+            else:
+                seen_contents[key] = i
+                targets.append(('page', i, i))
+
+        pending = [_page_resources(page.obj)]
+        while pending:
+            resources = pending.pop()
+            if not isinstance(resources, pikepdf.Dictionary):
+                continue
+            if resources.objgen != (0, 0):
+                if resources.objgen in seen_resources:
+                    continue
+                seen_resources.add(resources.objgen)
+
+            for category, kind in (('/XObject', 'xobject'), ('/Pattern', 'pattern')):
+                entries = resources.get(category)
+                if not isinstance(entries, pikepdf.Dictionary):
+                    continue
+                for _, obj in entries.items():
+                    if not isinstance(obj, pikepdf.Stream):
+                        continue
+                    if kind == 'xobject' and obj.get('/Subtype') != pikepdf.Name.Form:
+                        continue
+                    if kind == 'pattern' and obj.get('/PatternType') != 1:
+                        continue
+                    if obj.objgen in seen_streams:
+                        continue
+                    seen_streams.add(obj.objgen)
+                    targets.append((kind, obj.objgen, i))
+                    pending.append(obj.get('/Resources'))
+
+    return targets, page_aliases
+
+def _rewrite_target(pdf, target, match_color, stats):
+    kind, ref, _ = target
+    try:
+        content = pdf.pages[ref] if kind == 'page' else pdf.get_object(ref)
+        data = _content_bytes(content)
+        if not has_color_operators(data):
+            stats["skipped"] += 1
+            return target, None, 0, None
+        if FAST_REWRITE:
+            start = time.perf_counter()
+            patched = fast_rewrite_content(data, match_color)
+            stats["scan"] += time.perf_counter() - start
+            if patched is not None:
+                stats["fast"] += 1
+                return (target,) + patched + (None,)
+        stats["tokenized"] += 1
+        new_content, replacements = rewrite_content_stream(content, match_color, stats)
+        return target, new_content, replacements, None
+    except Exception as e:
+        return target, None, 0, str(e)
+
+def _rewrite_target_batch(input_pdf_path, color_mapping_path, tolerance, targets):
+    """Process pool worker: opens the PDF itself and rewrites the given targets."""
+    match_color = load_color_mapping(color_mapping_path).index(tolerance).matcher()
+    stats = new_rewrite_stats()
+    with pikepdf.open(input_pdf_path) as pdf:
+        return [_rewrite_target(pdf, target, match_color, stats) for target in targets], stats
+
+def _iter_rewrites(pdf, targets, input_pdf_path, color_mapping_path, tolerance, match_color, page_workers, progress, stats):
+    """
+    Yields (target, new_content, replacements, error) for every target, in
+    target order, so callers create the new streams in the same order (and with
+    the same object numbers) whether or not a pool was used. Step timings are
+    added to `stats`; with a pool they are summed over the workers.
+    """
+    total = len(targets)
+    workers = min(page_workers, len(pdf.pages) // MIN_PAGES_PER_WORKER)
+
+    if workers <= 1:
+        for n, target in enumerate(targets):
+            progress('rewrite', n, total)
+            yield _rewrite_target(pdf, target, match_color, stats)
+        return
+
+    # A few chunks per worker keeps the pool busy when pages differ in cost.
+    chunk_size = -(-total // (workers * 4))
+    batches = [targets[start:start + chunk_size] for start in range(0, total, chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [
+            pool.submit(_rewrite_target_batch, input_pdf_path, color_mapping_path, tolerance, batch)
+            for batch in batches
+        ]
+        progress('rewrite', 0, total)
+        done = 0
+        for future, batch in zip(futures, batches):
+            results, batch_stats = future.result()
+            _merge_rewrite_stats(stats, batch_stats)
+            yield from results
+            done += len(batch)
+            progress('rewrite', done, total)
+
+def _save_intermediate(pdf, path, save_mode, in_memory):
+    """
+    Saves the rewritten PDF with the options of `save_mode`, to `path` or,
+    in_memory, to an anonymous memfd that Ghostscript reads directly.
+    Returns (fd or None, bytes written).
+    """
+    options = SAVE_OPTIONS[save_mode]
+    if not in_memory:
+        pdf.save(path, **options)
+        return None, os.path.getsize(path)
+
+    fd = os.memfd_create('fig2pdf-cmyk')
+    try:
+        with os.fdopen(fd, 'w+b', closefd=False) as f:
+            pdf.save(f, **options)
+            return fd, f.tell()
+    except BaseException:
+        os.close(fd)
+        raise
+
+def process_pdf_files(input_pdf_path, color_mapping_path, output_dir, tolerance=DEFAULT_TOLERANCE, convert_text_to_curves=False, progress=None, log=None, page_workers=PAGE_WORKERS, save_mode=SAVE_MODE, intermediate=INTERMEDIATE):
+    """
+    Replaces mapped RGB colors with CMYK and converts the result with Ghostscript.
+
+    `progress`, if given, is called as progress(stage, current, total) while the
+    job advances (stages: 'mapping', 'rewrite', 'save', 'ghostscript'), and
+    `log(line)` receives every log line as it is produced; the returned
+    "message" only holds the last MAX_LOG_LINES lines.
+
+    With `page_workers` > 1, large documents have their pages rewritten in a
+    process pool; the output is byte-identical to the serial path.
+
+    `save_mode` picks the SAVE_OPTIONS used for the intermediate CMYK PDF
+    ('compact' adds object streams, 'linearized' also linearizes). With
+    intermediate='memory' it is never written to disk: Ghostscript reads it
+    from a memfd and no "output_cmyk_pdf" is returned. The result reports
+    the bytes written ("intermediate"), step durations in seconds
+    ("timings": mapping, open, scan, parse, match, unparse, rewrite, save,
+    ghostscript) and work done ("counters": pages, streams, streams_skipped,
+    streams_fast, streams_tokenized, operators, replacements).
+    """
+    if progress is None:
+        progress = lambda stage, current=None, total=None: None
+
+    logs = LogBuffer(log)
     success = False
     output_cmyk_pdf = None
     output_final_pdf = None
+    timings = {}
+    counters = {}
+
+    if save_mode not in SAVE_OPTIONS:
+        logs.append(f"Unknown save mode '{save_mode}', using 'default'.")
+        save_mode = 'default'
+    in_memory = intermediate == 'memory'
+    if in_memory and not hasattr(os, 'memfd_create'):
+        logs.append("In-memory intermediate needs memfd (Linux); writing it to disk instead.")
+        in_memory = False
+    if in_memory and not shutil.which('gs'):
+        # Without Ghostscript the CMYK PDF is the only output, so keep it.
+        in_memory = False
+    intermediate_fd = None
+    intermediate_info = None
 
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
@@ -22,86 +521,100 @@ def process_pdf_files(input_pdf_path, color_mapping_path, output_dir, tolerance=
     logs.append("--- Step 1: Replacing RGB with CMYK values ---")
 
     # --- Load Color Mappings ---
+    progress('mapping')
+    start = time.perf_counter()
     try:
-        with open(color_mapping_path, 'r') as f:
-            color_mappings_data = json.load(f)['mappings']
+        color_mapping = load_color_mapping(color_mapping_path)
     except FileNotFoundError:
         logs.append(f"Error: Mapping file not found at {color_mapping_path}")
         return {"success": False, "message": "\n".join(logs)}
-    except (json.JSONDecodeError, KeyError):
+    except (json.JSONDecodeError, KeyError, TypeError):
         logs.append(f"Error: Could not parse JSON or 'mappings' key not found in {color_mapping_path}")
         return {"success": False, "message": "\n".join(logs)}
 
-    rgb_to_cmyk_map = {}
-    for item in color_mappings_data:
-        rgb_key = tuple(c / 255.0 for c in item['rgb_255'])
-        cmyk_value = tuple(c / 100.0 for c in item['cmyk_100'])
-        rgb_to_cmyk_map[rgb_key] = cmyk_value
+    match_color = color_mapping.index(tolerance).matcher()
+    timings['mapping'] = round(time.perf_counter() - start, 3)
 
     logs.append("Color mappings loaded and processed.")
 
     # --- PDF Processing ---
     intermediate_file_created = False
     try:
+        start = time.perf_counter()
         with pikepdf.open(input_pdf_path) as pdf:
             logs.append(f"Successfully opened PDF: {input_pdf_path}")
             total_replacements = 0
+            targets, page_aliases = collect_rewrite_targets(pdf)
+            timings['open'] = round(time.perf_counter() - start, 3)
+            if page_workers > 1:
+                logs.append(f"Rewriting pages with up to {page_workers} worker processes.")
+
+            start = time.perf_counter()
+            rewrite_stats = new_rewrite_stats()
+            rewrites = _iter_rewrites(
+                pdf, targets, input_pdf_path, color_mapping_path, tolerance, match_color, page_workers, progress,
+                rewrite_stats
+            )
+            new_page_contents = {}
+            for (kind, ref, page_index), new_content, replacements, error in rewrites:
+                label = f"Page {ref+1}" if kind == 'page' else f"{_TARGET_LABELS[kind]} {ref[0]} {ref[1]} R (page {page_index+1})"
+                if error is not None:
+                    logs.append(f"  Could not process {label}. Error: {error}")
+                elif replacements > 0:
+                    logs.append(f"  {label}: Replaced {replacements} color definitions.")
+                    total_replacements += replacements
+                    if kind == 'page':
+                        new_page_contents[ref] = pdf.make_stream(new_content)
+                        pdf.pages[ref].Contents = new_page_contents[ref]
+                    else:
+                        # Rewritten in place, so every page using it sees the change.
+                        pdf.get_object(ref).write(new_content)
+
+            # Pages sharing an identical /Contents reuse the stream rewritten once.
+            for i, first in page_aliases.items():
+                if first in new_page_contents:
+                    pdf.pages[i].Contents = new_page_contents[first]
 
-            for i, page in enumerate(pdf.pages):
-                try:
-                    commands = []
-                    page_replacements = 0
-                    
-                    for operands, operator in pikepdf.parse_content_stream(page):
-                        op_str = str(operator)
-                        
-                        if op_str in ('rg', 'sc', 'scn') and len(operands) >= 3:
-                            r, g, b = [float(c) for c in operands[:3]]
-                            
-                            found_match = False
-                            for map_rgb, map_cmyk in rgb_to_cmyk_map.items():
-                                if (abs(r - map_rgb[0]) < tolerance and
-                                    abs(g - map_rgb[1]) < tolerance and
-                                    abs(b - map_rgb[2]) < tolerance):
-                                    
-                                    new_operands = pikepdf.Array(map_cmyk)
-                                    new_operator = pikepdf.Operator('k') if op_str in ('sc', 'scn') else pikepdf.Operator('K')
-
-                                    commands.append((new_operands, new_operator))
-                                    page_replacements += 1
-                                    found_match = True
-                                    break
-                            
-                            if not found_match:
-                                commands.append((operands, operator))
-                        else:
-                            commands.append((operands, operator))
-                    
-                    if page_replacements > 0:
-                        logs.append(f"  Page {i+1}: Replaced {page_replacements} color definitions.")
-                        total_replacements += page_replacements
-                        new_content = pikepdf.unparse_content_stream(commands)
-                        page.Contents = pdf.make_stream(new_content)
-
-                except Exception as e:
-                    logs.append(f"  Could not process page {i+1}. Error: {e}")
+            progress('rewrite', len(targets), len(targets))
+            timings['rewrite'] = round(time.perf_counter() - start, 3)
+            for step in ('scan', 'parse', 'match', 'unparse'):
+                timings[step] = round(rewrite_stats[step], 3)
+            counters = {
+                "pages": len(pdf.pages),
+                "streams": len(targets),
+                "streams_skipped": rewrite_stats["skipped"],
+                "streams_fast": rewrite_stats["fast"],
+                "streams_tokenized": rewrite_stats["tokenized"],
+                "operators": rewrite_stats["operators"],
+                "replacements": total_replacements,
+            }
 
             if total_replacements > 0:
                 logs.append(f"\nTotal replacements made: {total_replacements}")
-                pdf.save(intermediate_cmyk_pdf)
-                logs.append(f"Successfully saved intermediate PDF to: {intermediate_cmyk_pdf}")
+                progress('save')
+                start = time.perf_counter()
+                intermediate_fd, written = _save_intermediate(pdf, intermediate_cmyk_pdf, save_mode, in_memory)
+                timings['save'] = round(time.perf_counter() - start, 3)
+                intermediate_info = {"mode": save_mode, "storage": 'memory' if in_memory else 'file', "bytes": written}
+                if in_memory:
+                    logs.append(f"Saved intermediate PDF in memory: {written} bytes in {timings['save']:.2f} s ({save_mode} mode).")
+                else:
+                    logs.append(f"Successfully saved intermediate PDF to: {intermediate_cmyk_pdf}")
+                    logs.append(f"  {written} bytes written in {timings['save']:.2f} s ({save_mode} mode).")
+                    output_cmyk_pdf = intermediate_cmyk_pdf
                 intermediate_file_created = True
-                output_cmyk_pdf = intermediate_cmyk_pdf
             else:
                 logs.append("\nNo matching RGB colors found to replace. No files created.")
 
     except Exception as e:
+        if intermediate_fd is not None:
+            os.close(intermediate_fd)
         logs.append(f"An unexpected error occurred during PDF processing: {e}")
         return {"success": False, "message": "\n".join(logs)}
 
     if not intermediate_file_created:
         logs.append("No intermediate CMYK file was created, skipping final conversion.")
-        return {"success": False, "message": "\n".join(logs)}
+        return {"success": False, "message": "\n".join(logs), "timings": timings, "counters": counters}
 
     # --- Step 2: Convert to Modern Print-Ready PDF (preserving vectors) ---
     logs.append("\n--- Step 2: Converting to modern print-ready PDF ---")
@@ -110,40 +623,43 @@ def process_pdf_files(input_pdf_path, color_mapping_path, output_dir, tolerance=
     if not gs_command:
         logs.append("Warning: Ghostscript ('gs') not found in your system's PATH.")
         logs.append(f"Skipping final conversion. Your intermediate CMYK file is safe at: {intermediate_cmyk_pdf}")
-        return {"success": False, "message": "\n".join(logs), "output_cmyk_pdf": output_cmyk_pdf}
+        return {"success": False, "message": "\n".join(logs), "output_cmyk_pdf": output_cmyk_pdf,
+                "intermediate": intermediate_info, "timings": timings, "counters": counters}
 
     logs.append(f"Found Ghostscript at: {gs_command}")
-    logs.append(f"Converting '{intermediate_cmyk_pdf}' to a modern print-ready PDF (preserving vectors)...")
+    intermediate_label = "the in-memory CMYK PDF" if in_memory else f"'{intermediate_cmyk_pdf}'"
+    logs.append(f"Converting {intermediate_label} to a modern print-ready PDF (preserving vectors)...")
 
     # Ghostscript arguments - 添加文字转曲线选项
-    gs_args = [
-        gs_command,
-        '-dBATCH',
-        '-dNOPAUSE',
+    gs_options = [
         '-sDEVICE=pdfwrite',
         '-dUseCIEColor=false',  # Disable advanced color management
-        f'-sOutputFile={final_print_pdf}',
     ]
     
     # 如果启用文字转曲线，添加相应参数
     if convert_text_to_curves:
         logs.append("启用文字转曲线功能...")
-        gs_args.extend([
+        gs_options.extend([
             '-dNoOutputFonts',    # 不输出字体
             '-dConvertCMYKImagesToRGB=false',
             '-dConvertImagesToIndexed=false',
             '-dPreserveHalftoneInfo=true',
             '-dPreserveOverprintSettings=true'
         ])
-    
-    gs_args.append(intermediate_cmyk_pdf)
 
+    progress('ghostscript')
+    start = time.perf_counter()
     try:
-        process = subprocess.run(gs_args, capture_output=True, text=True, check=True)
-        logs.append("\nGhostscript conversion successful!")
+        process, used_pool = run_ghostscript(gs_command, gs_options, intermediate_cmyk_pdf, final_print_pdf,
+                                             input_fd=intermediate_fd)
+        logs.append("\nGhostscript conversion successful!" + (" (pooled interpreter)" if used_pool else ""))
         logs.append(f"Final print-ready file created at: {final_print_pdf}")
         output_final_pdf = final_print_pdf
         success = True
+    except subprocess.TimeoutExpired as e:
+        logs.append(f"\nError: Ghostscript did not finish within {e.timeout:g} seconds and was stopped.")
+        logs.append(f"The intermediate file {intermediate_label} was created but the final conversion failed.")
+        success = False
     except subprocess.CalledProcessError as e:
         logs.append("\nError: Ghostscript conversion failed.")
         logs.append(f"Return code: {e.returncode}")
@@ -151,17 +667,24 @@ def process_pdf_files(input_pdf_path, color_mapping_path, output_dir, tolerance=
         logs.append(e.stdout)
         logs.append("--- Ghostscript stderr ---")
         logs.append(e.stderr)
-        logs.append(f"The intermediate file '{intermediate_cmyk_pdf}' was created but the final conversion failed.")
+        logs.append(f"The intermediate file {intermediate_label} was created but the final conversion failed.")
         success = False
     except FileNotFoundError:
         logs.append(f"Error: Could not run Ghostscript command. Is '{gs_command}' correct?")
         success = False
+    finally:
+        timings['ghostscript'] = round(time.perf_counter() - start, 3)
+        if intermediate_fd is not None:
+            os.close(intermediate_fd)
     
     return {
         "success": success,
         "message": "\n".join(logs),
         "output_cmyk_pdf": output_cmyk_pdf,
-        "output_final_pdf": output_final_pdf
+        "output_final_pdf": output_final_pdf,
+        "intermediate": intermediate_info,
+        "timings": timings,
+        "counters": counters
     }
 
 if __name__ == '__main__':
@@ -170,6 +693,7 @@ if __name__ == '__main__':
     import sys
     if len(sys.argv) != 3:
         print("Usage: python process_pdf.py <input_pdf_path> <color_mapping_path>")
+        print("For many files, see: python batch.py --help")
         sys.exit(1)
     
     input_pdf = sys.argv[1]
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from disk_cache import DiskCache, _dir_size
+
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('FIG2PDF_RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Cached output name -> suffix used for the file placed in an upload directory
+# (matches the names process_pdf_files writes).
+RESULT_FILES = {
+    'cmyk.pdf': '_cmyk.pdf',
+    'final.pdf': '_modern_print.pdf',
+}
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystem, or links not supported.
+        shutil.copy2(src, dst)
+
+
+class ResultCache(DiskCache):
+    """
+    Content-addressed store of finished /process outputs.
+
+    An entry is keyed by hash(PDF bytes, compiled mapping hash, options) and
+    holds the intermediate CMYK PDF and the final print PDF. Hits are
+    hard-linked into the new upload directory. Entries are evicted least
+    recently used first once the store grows past `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes=RESULT_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    @staticmethod
+    def make_key(pdf_sha256, mapping_hash, convert_text_to_curves, tolerance):
+        payload = json.dumps([pdf_sha256, mapping_hash, bool(convert_text_to_curves), repr(float(tolerance))])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key, dest_dir, base_name):
+        """
+        On a hit, links the cached outputs into dest_dir as
+        '<base_name>_cmyk.pdf' / '<base_name>_modern_print.pdf' and returns
+        {cached name: destination path}. Returns None on a miss.
+        """
+        if not self.enabled:
+            return None
+        entry = self._entry_dir(key)
+        placed = {}
+        try:
+            for name in os.listdir(entry):
+                if name in RESULT_FILES:
+                    dst = os.path.join(dest_dir, base_name + RESULT_FILES[name])
+                    _link_or_copy(os.path.join(entry, name), dst)
+                    placed[name] = dst
+            os.utime(entry)  # LRU bookkeeping
+        except FileNotFoundError:
+            # Missing, or evicted while we were reading it.
+            for dst in placed.values():
+                os.remove(dst)
+            placed = {}
+
+        if not placed:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return placed
+
+    def store(self, key, files):
+        """Adds {cached name: source path} under key (no-op if already present)."""
+        if not self.enabled:
+            return
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+
+        staging = os.path.join(self.root, f'.tmp-{uuid.uuid4()}')
+        os.makedirs(staging)
+        try:
+            for name, src in files.items():
+                if src:  # e.g. no CMYK file when the intermediate stayed in memory
+                    _link_or_copy(src, os.path.join(staging, name))
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            os.rename(staging, entry)
+        except OSError:
+            # Another worker stored the same key first.
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._stored(_dir_size(entry))
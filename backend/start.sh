@@ -11,4 +11,5 @@ mkdir -p uploads
 
 # 启动Flask应用
 echo "Starting Figma2PDF Flask app on port $PORT..."
-gunicorn --bind 0.0.0.0:$PORT app:app
\ No newline at end of file
+# 预加载应用并在 fork worker 前预热（见 gunicorn.conf.py）
+exec gunicorn -c gunicorn.conf.py app:app
\ No newline at end of file
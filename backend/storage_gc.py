@@ -0,0 +1,277 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from uploads import BLOB_DIR
+
+UPLOAD_TTL_HOURS = float(os.environ.get('FIG2PDF_UPLOAD_TTL_HOURS', 7 * 24))
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get('FIG2PDF_UPLOAD_STORE_MAX_BYTES', 20 * 1024 ** 3))
+GC_INTERVAL = float(os.environ.get('FIG2PDF_GC_INTERVAL', 600))
+# Entries used more recently than this are never removed, whatever the quota:
+# they may belong to a request that is still uploading or being answered.
+GC_GRACE_SECONDS = 600
+# Directory (inside the upload folder) holding entries waiting to be deleted.
+TRASH_DIR = '.trash'
+
+
+def _scan(path):
+    """({(st_dev, st_ino): size} of the files, newest mtime) of a file or directory tree."""
+    stat = os.stat(path, follow_symlinks=False)
+    if not os.path.isdir(path):
+        return {(stat.st_dev, stat.st_ino): stat.st_size}, stat.st_mtime
+    files, newest = {}, stat.st_mtime
+    stack = [path]
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            files[(stat.st_dev, stat.st_ino)] = stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return files, newest
+
+
+def _usage(path):
+    """(bytes, newest mtime) of a file or directory tree; hard-linked files count once."""
+    files, newest = _scan(path)
+    return sum(files.values()), newest
+
+
+def _remove(path):
+    """Deletes a file or directory tree; returns whether it is gone."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+    return not os.path.lexists(path)
+
+
+def purge_trash(trash_dir, progress=None, log=None):
+    """
+    Job queue entry point: deletes a directory of discarded uploads (see
+    UploadReaper.discard_all) and reports what was reclaimed.
+    """
+    if progress is None:
+        progress = lambda stage, current=None, total=None: None
+    names = os.listdir(trash_dir) if os.path.isdir(trash_dir) else []
+    removed = reclaimed = 0
+    progress('cleanup', 0, len(names))
+    for n, name in enumerate(names, 1):
+        path = os.path.join(trash_dir, name)
+        try:
+            size, _ = _usage(path)
+        except FileNotFoundError:
+            continue
+        if _remove(path):
+            removed += 1
+            reclaimed += size
+        progress('cleanup', n, len(names))
+    shutil.rmtree(trash_dir, ignore_errors=True)
+    return {
+        "success": True,
+        "message": f"已删除 {removed} 个上传目录，释放 {reclaimed / 1024 ** 2:.1f} MB",
+        "removed": removed,
+        "bytes_reclaimed": reclaimed,
+    }
+
+
+class UploadReaper:
+    """
+    Background garbage collector for the upload folder.
+
+    Each entry (one upload_id directory) is removed once it has not been used
+    for `ttl_hours`, and least recently used entries are removed while the
+    folder is larger than `max_bytes`. "Used" is the newest mtime in the
+    entry; downloads refresh it through touch(). Entries of running jobs
+    (`is_active()` -> set of upload_ids) and entries younger than
+    GC_GRACE_SECONDS are always kept. `on_removed(upload_ids)` lets the app
+    drop the matching history rows. Deduplicated PDF copies in .blobs go
+    once no entry links to them.
+
+    A ttl or max_bytes of 0 disables that policy; an interval of 0 disables
+    the background thread (collect() can still be called directly).
+    """
+
+    def __init__(self, root, ttl_hours=UPLOAD_TTL_HOURS, max_bytes=UPLOAD_STORE_MAX_BYTES,
+                 interval=GC_INTERVAL, on_removed=None, is_active=None):
+        self.root = root
+        self.ttl = ttl_hours * 3600
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.on_removed = on_removed
+        self.is_active = is_active
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._counters = {"runs": 0, "removed": 0, "bytes_reclaimed": 0}
+        self._last_scan = {"entries": None, "bytes": None, "last_run": None, "last_run_seconds": None}
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def trash_root(self):
+        return os.path.join(self.root, TRASH_DIR)
+
+    def start(self):
+        # Started on first use rather than at import, so a preloading server
+        # master does not own the thread.
+        with self._start_lock:
+            if self._thread is None and self.interval > 0:
+                self._thread = threading.Thread(target=self._run, name='fig2pdf-upload-gc', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"[ERROR] upload cleanup failed: {e}")
+            time.sleep(self.interval)
+
+    def touch(self, upload_id):
+        """Marks an entry as used (e.g. on download)."""
+        if not upload_id or upload_id.startswith('.') or os.sep in upload_id:
+            return
+        try:
+            os.utime(os.path.join(self.root, upload_id))
+        except OSError:
+            pass
+
+    def record_reclaimed(self, removed, reclaimed):
+        with self._lock:
+            self._counters["removed"] += removed
+            self._counters["bytes_reclaimed"] += reclaimed
+            if self._last_scan["bytes"] is not None:
+                self._last_scan["bytes"] = max(0, self._last_scan["bytes"] - reclaimed)
+                self._last_scan["entries"] = max(0, self._last_scan["entries"] - removed)
+
+    def _entries(self):
+        scanned = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                files, last_used = _scan(entry.path)
+            except FileNotFoundError:
+                continue
+            scanned.append((last_used, entry.name, files))
+        # A file hard-linked into several uploads (see uploads.dedup_upload) takes its
+        # space once and is only freed with its last link, so it counts towards the
+        # most recently used upload holding it.
+        scanned.sort(reverse=True)
+        seen = set()
+        entries = []
+        for last_used, name, files in scanned:
+            entries.append((last_used, sum(size for key, size in files.items() if key not in seen), name))
+            seen.update(files)
+        return entries
+
+    def _purge_stale_trash(self, now):
+        # Trash left behind by a purge job that never ran (full queue, restart).
+        reclaimed = 0
+        if not os.path.isdir(self.trash_root):
+            return reclaimed
+        for entry in os.scandir(self.trash_root):
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime < GC_GRACE_SECONDS:
+                    continue
+                reclaimed += purge_trash(entry.path)["bytes_reclaimed"]
+            except FileNotFoundError:
+                continue
+        return reclaimed
+
+    def _purge_orphan_blobs(self, now):
+        # Stored PDF copies (see uploads.dedup_upload) no upload directory links to any more.
+        reclaimed = 0
+        blob_dir = os.path.join(self.root, BLOB_DIR)
+        if not os.path.isdir(blob_dir):
+            return reclaimed
+        for entry in os.scandir(blob_dir):
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.st_nlink <= 1 and now - stat.st_mtime >= GC_GRACE_SECONDS and _remove(entry.path):
+                reclaimed += stat.st_size
+        return reclaimed
+
+    def collect(self):
+        """One pass: expired entries first, then least recently used ones over the quota."""
+        with self._collect_lock:
+            start = time.time()
+            reclaimed = self._purge_stale_trash(start)
+            active = self.is_active() if self.is_active else set()
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            removed = []
+            for last_used, size, name in entries:
+                age = start - last_used
+                if name in active or age < GC_GRACE_SECONDS:
+                    continue
+                expired = self.ttl > 0 and age > self.ttl
+                over_quota = self.max_bytes > 0 and total > self.max_bytes
+                if not (expired or over_quota):
+                    break  # entries are oldest first: the rest are newer still
+                if _remove(os.path.join(self.root, name)):
+                    removed.append(name)
+                    total -= size
+                    reclaimed += size
+
+            if removed and self.on_removed:
+                self.on_removed(removed)
+            reclaimed += self._purge_orphan_blobs(start)
+            with self._lock:
+                self._counters["runs"] += 1
+                self._counters["removed"] += len(removed)
+                self._counters["bytes_reclaimed"] += reclaimed
+                self._last_scan = {
+                    "entries": len(entries) - len(removed),
+                    "bytes": total,
+                    "last_run": start,
+                    "last_run_seconds": round(time.time() - start, 3),
+                }
+            return {"removed": len(removed), "bytes_reclaimed": reclaimed}
+
+    def discard_all(self, keep=()):
+        """
+        Moves every entry except the upload_ids in `keep` into a new trash
+        directory and returns its path. Renames are cheap, so callers can
+        answer right away and delete the trash in the background (purge_trash).
+        """
+        trash_dir = os.path.join(self.trash_root, str(uuid.uuid4()))
+        os.makedirs(trash_dir)
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.') or entry.name in keep:
+                continue
+            try:
+                os.rename(entry.path, os.path.join(trash_dir, entry.name))
+            except FileNotFoundError:
+                pass
+        return trash_dir
+
+    def stats(self):
+        """Counters plus store size as of the last pass (scanned now if there was none)."""
+        with self._lock:
+            counters = dict(self._counters)
+            last_scan = dict(self._last_scan)
+        if last_scan["bytes"] is None:
+            entries = self._entries()
+            last_scan["entries"] = len(entries)
+            last_scan["bytes"] = sum(size for _, size, _ in entries)
+        return {
+            **counters,
+            **last_scan,
+            "ttl_hours": self.ttl / 3600,
+            "max_bytes": self.max_bytes,
+            "interval": self.interval,
+        }
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import uuid
+import zipfile
+import zlib
+from werkzeug.utils import secure_filename
+from result_cache import _link_or_copy
+
+MAX_UPLOAD_BYTES = int(os.environ.get('FIG2PDF_MAX_UPLOAD_BYTES', 512 * 1024 ** 2))
+MAX_MAPPING_BYTES = int(os.environ.get('FIG2PDF_MAX_MAPPING_BYTES', 5 * 1024 ** 2))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Limits for zip archives sent to /api/batch (guards against zip bombs).
+MAX_BATCH_FILES = int(os.environ.get('FIG2PDF_MAX_BATCH_FILES', 500))
+MAX_BATCH_UNCOMPRESSED_BYTES = int(os.environ.get('FIG2PDF_MAX_BATCH_UNCOMPRESSED_BYTES', 4 * 1024 ** 3))
+
+# The PDF header may be preceded by a little junk (PDF 32000-1, annex H.3).
+PDF_HEADER_WINDOW = 1024
+
+# Inside the upload folder: one hard-linked copy of every distinct uploaded PDF,
+# named by content hash, so repeated uploads of a file take its space once.
+BLOB_DIR = '.blobs'
+# Written next to an uploaded PDF so later requests can refer to it by upload_id.
+UPLOAD_INFO_FILENAME = 'upload.json'
+
+
+class UploadError(Exception):
+    """An upload was rejected; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def save_upload(file_storage, dest_path, max_bytes=MAX_UPLOAD_BYTES, expect_pdf=True):
+    """
+    Copies an uploaded file to dest_path in fixed-size chunks, so memory use
+    does not depend on the file size.
+
+    The PDF header is checked on the first chunk and the size limit while
+    copying, so bad uploads are rejected without being read to the end.
+    Returns (size_in_bytes, sha256_hex). Raises UploadError and removes the
+    partial file on rejection.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    stream = file_storage.stream
+    try:
+        with open(dest_path, 'wb') as out:
+            first = True
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if first:
+                    first = False
+                    if expect_pdf and b'%PDF-' not in chunk[:PDF_HEADER_WINDOW]:
+                        raise UploadError("上传的文件不是有效的PDF（缺少 %PDF- 文件头）")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f"文件过大，最大允许 {max_bytes // (1024 * 1024)} MB", status=413)
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadError("上传的文件为空")
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return size, digest.hexdigest()
+
+
+def unique_path(directory, filename):
+    """directory/filename, or directory/name_2.ext etc. if that is taken."""
+    stem, ext = os.path.splitext(filename)
+    path = os.path.join(directory, filename)
+    n = 1
+    while os.path.exists(path):
+        n += 1
+        path = os.path.join(directory, f'{stem}_{n}{ext}')
+    return path
+
+
+def extract_pdf_zip(zip_path, dest_dir, max_files=MAX_BATCH_FILES, max_bytes=MAX_BATCH_UNCOMPRESSED_BYTES):
+    """
+    Extracts the *.pdf members of a zip archive into dest_dir (flattened, with
+    sanitized unique names) and returns their paths in archive order.
+
+    The declared sizes are checked before anything is written and the actual
+    bytes while copying. Raises UploadError for bad or oversized archives.
+    """
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except (zipfile.BadZipFile, OSError):
+        raise UploadError("上传的文件不是有效的 ZIP 压缩包")
+
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith('.pdf')
+            and not info.filename.startswith('__MACOSX/')
+            and secure_filename(os.path.basename(info.filename))
+        ]
+        if not members:
+            raise UploadError("压缩包中没有 PDF 文件")
+        if len(members) > max_files:
+            raise UploadError(f"压缩包中的 PDF 文件过多，最多允许 {max_files} 个", status=413)
+        if sum(info.file_size for info in members) > max_bytes:
+            raise UploadError(f"压缩包解压后过大，最大允许 {max_bytes // (1024 * 1024)} MB", status=413)
+
+        os.makedirs(dest_dir, exist_ok=True)
+        paths = []
+        written = 0
+        for info in members:
+            path = unique_path(dest_dir, secure_filename(os.path.basename(info.filename)))
+            try:
+                with archive.open(info) as src, open(path, 'wb') as out:
+                    while True:
+                        chunk = src.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise UploadError(f"压缩包解压后过大，最大允许 {max_bytes // (1024 * 1024)} MB", status=413)
+                        out.write(chunk)
+            except (zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError) as e:
+                # Corrupt member, encrypted member, or unsupported compression.
+                raise UploadError(f"无法解压 {info.filename}: {e}")
+            paths.append(path)
+    return paths
+
+
+def dedup_upload(path, sha256, upload_root):
+    """
+    Makes `path` share its inode with the stored copy of the same content in
+    upload_root/.blobs, or makes it that stored copy if it is the first.
+    Returns whether an existing copy was reused (`path` then points to it).
+    """
+    blob_dir = os.path.join(upload_root, BLOB_DIR)
+    blob = os.path.join(blob_dir, f'{sha256}.pdf')
+    os.makedirs(blob_dir, exist_ok=True)
+    for _ in range(2):
+        try:
+            if os.stat(blob).st_size == os.stat(path).st_size:
+                if os.path.samefile(blob, path):
+                    return True
+                tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+                os.link(blob, tmp)
+                os.replace(tmp, path)
+                return True
+            os.remove(blob)  # damaged copy: replaced by this upload
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False  # no hard links here: keep the private copy
+        try:
+            os.link(path, blob)
+            return False
+        except FileExistsError:
+            continue  # stored concurrently by another request: share it
+        except OSError:
+            return False
+    return False
+
+
+def write_upload_info(upload_dir, filename, size, sha256):
+    with open(os.path.join(upload_dir, UPLOAD_INFO_FILENAME), 'w') as f:
+        json.dump({"filename": filename, "size": size, "sha256": sha256}, f)
+
+
+def find_upload(upload_root, upload_id):
+    """
+    (pdf_path, info) of the PDF stored by an earlier request as `upload_id`;
+    info has "filename", "size" and "sha256". Raises UploadError (404) if the
+    upload is unknown or has been cleaned up.
+    """
+    try:
+        upload_id = str(uuid.UUID(upload_id))
+    except (TypeError, ValueError):
+        raise UploadError("upload_id 无效")
+    upload_dir = os.path.join(upload_root, upload_id)
+    try:
+        with open(os.path.join(upload_dir, UPLOAD_INFO_FILENAME)) as f:
+            info = json.load(f)
+        pdf_path = os.path.join(upload_dir, secure_filename(info["filename"]))
+        if os.path.isfile(pdf_path):
+            return pdf_path, info
+    except (OSError, ValueError, KeyError):
+        pass
+    raise UploadError("上传的文件不存在或已过期，请重新上传", status=404)
+
+
+def upload_file_path(upload_root, upload_id, filename):
+    """
+    Path of `filename` (e.g. a conversion output) in the upload directory
+    `upload_id`. Raises UploadError (404) if it does not exist (any more).
+    """
+    try:
+        upload_id = str(uuid.UUID(upload_id))
+    except (TypeError, ValueError):
+        raise UploadError("upload_id 无效")
+    path = os.path.join(upload_root, upload_id, secure_filename(filename))
+    if filename != secure_filename(filename) or not os.path.isfile(path):
+        raise UploadError("文件不存在或已过期，请重新处理", status=404)
+    return path
+
+
+def link_upload(pdf_path, dest_dir, filename):
+    """Places an earlier upload into a new upload directory without copying its bytes."""
+    dest = os.path.join(dest_dir, filename)
+    try:
+        _link_or_copy(pdf_path, dest)
+    except FileNotFoundError:
+        raise UploadError("上传的文件不存在或已过期，请重新上传", status=404)
+    return dest
@@ -0,0 +1,43 @@
+// Streams /api/analyze-colors (NDJSON, one partial result per line) and calls
+// onSnapshot({ upload_id, colors, pages_analyzed, page_count, cached_pages, partial, done })
+// for each one. Resolves with the final snapshot; its upload_id lets /process
+// reuse the uploaded PDF.
+export async function streamColorAnalysis(file, onSnapshot = () => {}, { maxPages } = {}) {
+  const formData = new FormData()
+  formData.append('pdf_file', file)
+  formData.append('stream', 'true')
+  if (maxPages) formData.append('max_pages', maxPages)
+
+  const response = await fetch('/api/analyze-colors', { method: 'POST', body: formData })
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}))
+    throw new Error(error.message || '颜色分析失败，请检查PDF文件是否有效。')
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffered = ''
+  let last = null
+  while (true) {
+    const { value, done } = await reader.read()
+    buffered += decoder.decode(value || new Uint8Array(), { stream: !done })
+    const lines = buffered.split('\n')
+    buffered = lines.pop()
+    for (const line of lines) {
+      if (!line.trim()) continue
+      const snapshot = JSON.parse(line)
+      if (!snapshot.success) throw new Error(snapshot.message || '分析结果无效。')
+      last = snapshot
+      onSnapshot(snapshot)
+    }
+    if (done) break
+  }
+  if (!last || !last.done) throw new Error('颜色分析意外中断。')
+  return last
+}
+
+// Keeps CMYK values the user already edited (by hex) when a newer snapshot arrives.
+export function mergeAnalyzedColors(current, incoming) {
+  const edited = new Map(current.map(color => [color.hex, color.cmyk]))
+  return incoming.map(color => (edited.has(color.hex) ? { ...color, cmyk: edited.get(color.hex) } : color))
+}
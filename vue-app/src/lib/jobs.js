@@ -0,0 +1,58 @@
+const POLL_INTERVAL_MS = 1000
+
+const STAGE_LABELS = {
+  mapping: '加载颜色映射',
+  rewrite: '替换页面颜色',
+  save: '保存 CMYK 文件',
+  ghostscript: 'Ghostscript 转换',
+  batch: '批量转换文件',
+}
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms))
+
+// Human readable description of a job's current stage, e.g. "替换页面颜色 (12/40)"
+export function describeJobProgress(job) {
+  if (!job || !job.stage) return '排队中...'
+  const label = STAGE_LABELS[job.stage] || job.stage
+  const step = job.progress?.[job.stage]
+  return step && step.total ? `${label} (${step.current}/${step.total})` : label
+}
+
+// Polls /api/jobs/<jobId> until the job finishes and resolves with its result.
+// onUpdate(job) is called after every poll so callers can show progress.
+async function pollJob(jobId, onUpdate) {
+  while (true) {
+    const response = await fetch(`/api/jobs/${jobId}`)
+    if (!response.ok) throw new Error('无法获取任务状态。')
+    const job = await response.json()
+    onUpdate(job)
+
+    if (job.status === 'succeeded') return job.result
+    if (job.status === 'failed') throw new Error(job.error || '处理过程中发生未知错误。')
+    await sleep(POLL_INTERVAL_MS)
+  }
+}
+
+// Waits for a job via the /events stream (progress + log lines), falling back to
+// polling when EventSource is unavailable or the stream breaks.
+// onLog(line) receives Ghostscript/processing log lines as they are produced.
+export function waitForJob(jobId, onUpdate = () => {}, onLog = () => {}) {
+  if (typeof EventSource === 'undefined') return pollJob(jobId, onUpdate)
+
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`/api/jobs/${jobId}/events`)
+    source.addEventListener('progress', (e) => onUpdate(JSON.parse(e.data)))
+    source.addEventListener('log', (e) => onLog(JSON.parse(e.data)))
+    source.addEventListener('done', (e) => {
+      source.close()
+      const job = JSON.parse(e.data)
+      onUpdate(job)
+      if (job.status === 'succeeded') resolve(job.result)
+      else reject(new Error(job.error || '处理过程中发生未知错误。'))
+    })
+    source.onerror = () => {
+      source.close()
+      pollJob(jobId, onUpdate).then(resolve, reject)
+    }
+  })
+}